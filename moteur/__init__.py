@@ -0,0 +1,95 @@
+"""Moteur de simulation d'assurance-vie, indépendant de l'interface Streamlit."""
+from .fiscalite import (
+    BAREME_EN_VIGUEUR,
+    BAREMES,
+    BaremeFiscal,
+    DetailFiscalite,
+    calculer_fiscalite,
+    calculer_fiscalite_foyer,
+    dates_annuelles,
+    detailler_fiscalite,
+    detailler_fiscalite_primes,
+    primes_apres_70_ans,
+    rachat_brut_pour_net,
+    seuils_primes,
+    taux_primes_anciennes,
+)
+from .modeles import (
+    ABATTEMENT_COUPLE,
+    ABATTEMENT_SEUL,
+    OPTION_MOINS_8_ANS,
+    OPTION_PLUS_8_ANS,
+    Contrat,
+    ModificationVersement,
+    Objectif,
+    Parametres,
+    VersementLibre,
+    ages_annuels,
+    anciennete_contrat,
+    anciennetes_annuelles,
+    annees_ecoulees,
+)
+from .calendrier import compiler_versements, compiler_versements_libres, detecter_chevauchements
+from .simulation import (
+    COLONNES,
+    EtatAnnuel,
+    ResultatSimulation,
+    calculer_duree_capi_max,
+    calculer_duree_totale,
+    calculer_rachats,
+    simuler,
+)
+from .lot import (
+    ResultatLot,
+    etat_fin_annee,
+    par_scenario,
+    preparer_lot,
+    rachats_objectifs,
+    series_scenarios,
+    simuler_lot,
+)
+from .cache import CacheSimulations, cache_simulations, cle_scenario, simuler_en_cache
+from .solveurs import (
+    RetraitSoutenable,
+    Solution,
+    marge_financement,
+    resoudre_financement,
+    retraits_soutenables,
+)
+from .sensibilite import GrilleSensibilite, grille_sensibilite
+from .stochastique import PERCENTILES, LoiRendements, ResultatMonteCarlo, simuler_monte_carlo
+from .parallele import ResultatMonteCarloParallele, decouper, simuler_monte_carlo_parallele
+from .quantiles import SketchQuantiles, StatistiquesMonteCarlo, quantiles_monte_carlo
+from .adaptatif import EstimationFinancement, estimer_probabilite_financement
+from .historique import UNITES_RENDEMENT, ResultatBacktest, SerieHistorique, backtest_historique, charger_rendements
+from .mensuel import ResultatMensuel, echeancier_mensuel, recurrence_lineaire, simuler_mensuel
+from .incremental import MiseAJour, SimulationIncrementale, lignes_modifiees, premiere_annee_modifiee
+from .optimisation_fiscale import CalendrierRachats, optimiser_rachats
+from .registre import LOT, REPARTITION, RachatRegistre, Registre, ResultatRegistre, simuler_registre
+from .centimes import appliquer_taux, en_centimes, en_euros, simuler_centimes, simuler_lot_centimes, taux_entier
+from .supports import (
+    FONDS_EUROS,
+    REBALANCEMENTS,
+    REPARTITION_PAR_DEFAUT,
+    UNITES_DE_COMPTE,
+    ResultatSupports,
+    Support,
+    allocations_pilotees,
+    simuler_supports,
+    taux_portefeuille,
+)
+from .enveloppes import (
+    ASSURANCE_VIE,
+    CTO,
+    ENVELOPPES,
+    PEA,
+    PER,
+    REGIMES,
+    ComparaisonEnveloppes,
+    Enveloppe,
+    comparer_enveloppes,
+    fiscalite_enveloppes,
+)
+from .foyer import REPARTITIONS, ResultatFoyer, anciennetes_foyer, repartir_rachats, simuler_foyer
+from .attribution import POSTES, SERIES_ATTRIBUTION, AttributionFrais, attribution_lot, calculer_attribution
+from .tri import SERIES_RENTABILITE, Rentabilite, calculer_rentabilite, calculer_tri, rentabilite_lot
@@ -0,0 +1,145 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+from scipy import stats
+from scipy.stats import qmc
+
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre
+from .quantiles import StatistiquesMonteCarlo
+from .simulation import calculer_duree_totale
+from .stochastique import LoiRendements, simuler_monte_carlo
+from .tri import SERIES_RENTABILITE, calculer_rentabilite
+
+
+METHODES = ("sobol", "aleatoire")
+
+# Les uniformes sont bornées pour que l'inversion de la loi reste finie
+_EPSILON_UNIFORME = 1e-12
+
+
+@dataclass(frozen=True)
+class EstimationFinancement:
+    """Probabilité de financer tous les objectifs et précision atteinte.
+
+    `erreur` est la demi-largeur de l'intervalle de confiance tirée de la
+    dispersion des réplicats indépendants, ou l'écart de l'intervalle binomial de
+    Wilson sur l'ensemble des chemins quand cette dispersion est dégénérée ; `statistiques`
+    résume tous les chemins simulés (bandes de percentiles, année de ruine).
+    """
+    probabilite: float
+    erreur: float
+    nombre_chemins: int
+    replicats: np.ndarray
+    converge: bool
+    statistiques: StatistiquesMonteCarlo
+
+    @property
+    def intervalle(self):
+        return max(self.probabilite - self.erreur, 0.0), min(self.probabilite + self.erreur, 1.0)
+
+
+class _Tirage:
+    """Suite de chocs d'un réplicat : Sobol brouillé ou pseudo-aléatoire."""
+
+    def __init__(self, methode: str, loi: LoiRendements, duree: int, graine: np.random.SeedSequence):
+        self.loi = loi
+        self.duree = duree
+        if methode == "sobol":
+            self._sobol = qmc.Sobol(d=duree, scramble=True, seed=np.random.default_rng(graine))
+        else:
+            self._sobol = None
+            self._generateur = np.random.default_rng(graine)
+
+    def chocs(self, nombre: int) -> np.ndarray:
+        if self._sobol is None:
+            return self.loi.chocs(self._generateur, (nombre, self.duree))
+        # Les points suivants prolongent la suite : 2^m puis 2^m autres forment les 2^(m+1) premiers points
+        uniformes = np.clip(self._sobol.random(nombre), _EPSILON_UNIFORME, 1 - _EPSILON_UNIFORME)
+        return self.loi.chocs_depuis_uniformes(uniformes)
+
+
+def _ecart_wilson(probabilite: float, nombre_chemins: int, quantile: float) -> float:
+    """Plus grand écart entre `probabilite` et les bornes de son intervalle de Wilson.
+
+    Reste strictement positif quand tous les chemins sont financés (ou aucun) :
+    n chemins sans échec ne prouvent qu'une probabilité d'échec de l'ordre de z² / n.
+    """
+    z2 = quantile ** 2
+    centre = (probabilite + z2 / (2 * nombre_chemins)) / (1 + z2 / nombre_chemins)
+    demi_largeur = quantile / (1 + z2 / nombre_chemins) * np.sqrt(
+        probabilite * (1 - probabilite) / nombre_chemins + z2 / (4 * nombre_chemins ** 2))
+    return float(max(probabilite - (centre - demi_largeur), centre + demi_largeur - probabilite))
+
+
+def estimer_probabilite_financement(params: Parametres,
+                                    objectifs: Sequence[Objectif] = (),
+                                    modifications: Sequence[ModificationVersement] = (),
+                                    versements_libres: Sequence[VersementLibre] = (),
+                                    loi: LoiRendements = LoiRendements(),
+                                    tolerance: float = 0.005,
+                                    methode: str = "sobol",
+                                    replicats: int = 16,
+                                    chemins_initiaux: int = 256,
+                                    chemins_max: int = 2 ** 18,
+                                    niveau_confiance: float = 0.95,
+                                    graine: Optional[int] = 0) -> EstimationFinancement:
+    """Simule jusqu'à ce que l'intervalle de confiance sur la probabilité de financement soit assez étroit.
+
+    `replicats` suites indépendantes (Sobol brouillé, ou pseudo-aléatoire avec
+    `methode="aleatoire"`) sont prolongées en doublant leur nombre de points à
+    chaque tour, tant que la demi-largeur de l'intervalle de Student sur la
+    moyenne des réplicats dépasse `tolerance` et que `chemins_max` n'est pas
+    atteint. Quand les réplicats sont tous identiques (dispersion nulle, par
+    exemple tous à 100 % ou à 0 %), l'intervalle de Student est vide : il est
+    alors remplacé par l'intervalle de Wilson sur tous les chemins
+    (`_ecart_wilson`), qui exige assez de chemins pour exclure un risque de
+    l'ordre de `tolerance`. Hors de ce cas, seule la dispersion des réplicats
+    compte, ce qui conserve le gain de Sobol sur l'aléatoire. Avec Sobol, le
+    nombre de points par réplicat reste une puissance de deux, ce qui préserve
+    l'équirépartition de la suite.
+    """
+    if methode not in METHODES:
+        raise ValueError(f"Méthode inconnue : {methode!r} (attendu : {', '.join(METHODES)})")
+    if replicats < 2:
+        raise ValueError("Il faut au moins deux réplicats pour estimer l'erreur")
+    if chemins_initiaux & (chemins_initiaux - 1):
+        raise ValueError("Le nombre de chemins initiaux doit être une puissance de deux")
+
+    entrees = (params, list(objectifs), list(modifications), list(versements_libres))
+    duree = calculer_duree_totale(entrees[1])
+    tirages = [_Tirage(methode, loi, duree, graine_replicat)
+               for graine_replicat in np.random.SeedSequence(graine).spawn(replicats)]
+    quantile_student = stats.t.ppf((1 + niveau_confiance) / 2, replicats - 1)
+    quantile_normal = stats.norm.ppf((1 + niveau_confiance) / 2)
+
+    statistiques = StatistiquesMonteCarlo(duree)
+    finances = np.zeros(replicats)
+    effectif, a_tirer = 0, chemins_initiaux
+    while True:
+        for i, tirage in enumerate(tirages):
+            resultat = simuler_monte_carlo(*entrees, loi=loi, chocs=tirage.chocs(a_tirer),
+                                           conserver=("capital_debut", *SERIES_RENTABILITE))
+            finances[i] += resultat.finance.sum()
+            statistiques.ajouter(resultat, calculer_rentabilite(resultat.lot, params))
+        effectif += a_tirer
+
+        estimations = finances / effectif
+        probabilite = float(estimations.mean())
+        erreur = float(quantile_student * estimations.std(ddof=1) / np.sqrt(replicats))
+        if erreur == 0 or probabilite in (0.0, 1.0):
+            # Dispersion dégénérée : elle ne dit rien de la précision atteinte
+            erreur = _ecart_wilson(probabilite, effectif * replicats, quantile_normal)
+        converge = erreur <= tolerance
+        if converge or 2 * effectif * replicats > chemins_max:
+            break
+        a_tirer = effectif
+
+    return EstimationFinancement(
+        probabilite=probabilite,
+        erreur=erreur,
+        nombre_chemins=effectif * replicats,
+        replicats=estimations,
+        converge=converge,
+        statistiques=statistiques,
+    )
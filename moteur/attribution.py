@@ -0,0 +1,139 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .lot import par_scenario, series_scenarios
+from .modeles import Parametres
+from .simulation import PRORATA_VERSEMENTS
+
+
+# Séries du moteur nécessaires à l'attribution (à conserver dans `simuler_lot`)
+SERIES_ATTRIBUTION = ("capital_debut", "vp_net", "rendement", "frais_gestion", "capital_fin", "vp_exceptionnel", "fiscalite")
+
+# Postes de coût et leurs libellés dans l'application
+POSTES = {
+    "frais_entree_ci": "Frais d'entrée CI",
+    "frais_entree_vp": "Frais d'entrée VP",
+    "frais_gestion": "Frais de gestion",
+    "fiscalite": "Fiscalité des rachats",
+}
+
+
+@dataclass(frozen=True)
+class AttributionFrais:
+    """Écart entre la croissance brute et le résultat obtenu, ventilé par poste de coût.
+
+    `montants` et `capitalisation` sont de forme (..., postes), dans l'ordre de
+    `POSTES` : le coût payé, puis ce qu'il aurait rapporté jusqu'à la dernière
+    année s'il était resté investi au rendement brut du contrat. `capital_brut`
+    est le capital final sans frais d'entrée ni frais de gestion.
+    """
+    montants: np.ndarray
+    capitalisation: np.ndarray
+    capital_final: np.ndarray
+    capital_brut: np.ndarray
+
+    @property
+    def cout_total(self) -> np.ndarray:
+        """Coût de chaque poste à la dernière année, capitalisation comprise."""
+        return self.montants + self.capitalisation
+
+    def vers_dataframe(self) -> pd.DataFrame:
+        """Une ligne par scénario : coût payé puis coût de la capitalisation de chaque poste."""
+        montants = np.atleast_2d(self.montants)
+        capitalisation = np.atleast_2d(self.capitalisation)
+        df = pd.DataFrame({
+            "Capital final": np.atleast_1d(self.capital_final),
+            "Capital sans frais": np.atleast_1d(self.capital_brut),
+        })
+        for i, libelle in enumerate(POSTES.values()):
+            df[libelle] = montants[:, i]
+            df[f"{libelle} (capitalisation)"] = capitalisation[:, i]
+        return df
+
+
+def _attribution(resultat, capital_initial, frais_entree_ci, frais_entree_vp) -> AttributionFrais:
+    unitaire, series, duree_totale, actives = series_scenarios(resultat, SERIES_ATTRIBUTION)
+    n = len(duree_totale)
+    capital_initial = par_scenario(capital_initial, n)
+    frais_entree_ci = par_scenario(frais_entree_ci, n)
+    frais_entree_vp = par_scenario(frais_entree_vp, n)
+    # Calculs en (duree, N) : c'est la disposition en mémoire des séries de `simuler_lot`
+    series = {champ: serie.T for champ, serie in series.items()}
+    vp_net, libres = series["vp_net"], series["vp_exceptionnel"]
+    frais_gestion, fiscalite = series["frais_gestion"], series["fiscalite"]
+    derniere = (duree_totale - 1)[None, :]
+
+    # Taux brut de chaque année, lu sur les séries : le rendement rapporté au capital exposé
+    # (capital après rachat et versements du mois au prorata) ; une année sans capital ne capitalise pas
+    # (calculs en place : l'attribution doit rester négligeable devant la simulation)
+    expose = vp_net * (PRORATA_VERSEMENTS / 12)
+    expose += series["capital_debut"]
+    taux = np.divide(series["rendement"], expose, out=expose, where=expose > 0)
+    # Croissance cumulée jusqu'à chaque fin d'année : un euro retiré en fin d'année t vaut
+    # cumul[D] / cumul[t] à la dernière année D, et cumul[D] / cumul[t - 1] en début d'année
+    cumul = taux + 1
+    for t in range(1, len(cumul)):
+        # Produit cumulé ligne à ligne : bien plus rapide que np.cumprod sur l'axe des années
+        np.multiply(cumul[t - 1], cumul[t], out=cumul[t])
+    final = cumul[-1].copy() if actives is None else np.take_along_axis(cumul, derniere, axis=0)[0]
+    escompte = np.divide(1, cumul, out=cumul)
+    escompte_debut = escompte[:-1]
+    if actives is None:
+        def total(serie):
+            return serie.sum(axis=0)
+    else:
+        # Au-delà de sa propre durée, un scénario n'a plus de coûts
+        actives = actives.T
+        escompte = np.where(actives, escompte, 0.0)
+        escompte_debut = np.where(actives[1:], escompte_debut, 0.0)
+        poids = actives.astype(float)
+
+        def total(serie):
+            return np.einsum("tn,tn->n", serie, poids)
+
+    def valeur_finale(serie):
+        return final * np.einsum("tn,tn->n", serie, escompte)
+
+    # Les versements mensuels auraient rapporté leur prorata de rendement de l'année,
+    # la fiscalité (payée en début d'année) une année pleine
+    ratio_vp = np.divide(frais_entree_vp, 1 - frais_entree_vp, out=np.zeros_like(frais_entree_vp), where=frais_entree_vp < 1)
+    frais_ci = capital_initial * frais_entree_ci
+    montants = np.stack([
+        frais_ci,
+        ratio_vp * total(vp_net) + frais_entree_vp * total(libres),
+        total(frais_gestion),
+        total(fiscalite),
+    ], axis=-1)
+    valeurs = np.stack([
+        frais_ci * final,
+        ratio_vp * (valeur_finale(vp_net) + PRORATA_VERSEMENTS / 12 * valeur_finale(vp_net * taux)) + frais_entree_vp * valeur_finale(libres),
+        valeur_finale(frais_gestion),
+        final * (fiscalite[0] + np.einsum("tn,tn->n", fiscalite[1:], escompte_debut)),
+    ], axis=-1)
+
+    capital_final = series["capital_fin"][-1] if actives is None else np.take_along_axis(series["capital_fin"], derniere, axis=0)[0]
+    # La fiscalité est prélevée sur les rachats, pas sur le capital : seuls les frais l'ont réduit
+    capital_brut = capital_final + valeurs[:, :3].sum(axis=1)
+    capitalisation = valeurs - montants
+    if unitaire:
+        return AttributionFrais(montants=montants[0], capitalisation=capitalisation[0],
+                                capital_final=float(capital_final[0]), capital_brut=float(capital_brut[0]))
+    return AttributionFrais(montants=montants, capitalisation=capitalisation, capital_final=capital_final, capital_brut=capital_brut)
+
+
+def calculer_attribution(resultat, params: Parametres) -> AttributionFrais:
+    """Attribution des coûts d'une simulation (`ResultatSimulation`) ou de chemins d'un même contrat (`ResultatLot`).
+
+    Calculée sur les séries du moteur, sans nouvelle simulation : un coût retiré
+    du contrat une année aurait suivi ensuite le rendement brut de chaque année.
+    Exacte pour le moteur annuel tant que les rachats demandés sont versés en
+    totalité ; le lot doit avoir conservé les `SERIES_ATTRIBUTION`.
+    """
+    return _attribution(resultat, params.capital_initial, params.frais_entree_ci, params.frais_entree_vp)
+
+
+def attribution_lot(lot, arguments: dict) -> AttributionFrais:
+    """Attribution des coûts de chaque scénario d'un lot simulé avec les `arguments` de `preparer_lot`."""
+    return _attribution(lot, arguments["capital_initial"], arguments["frais_entree_ci"], arguments["frais_entree_vp"])
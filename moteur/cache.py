@@ -0,0 +1,146 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, fields, replace
+from datetime import date
+from typing import Sequence
+
+import numpy as np
+
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre
+from .simulation import ResultatSimulation, simuler
+
+
+def _canonique(valeur):
+    # Les nombres sont normalisés en float pour que 2000 et 2000.0 donnent la même clé
+    if isinstance(valeur, bool) or valeur is None or isinstance(valeur, str):
+        return valeur
+    if isinstance(valeur, (int, float, np.number)):
+        return float(valeur)
+    if isinstance(valeur, date):
+        return valeur.isoformat()
+    raise TypeError(f"Valeur non hachable pour le cache : {valeur!r}")
+
+
+def _entree(objet, exclure=()):
+    return {cle: _canonique(val) for cle, val in sorted(asdict(objet).items()) if cle not in exclure}
+
+
+def cle_scenario(params: Parametres,
+                 objectifs: Sequence[Objectif] = (),
+                 modifications: Sequence[ModificationVersement] = (),
+                 versements_libres: Sequence[VersementLibre] = ()) -> str:
+    """Empreinte SHA-256 de tout ce qui influence le résultat d'une simulation.
+
+    Le nom des objectifs est ignoré, et l'ordre des objectifs et des versements
+    libres n'a pas d'effet. L'ordre des modifications est conservé car la
+    première modification couvrant une année l'emporte. Sans `date_debut`, la
+    simulation part d'aujourd'hui : la date du jour entre dans la clé, l'ancienneté
+    et le seuil de primes de chaque année en dépendant.
+    """
+    params = replace(params, date_debut=params.date_debut or date.today())
+    contenu = {
+        "params": _entree(params),
+        "objectifs": sorted((_entree(obj, exclure=("nom",)) for obj in objectifs),
+                            key=lambda e: json.dumps(e, sort_keys=True)),
+        "modifications": [_entree(m) for m in modifications],
+        "versements_libres": sorted((_entree(v) for v in versements_libres),
+                                    key=lambda e: json.dumps(e, sort_keys=True)),
+    }
+    texte = json.dumps(contenu, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(texte.encode("utf-8")).hexdigest()
+
+
+def _taille_resultat(resultat: ResultatSimulation) -> int:
+    return sum(getattr(resultat, f.name).nbytes for f in fields(resultat))
+
+
+class CacheSimulations:
+    """Cache LRU de résultats, borné en nombre d'entrées et en mémoire.
+
+    Une même instance est partagée par toutes les sessions du processus :
+    les tableaux mis en cache sont donc passés en lecture seule.
+    """
+
+    def __init__(self, taille_max: int = 512, memoire_max: int = 64 * 1024 * 1024):
+        self.taille_max = taille_max
+        self.memoire_max = memoire_max
+        self._entrees = OrderedDict()
+        self._memoire = 0
+        self._verrou = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entrees)
+
+    def __contains__(self, cle):
+        return cle in self._entrees
+
+    def obtenir(self, cle: str):
+        with self._verrou:
+            resultat = self._entrees.get(cle)
+            if resultat is None:
+                self.misses += 1
+                return None
+            self._entrees.move_to_end(cle)
+            self.hits += 1
+            return resultat
+
+    def ajouter(self, cle: str, resultat: ResultatSimulation):
+        for f in fields(resultat):
+            getattr(resultat, f.name).flags.writeable = False
+        taille = _taille_resultat(resultat)
+        with self._verrou:
+            if cle in self._entrees:
+                self._memoire -= _taille_resultat(self._entrees.pop(cle))
+            self._entrees[cle] = resultat
+            self._memoire += taille
+            # Évince les entrées les moins récemment utilisées, en gardant au moins la dernière
+            while len(self._entrees) > 1 and (len(self._entrees) > self.taille_max or self._memoire > self.memoire_max):
+                _, ancien = self._entrees.popitem(last=False)
+                self._memoire -= _taille_resultat(ancien)
+                self.evictions += 1
+
+    def vider(self):
+        with self._verrou:
+            self._entrees.clear()
+            self._memoire = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def statistiques(self) -> dict:
+        with self._verrou:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "taux_hits": self.hits / total if total else 0.0,
+                "entrees": len(self._entrees),
+                "memoire": self._memoire,
+            }
+
+    def simuler(self,
+                params: Parametres,
+                objectifs: Sequence[Objectif] = (),
+                modifications: Sequence[ModificationVersement] = (),
+                versements_libres: Sequence[VersementLibre] = ()) -> ResultatSimulation:
+        cle = cle_scenario(params, objectifs, modifications, versements_libres)
+        resultat = self.obtenir(cle)
+        if resultat is None:
+            resultat = simuler(params, objectifs, modifications, versements_libres)
+            self.ajouter(cle, resultat)
+        return resultat
+
+
+# Cache partagé par toutes les sessions du serveur
+cache_simulations = CacheSimulations()
+
+
+def simuler_en_cache(params: Parametres,
+                     objectifs: Sequence[Objectif] = (),
+                     modifications: Sequence[ModificationVersement] = (),
+                     versements_libres: Sequence[VersementLibre] = ()) -> ResultatSimulation:
+    return cache_simulations.simuler(params, objectifs, modifications, versements_libres)
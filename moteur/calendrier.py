@@ -0,0 +1,47 @@
+import heapq
+from typing import Sequence
+
+import numpy as np
+
+from .modeles import ModificationVersement, VersementLibre
+
+
+def compiler_versements(versement_mensuel: float, modifications: Sequence[ModificationVersement], duree: int) -> np.ndarray:
+    """Versement mensuel de chaque année (index 0 = année 1).
+
+    Précédence : lorsque plusieurs modifications couvrent la même année, la
+    première de la liste l'emporte. Les modifications sont appliquées de la
+    dernière à la première, chacune écrasant les précédentes sur sa période.
+    """
+    versements = np.full(duree, float(versement_mensuel))
+    for modification in reversed(modifications):
+        debut, fin = max(modification.debut, 1), min(modification.fin, duree)
+        if debut <= fin:
+            versements[debut - 1:fin] = modification.montant
+    return versements
+
+
+def compiler_versements_libres(versements_libres: Sequence[VersementLibre], duree: int) -> np.ndarray:
+    """Somme des versements libres de chaque année ; ceux hors de la simulation sont ignorés."""
+    annees = np.array([versement.annee for versement in versements_libres], dtype=int)
+    montants = np.array([versement.montant for versement in versements_libres], dtype=float)
+    dans_simulation = (annees >= 1) & (annees <= duree)
+    return np.bincount(annees[dans_simulation] - 1, weights=montants[dans_simulation], minlength=duree)[:duree]
+
+
+def detecter_chevauchements(modifications: Sequence[ModificationVersement]) -> list:
+    """Paires (i, j), i < j, de modifications dont les périodes se chevauchent, chacune une seule fois.
+
+    Balayage des périodes par début croissant : seules les périodes encore
+    ouvertes au début de la suivante sont comparées, en O(n log n + paires).
+    """
+    ordre = sorted(range(len(modifications)), key=lambda i: modifications[i].debut)
+    ouvertes = []  # tas (fin, indice) des périodes pas encore terminées
+    paires = []
+    for i in ordre:
+        debut = modifications[i].debut
+        while ouvertes and ouvertes[0][0] < debut:
+            heapq.heappop(ouvertes)
+        paires.extend((min(i, j), max(i, j)) for _, j in ouvertes)
+        heapq.heappush(ouvertes, (modifications[i].fin, i))
+    return sorted(paires)
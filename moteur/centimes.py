@@ -0,0 +1,203 @@
+from typing import Sequence
+
+import numpy as np
+
+from .fiscalite import BAREME_EN_VIGUEUR, BaremeFiscal, dates_annuelles, seuils_primes
+from .lot import ResultatLot, SERIES, _par_annee, preparer_lot
+from .modeles import OPTION_MOINS_8_ANS, ModificationVersement, Objectif, Parametres, VersementLibre, anciennetes_annuelles
+from .simulation import DUREE_PAR_DEFAUT, ResultatSimulation
+
+
+# Les taux sont convertis en millionièmes : 4,5 % = 45 000
+ECHELLE = 10 ** 6
+
+# Somme des prorata (12 - mois) / 12 des versements mensuels, sous forme de fraction exacte 78 / 12
+PRORATA_NUMERATEUR, PRORATA_DENOMINATEUR = 78, 12
+
+
+def en_centimes(montant) -> np.ndarray:
+    """Montants en euros convertis en centimes entiers (demi-centime arrondi vers le haut)."""
+    return np.floor(np.asarray(montant, dtype=float) * 100 + 0.5).astype(np.int64)
+
+
+def en_euros(centimes) -> np.ndarray:
+    return np.asarray(centimes) / 100
+
+
+def taux_entier(taux) -> np.ndarray:
+    """Taux décimal converti en millionièmes entiers (au-delà de six décimales, arrondi)."""
+    return np.rint(np.asarray(taux, dtype=float) * ECHELLE).astype(np.int64)
+
+
+def appliquer_taux(montant, numerateur, denominateur: int = ECHELLE) -> np.ndarray:
+    """montant × numerateur / denominateur en centimes, demi-centime arrondi vers le haut.
+
+    Calcul entier exact : le montant est décomposé en quotient et reste de la
+    division par `denominateur`, pour que les produits restent loin de la limite
+    de l'int64 (montants jusqu'à 10^15 centimes, numérateurs jusqu'à 10^8).
+    """
+    quotient, reste = np.divmod(np.asarray(montant, dtype=np.int64), denominateur)
+    return quotient * numerateur + (reste * numerateur + denominateur // 2) // denominateur
+
+
+def arrondir(valeur) -> np.ndarray:
+    """Montant en centimes issu d'un rapport de montants (parts de plus-value, seuil de primes)."""
+    return np.floor(np.asarray(valeur, dtype=float) + 0.5).astype(np.int64)
+
+
+def fiscalite_centimes(rachat, part_plus_value, anciennete, epargne_investie, abattement,
+                       bareme: BaremeFiscal = BAREME_EN_VIGUEUR, seuil_primes=None):
+    """Prélèvements sociaux et impôt d'un rachat, en centimes, chacun arrondi séparément.
+
+    Mêmes règles que `detailler_fiscalite` ; la plus-value taxable est partagée entre
+    taux réduit et taux forfaitaire au centime le plus proche, avant application des taux.
+    """
+    imposable = (rachat > 0) & (part_plus_value > 0)
+    plus_value = np.where(imposable, part_plus_value, 0)
+    apres_seuil = np.asarray(anciennete) >= bareme.anciennete_reduite
+    seuil = en_centimes(bareme.seuil_primes if seuil_primes is None else seuil_primes)
+
+    prelevements_sociaux = appliquer_taux(plus_value, taux_entier(bareme.prelevements_sociaux))
+    taxable = np.where(apres_seuil, np.maximum(plus_value - abattement, 0), plus_value)
+    part_taux_reduit = np.where(apres_seuil, np.minimum(1.0, seuil / np.maximum(epargne_investie, seuil)), 0.0)
+    taxable_reduit = arrondir(taxable * part_taux_reduit)
+    impot = (appliquer_taux(taxable_reduit, taux_entier(bareme.taux_reduit))
+             + appliquer_taux(taxable - taxable_reduit, taux_entier(bareme.taux_forfaitaire)))
+    return prelevements_sociaux, impot
+
+
+def simuler_lot_centimes(capital_initial,
+                         versement_mensuel,
+                         rendement_annuel,
+                         frais_gestion,
+                         frais_entree_ci=0.0,
+                         frais_entree_vp=0.0,
+                         rendement_phase_rachat=None,
+                         abattement=4600,
+                         option_fiscalite=OPTION_MOINS_8_ANS,
+                         rachats=None,
+                         versements_libres=None,
+                         objectif_annee_max=None,
+                         duree_totale=None,
+                         duree: int = DUREE_PAR_DEFAUT,
+                         date_ouverture=None,
+                         date_debut=None,
+                         bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> ResultatLot:
+    """Variante exacte de `simuler_lot` : tous les montants en centimes int64.
+
+    Mêmes arguments (en euros et taux décimaux) et même résultat, séries monétaires
+    en centimes entiers ; seul `pourcentage_plus_value` reste un rapport décimal.
+    Règles d'arrondi, au centime, demi-centime vers le haut :
+    - frais d'entrée calculés sur chaque versement, le montant investi étant le
+      versement diminué des frais (versement = investi + frais, au centime près) ;
+    - rendement et frais de gestion calculés séparément sur le capital et sur les
+      versements de l'année (au prorata exact 78 / 12) ;
+    - part de plus-value d'un rachat arrondie, la part de capital étant le complément ;
+    - prélèvements sociaux et impôt arrondis séparément, le rachat net étant le complément.
+    Les taux sont lus à six décimales (`taux_entier`).
+    """
+    parametres = [capital_initial, frais_entree_ci, frais_entree_vp, rendement_annuel, rendement_phase_rachat,
+                  frais_gestion, abattement, objectif_annee_max, duree_totale,
+                  versement_mensuel, rachats, versements_libres]
+    n = max([np.shape(p)[0] for p in parametres if p is not None and np.ndim(p) >= 1] + [1])
+
+    def vecteur(valeur, defaut=None):
+        valeur = defaut if valeur is None else valeur
+        return np.broadcast_to(np.asarray(valeur, dtype=float), (n,))
+
+    def par_annee_entier(valeur, conversion):
+        return conversion(_par_annee(valeur, n, duree))
+
+    capital_initial = en_centimes(vecteur(capital_initial))
+    frais_entree_ci = taux_entier(vecteur(frais_entree_ci))
+    frais_entree_vp = taux_entier(vecteur(frais_entree_vp))
+    rendements = par_annee_entier(rendement_annuel, taux_entier)
+    rendements_phase_rachat = par_annee_entier(rendement_annuel if rendement_phase_rachat is None else rendement_phase_rachat, taux_entier)
+    frais_gestion = par_annee_entier(frais_gestion, taux_entier)
+    abattement = en_centimes(vecteur(abattement))
+    objectif_annee_max = vecteur(objectif_annee_max, duree)
+    duree_totale = vecteur(duree_totale, duree).astype(int)
+    anciennete = np.broadcast_to(anciennetes_annuelles(option_fiscalite, duree, date_ouverture, date_debut, bareme), (n, duree))
+    seuils = np.broadcast_to(seuils_primes(dates_annuelles(duree, date_debut)), (n, duree))
+
+    versements = par_annee_entier(versement_mensuel, en_centimes)
+    rachats = par_annee_entier(0.0 if rachats is None else rachats, en_centimes)
+    libres = par_annee_entier(0.0 if versements_libres is None else versements_libres, en_centimes)
+
+    capital = capital_initial - appliquer_taux(capital_initial, frais_entree_ci)
+    epargne_investie = capital_initial.copy()
+    pourcentage_precedent = np.zeros(n)
+    sorties = {champ: np.empty((duree, n), dtype=float if champ == "pourcentage_plus_value" else np.int64) for champ in SERIES}
+
+    for t in range(duree):
+        annee = t + 1
+        versement_courant = versements[:, t]
+        versement_investi = versement_courant - appliquer_taux(versement_courant, frais_entree_vp)
+        actifs = (annee <= objectif_annee_max) & (versement_courant > 0)
+
+        # Rachat plafonné au capital disponible en début d'année
+        rachat = np.minimum(rachats[:, t], capital)
+        capital = capital - rachat
+        part_plus_value = arrondir(pourcentage_precedent * rachat)
+        part_capital = rachat - part_plus_value
+
+        prelevements_sociaux, impot = fiscalite_centimes(rachat, part_plus_value, anciennete[:, t], epargne_investie, abattement,
+                                                         bareme, seuils[:, t])
+        fiscalite = prelevements_sociaux + impot
+        epargne_investie = np.where(rachat > 0, np.maximum(0, epargne_investie - part_capital), epargne_investie)
+
+        rendement = rendements[:, t]
+        taux = np.where(annee > objectif_annee_max, rendements_phase_rachat[:, t], rendement)
+        investi = np.where(actifs, versement_investi, 0)
+        vp_net = 12 * investi
+        denominateur_prorata = PRORATA_DENOMINATEUR * ECHELLE
+        rendement_total = appliquer_taux(capital, taux) + appliquer_taux(investi, PRORATA_NUMERATEUR * rendement, denominateur_prorata)
+        frais_annee = frais_gestion[:, t]
+        frais = appliquer_taux(capital, frais_annee) + appliquer_taux(investi, PRORATA_NUMERATEUR * frais_annee, denominateur_prorata)
+
+        versement_libre = libres[:, t]
+        capital_fin = capital + vp_net + rendement_total - frais + versement_libre - appliquer_taux(versement_libre, frais_entree_vp)
+        epargne_investie = epargne_investie + np.where(actifs, 12 * versement_courant, 0) + versement_libre
+
+        positif = (epargne_investie > 0) & (capital_fin > 0)
+        pourcentage = np.where(positif, 1 - epargne_investie / np.where(positif, capital_fin, 1), 0.0)
+
+        valeurs = {
+            "capital_debut": capital,
+            "vp_net": vp_net,
+            "rendement": rendement_total,
+            "frais_gestion": frais,
+            "capital_fin": capital_fin,
+            "rachat": rachat,
+            "epargne_investie": epargne_investie,
+            "vp_exceptionnel": versement_libre,
+            "part_capital": part_capital,
+            "part_plus_value": part_plus_value,
+            "fiscalite": fiscalite,
+            "pourcentage_plus_value": pourcentage,
+            "rachat_net": rachat - fiscalite,
+        }
+        for champ, sortie in sorties.items():
+            sortie[t] = valeurs[champ]
+
+        capital = capital_fin
+        pourcentage_precedent = pourcentage
+
+    return ResultatLot(
+        annee=np.arange(1, duree + 1),
+        duree_totale=duree_totale,
+        **{champ: sortie.T for champ, sortie in sorties.items()},
+    )
+
+
+def simuler_centimes(params: Parametres,
+                     objectifs: Sequence[Objectif] = (),
+                     modifications: Sequence[ModificationVersement] = (),
+                     versements_libres: Sequence[VersementLibre] = ()) -> ResultatSimulation:
+    """Simulation exacte au centime d'un scénario, montants rendus en euros à deux décimales."""
+    lot = simuler_lot_centimes(**preparer_lot([params], [list(objectifs)], [list(modifications)], [list(versements_libres)]))
+    scenario = lot.scenario(0)
+    return ResultatSimulation(**{
+        champ: valeur if champ in ("annee", "pourcentage_plus_value") else en_euros(valeur)
+        for champ, valeur in vars(scenario).items()
+    })
@@ -0,0 +1,202 @@
+from dataclasses import dataclass, replace
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .fiscalite import BAREME_EN_VIGUEUR, BaremeFiscal, calculer_fiscalite, dates_annuelles, seuils_primes
+from .lot import ResultatLot, preparer_lot, simuler_lot
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre, anciennetes_annuelles
+from .solveurs import marge_financement
+
+
+REGIMES = ("assurance_vie", "pea", "cto", "per")
+
+# Un retrait du PEA avant 5 ans est imposé au taux forfaitaire ; après, seuls les prélèvements sociaux restent dus
+DUREE_FISCALE_PEA = 5
+
+
+@dataclass(frozen=True)
+class Enveloppe:
+    """Enveloppe d'investissement : régime fiscal des rachats, frais et règles de blocage.
+
+    Les frais laissés à None reprennent ceux des paramètres du plan. Le cumul des
+    versements bruts est plafonné à `plafond_versements` (l'excédent n'est pas
+    versé) et aucun rachat n'est possible pendant les `blocage` premières années.
+    """
+    nom: str
+    regime: str
+    frais_entree_ci: Optional[float] = None
+    frais_entree_vp: Optional[float] = None
+    frais_gestion: Optional[float] = None
+    plafond_versements: float = np.inf
+    blocage: int = 0
+
+    def __post_init__(self):
+        if self.regime not in REGIMES:
+            raise ValueError(f"Régime fiscal inconnu : {self.regime!r} (attendu : {', '.join(REGIMES)})")
+
+
+ASSURANCE_VIE = Enveloppe("Assurance-vie", "assurance_vie")
+PEA = Enveloppe("PEA", "pea", frais_entree_ci=0.0, frais_entree_vp=0.0, frais_gestion=0.002, plafond_versements=150_000)
+CTO = Enveloppe("Compte-titres", "cto", frais_entree_ci=0.0, frais_entree_vp=0.0, frais_gestion=0.002)
+# Le PER est bloqué jusqu'à la retraite : `annee_retraite` de `comparer_enveloppes` fixe son blocage
+PER = Enveloppe("PER", "per")
+ENVELOPPES = (ASSURANCE_VIE, PEA, CTO, PER)
+
+
+def fiscalite_enveloppes(regimes,
+                         rachat,
+                         part_plus_value,
+                         part_capital,
+                         annee,
+                         anciennete,
+                         epargne_investie,
+                         abattement,
+                         taux_marginal: float = 0.30,
+                         bareme: BaremeFiscal = BAREME_EN_VIGUEUR,
+                         seuil_primes=None) -> np.ndarray:
+    """Fiscalité des rachats de chaque enveloppe, tableaux de forme (enveloppes, années).
+
+    `regimes` et `abattement` sont donnés par enveloppe, `anciennete` (assurance-vie)
+    par enveloppe ou par enveloppe et par année ; `epargne_investie` est celle d'avant le rachat. Sortie du PER : la part de capital
+    est imposée au barème de l'impôt sur le revenu (`taux_marginal`), la plus-value
+    au taux forfaitaire ; au PEA comme au compte-titres, la plus-value seule est imposée.
+    """
+    regimes = np.asarray(regimes)[:, None]
+    anciennete = np.asarray(anciennete)
+    if anciennete.ndim == 1:
+        anciennete = anciennete[:, None]
+    forfaitaire = part_plus_value * (bareme.prelevements_sociaux + bareme.taux_forfaitaire)
+    assurance_vie = calculer_fiscalite(rachat, part_plus_value, anciennete, epargne_investie,
+                                       np.asarray(abattement)[:, None], bareme, seuil_primes)
+    pea = part_plus_value * (bareme.prelevements_sociaux + bareme.taux_forfaitaire * (annee <= DUREE_FISCALE_PEA))
+    per = forfaitaire + part_capital * taux_marginal
+    return np.select([regimes == "assurance_vie", regimes == "pea", regimes == "per"], [assurance_vie, pea, per], forfaitaire)
+
+
+def _plafonner_versements(capital_initial, versements, libres, objectif_annee_max, plafond):
+    # Le capital initial compte parmi les versements de la première année ; l'excédent au plafond est retiré
+    annees = np.arange(1, versements.shape[1] + 1)
+    actifs = (annees <= objectif_annee_max[:, None]) & (versements > 0)
+    annuels = np.where(actifs, 12 * versements, 0.0) + libres
+    annuels[:, 0] += capital_initial
+    autorises = np.diff(np.minimum(np.cumsum(annuels, axis=1), plafond[:, None]), axis=1, prepend=0.0)
+    ratio = np.divide(autorises, annuels, out=np.ones_like(annuels), where=annuels > 0)
+    return capital_initial * ratio[:, 0], versements * ratio, libres * ratio, annuels * ratio
+
+
+@dataclass(frozen=True)
+class ComparaisonEnveloppes:
+    """Un même plan simulé dans plusieurs enveloppes : une ligne de `lot` par enveloppe."""
+    enveloppes: tuple
+    lot: ResultatLot
+    fiscalite: np.ndarray
+    economie_impot: np.ndarray
+    capital_net: np.ndarray
+    rachats_demandes: np.ndarray
+    rachats_bloques: np.ndarray
+
+    def __len__(self):
+        return len(self.enveloppes)
+
+    @property
+    def rachat_net(self) -> np.ndarray:
+        return self.lot.rachat - self.fiscalite
+
+    @property
+    def finance(self) -> np.ndarray:
+        """Enveloppes dans lesquelles tous les rachats demandés ont été versés en totalité."""
+        disponible = np.where(self.rachats_bloques, 0.0, self.lot.capital_debut + self.lot.rachat)
+        return marge_financement(disponible, self.rachats_demandes) >= 0
+
+    def vers_dataframe(self) -> pd.DataFrame:
+        """Synthèse par enveloppe."""
+        return pd.DataFrame({
+            "Enveloppe": [enveloppe.nom for enveloppe in self.enveloppes],
+            "Capital final": self.lot.capital_fin[:, -1],
+            "Capital final net d'impôt": self.capital_net,
+            "Rachats nets perçus": self.rachat_net.sum(axis=1),
+            "Fiscalité des rachats": self.fiscalite.sum(axis=1),
+            "Frais de gestion": self.lot.frais_gestion.sum(axis=1),
+            "Économie d'impôt à l'entrée": self.economie_impot.sum(axis=1),
+            "Objectifs financés": self.finance,
+            "Rachats bloqués": [f"Jusqu'à l'année {e.blocage}" if e.blocage else "Non" for e in self.enveloppes],
+        })
+
+
+def comparer_enveloppes(params: Parametres,
+                        objectifs: Sequence[Objectif] = (),
+                        modifications: Sequence[ModificationVersement] = (),
+                        versements_libres: Sequence[VersementLibre] = (),
+                        enveloppes: Sequence[Enveloppe] = ENVELOPPES,
+                        taux_marginal: float = 0.30,
+                        annee_retraite: Optional[int] = None,
+                        bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> ComparaisonEnveloppes:
+    """Simule le même plan de versements et de rachats dans chaque enveloppe, en un seul passage.
+
+    L'échéancier est compilé une fois puis décliné par enveloppe (frais, plafond de
+    versements, années bloquées) ; `simuler_lot` avance toutes les enveloppes
+    ensemble, la fiscalité propre à chacune étant calculée ensuite sur les séries.
+    Les versements au PER sont déduits du revenu imposable au `taux_marginal`
+    (plafond de déduction non modélisé). `capital_net` est le capital final diminué
+    de l'impôt qu'entraînerait son rachat total. Avec `annee_retraite`, les PER
+    sont bloqués jusqu'à cette année incluse ; sans elle, ils gardent leur propre
+    `blocage` (aucun pour `PER`), indiqué dans la synthèse.
+    """
+    enveloppes = tuple(enveloppes)
+    if annee_retraite is not None:
+        enveloppes = tuple(replace(e, blocage=annee_retraite) if e.regime == "per" else e for e in enveloppes)
+    n = len(enveloppes)
+    arguments = preparer_lot([params] * n, [list(objectifs)] * n, [list(modifications)] * n, [list(versements_libres)] * n)
+    duree = arguments["duree"]
+
+    def par_enveloppe(champ):
+        return np.array([arguments[champ][i] if getattr(e, champ) is None else getattr(e, champ)
+                         for i, e in enumerate(enveloppes)], dtype=float)
+
+    capital_initial, versements, libres, versements_bruts = _plafonner_versements(
+        arguments["capital_initial"], arguments["versement_mensuel"], arguments["versements_libres"],
+        arguments["objectif_annee_max"], np.array([e.plafond_versements for e in enveloppes], dtype=float))
+    annee = np.arange(1, duree + 1)
+    bloques = annee <= np.array([e.blocage for e in enveloppes])[:, None]
+    rachats_demandes = arguments["rachats"]
+    arguments.update(
+        capital_initial=capital_initial,
+        versement_mensuel=versements,
+        versements_libres=libres,
+        rachats=np.where(bloques, 0.0, rachats_demandes),
+        frais_entree_ci=par_enveloppe("frais_entree_ci"),
+        frais_entree_vp=par_enveloppe("frais_entree_vp"),
+        frais_gestion=par_enveloppe("frais_gestion"),
+    )
+    lot = simuler_lot(**arguments)
+
+    regimes = [e.regime for e in enveloppes]
+    # Ancienneté et seuil de primes de chaque année, et de l'année qui suit pour le rachat final
+    anciennete = anciennetes_annuelles(arguments["option_fiscalite"], duree + 1, arguments["date_ouverture"],
+                                       arguments["date_debut"], bareme)
+    seuils = seuils_primes(dates_annuelles(duree + 1, arguments["date_debut"]))
+    abattement = arguments["abattement"]
+    epargne_avant_rachat = np.concatenate([capital_initial[:, None], lot.epargne_investie[:, :-1]], axis=1)
+    fiscalite = fiscalite_enveloppes(regimes, lot.rachat, lot.part_plus_value, lot.part_capital, annee,
+                                     anciennete[:, :duree], epargne_avant_rachat, abattement, taux_marginal, bareme,
+                                     seuils[..., :duree])
+
+    # Rachat total à la fin de la dernière année
+    capital_final = lot.capital_fin[:, -1:]
+    plus_value_finale = np.maximum(capital_final - lot.epargne_investie[:, -1:], 0.0)
+    impot_final = fiscalite_enveloppes(regimes, capital_final, plus_value_finale, capital_final - plus_value_finale,
+                                       np.array([duree + 1]), anciennete[:, duree:], lot.epargne_investie[:, -1:], abattement,
+                                       taux_marginal, bareme, seuils[..., duree:])
+
+    per = np.array(regimes)[:, None] == "per"
+    return ComparaisonEnveloppes(
+        enveloppes=enveloppes,
+        lot=lot,
+        fiscalite=fiscalite,
+        economie_impot=np.where(per, versements_bruts * taux_marginal, 0.0),
+        capital_net=(capital_final - impot_final)[:, 0],
+        rachats_demandes=rachats_demandes,
+        rachats_bloques=bloques & (rachats_demandes > 0),
+    )
@@ -0,0 +1,261 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import Tuple
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class BaremeFiscal:
+    """Règles d'imposition des rachats d'assurance-vie en vigueur à partir de `en_vigueur`.
+
+    Les taux sont en décimal. Après `anciennete_reduite` ans de contrat, la
+    plus-value au-delà de l'abattement annuel est imposée à `taux_reduit` pour la
+    part des primes inférieure à `seuil_primes`, et à `taux_forfaitaire` au-delà ;
+    avant, toute la plus-value est imposée à `taux_forfaitaire`. Les prélèvements
+    sociaux s'appliquent dans tous les cas, sans abattement.
+
+    La plus-value des primes versées avant `date_reforme` garde l'ancien régime :
+    `taux_primes_anciennes` associe à chaque ancienneté minimale du contrat son taux.
+
+    Les primes versées après `age_limite_primes` ans de l'assuré relèvent, au décès,
+    des droits de succession au-delà de `abattement_primes_apres_70_ans` (tous
+    contrats confondus).
+    """
+    version: str
+    en_vigueur: date
+    prelevements_sociaux: float
+    taux_forfaitaire: float
+    taux_reduit: float
+    seuil_primes: float
+    anciennete_reduite: int
+    abattement_seul: float
+    abattement_couple: float
+    date_reforme: date
+    taux_primes_anciennes: Tuple[Tuple[int, float], ...]
+    age_limite_primes: int
+    abattement_primes_apres_70_ans: float
+
+
+# Une nouvelle loi de finances se traduit par une nouvelle ligne, sans toucher aux moteurs
+BAREMES = {
+    bareme.version: bareme
+    for bareme in (
+        BaremeFiscal(
+            version="2018",
+            en_vigueur=date(2018, 1, 1),
+            prelevements_sociaux=0.172,
+            taux_forfaitaire=0.128,
+            taux_reduit=0.075,
+            seuil_primes=150000,
+            anciennete_reduite=8,
+            abattement_seul=4600,
+            abattement_couple=9200,
+            date_reforme=date(2017, 9, 27),
+            taux_primes_anciennes=((0, 0.35), (4, 0.15), (8, 0.075)),
+            age_limite_primes=70,
+            abattement_primes_apres_70_ans=30500,
+        ),
+    )
+}
+
+BAREME_EN_VIGUEUR = max(BAREMES.values(), key=lambda bareme: bareme.en_vigueur)
+
+
+def ajouter_mois(jour, mois) -> np.ndarray:
+    """Même jour du mois, `mois` mois plus tard (dernier jour du mois si ce jour n'existe pas)."""
+    jour = np.asarray(jour, dtype="datetime64[D]")
+    debut_mois = jour.astype("datetime64[M]")
+    decalage = jour - debut_mois.astype("datetime64[D]")
+    cibles = debut_mois + np.asarray(mois)
+    fin = (cibles + 1).astype("datetime64[D]")
+    return np.minimum(cibles.astype("datetime64[D]") + decalage, fin - 1)
+
+
+def dates_annuelles(duree: int, date_debut=None) -> np.ndarray:
+    """Date de début de chaque année simulée, de forme (..., duree), la simulation partant de
+    `date_debut` (aujourd'hui par défaut ; une date ou un tableau de dates)."""
+    debut = np.asarray(date.today() if date_debut is None else date_debut, dtype="datetime64[D]")
+    return ajouter_mois(debut[..., None], 12 * np.arange(duree))
+
+
+def seuils_primes(jours) -> np.ndarray:
+    """Seuil de primes du taux réduit du barème en vigueur à chaque date de `jours`.
+
+    Une loi de finances qui modifie le seuil s'applique ainsi aux rachats des années
+    suivantes d'une même simulation. Avant le premier barème, le plus ancien s'applique.
+    """
+    baremes = sorted(BAREMES.values(), key=lambda bareme: bareme.en_vigueur)
+    entrees = np.array([bareme.en_vigueur for bareme in baremes], dtype="datetime64[D]")
+    indices = np.maximum(np.searchsorted(entrees, np.asarray(jours, dtype="datetime64[D]"), side="right") - 1, 0)
+    return np.array([bareme.seuil_primes for bareme in baremes], dtype=float)[indices]
+
+
+def primes_apres_70_ans(versements, age, bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> np.ndarray:
+    """Cumul des primes versées après `age_limite_primes` ans, de même forme que `versements`.
+
+    `versements` sont les primes brutes de chaque année et `age` l'âge de l'assuré
+    en début d'année (NaN s'il est inconnu) ; l'année du 70e anniversaire, seule la
+    part des mois qui le suivent est comptée.
+    """
+    part_apres = np.clip(np.nan_to_num(np.asarray(age, dtype=float) + 1 - bareme.age_limite_primes, nan=0.0), 0.0, 1.0)
+    return np.cumsum(np.asarray(versements, dtype=float) * part_apres, axis=-1)
+
+
+@dataclass(frozen=True)
+class DetailFiscalite:
+    """Décomposition de la fiscalité de chaque rachat, tableaux de même forme que les entrées."""
+    prelevements_sociaux: np.ndarray
+    impot: np.ndarray
+    abattement_utilise: np.ndarray
+    part_taux_reduit: np.ndarray
+
+    @property
+    def total(self) -> np.ndarray:
+        return self.prelevements_sociaux + self.impot
+
+
+def detailler_fiscalite(rachat,
+                        part_plus_value,
+                        anciennete,
+                        epargne_investie,
+                        abattement,
+                        bareme: BaremeFiscal = BAREME_EN_VIGUEUR,
+                        seuil_primes=None) -> DetailFiscalite:
+    """Fiscalité de rachats donnés sous forme de tableaux (lignes, scénarios… diffusés entre eux).
+
+    `anciennete` est l'âge du contrat en années au moment du rachat, éventuellement
+    différent chaque année ; `epargne_investie` le total des primes versées, qui
+    fixe la part de la plus-value éligible au taux réduit ; `abattement`
+    l'abattement annuel disponible. `seuil_primes` remplace, par exemple année par
+    année (`seuils_primes`), le seuil du barème. `part_taux_reduit` est la fraction
+    de la plus-value taxable imposée au taux réduit.
+    """
+    seuil = bareme.seuil_primes if seuil_primes is None else np.asarray(seuil_primes, dtype=float)
+    rachat = np.asarray(rachat, dtype=float)
+    part_plus_value = np.asarray(part_plus_value, dtype=float)
+    epargne_investie = np.asarray(epargne_investie, dtype=float)
+    imposable = (rachat > 0) & (part_plus_value > 0)
+    plus_value = np.where(imposable, part_plus_value, 0.0)
+    apres_seuil = np.asarray(anciennete) >= bareme.anciennete_reduite
+
+    abattement_utilise = np.where(apres_seuil, np.minimum(plus_value, abattement), 0.0)
+    part_taux_reduit = np.where(
+        apres_seuil,
+        np.minimum(1.0, seuil / np.maximum(epargne_investie, seuil)),
+        0.0,
+    )
+    taux_impot = part_taux_reduit * bareme.taux_reduit + (1 - part_taux_reduit) * bareme.taux_forfaitaire
+    return DetailFiscalite(
+        prelevements_sociaux=plus_value * bareme.prelevements_sociaux,
+        impot=(plus_value - abattement_utilise) * taux_impot,
+        abattement_utilise=abattement_utilise,
+        part_taux_reduit=part_taux_reduit,
+    )
+
+
+def taux_primes_anciennes(anciennete, bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> np.ndarray:
+    """Taux d'impôt de la plus-value des primes antérieures à la réforme, selon l'ancienneté du contrat."""
+    seuils, taux = zip(*bareme.taux_primes_anciennes)
+    return np.asarray(taux)[np.searchsorted(seuils, anciennete, side="right") - 1]
+
+
+def detailler_fiscalite_primes(plus_value_anciennes,
+                               plus_value_nouvelles,
+                               primes_anciennes,
+                               primes_nouvelles,
+                               anciennete,
+                               abattement,
+                               bareme: BaremeFiscal = BAREME_EN_VIGUEUR,
+                               seuil_primes=None) -> DetailFiscalite:
+    """Fiscalité de rachats dont la plus-value est ventilée entre primes anciennes et nouvelles.
+
+    Les primes anciennes sont celles versées avant `date_reforme`. Leur plus-value
+    est imposée selon `taux_primes_anciennes` et absorbe l'abattement en premier.
+    Le seuil de primes du taux réduit est diminué des primes anciennes encore
+    investies. Sans primes anciennes, identique à `detailler_fiscalite`.
+    """
+    plus_value_anciennes = np.maximum(np.asarray(plus_value_anciennes, dtype=float), 0.0)
+    plus_value_nouvelles = np.maximum(np.asarray(plus_value_nouvelles, dtype=float), 0.0)
+    primes_nouvelles = np.asarray(primes_nouvelles, dtype=float)
+    apres_seuil = np.asarray(anciennete) >= bareme.anciennete_reduite
+
+    abattement_anciennes = np.where(apres_seuil, np.minimum(plus_value_anciennes, abattement), 0.0)
+    abattement_nouvelles = np.where(apres_seuil, np.minimum(plus_value_nouvelles, abattement - abattement_anciennes), 0.0)
+    seuil = bareme.seuil_primes if seuil_primes is None else np.asarray(seuil_primes, dtype=float)
+    seuil_restant = np.maximum(seuil - np.asarray(primes_anciennes, dtype=float), 0.0)
+    depasse = primes_nouvelles > seuil_restant
+    part_taux_reduit = np.where(
+        apres_seuil,
+        np.where(depasse, seuil_restant / np.where(depasse, primes_nouvelles, 1.0), 1.0),
+        0.0,
+    )
+    taux_nouvelles = part_taux_reduit * bareme.taux_reduit + (1 - part_taux_reduit) * bareme.taux_forfaitaire
+    return DetailFiscalite(
+        prelevements_sociaux=(plus_value_anciennes + plus_value_nouvelles) * bareme.prelevements_sociaux,
+        impot=((plus_value_anciennes - abattement_anciennes) * taux_primes_anciennes(anciennete, bareme)
+               + (plus_value_nouvelles - abattement_nouvelles) * taux_nouvelles),
+        abattement_utilise=abattement_anciennes + abattement_nouvelles,
+        part_taux_reduit=part_taux_reduit,
+    )
+
+
+def calculer_fiscalite(rachat, part_plus_value, anciennete, epargne_investie, abattement,
+                       bareme: BaremeFiscal = BAREME_EN_VIGUEUR, seuil_primes=None) -> np.ndarray:
+    """Montant total prélevé sur chaque rachat (prélèvements sociaux et impôt)."""
+    return detailler_fiscalite(rachat, part_plus_value, anciennete, epargne_investie, abattement, bareme, seuil_primes).total
+
+
+def rachat_brut_pour_net(rachat_net, pourcentage_plus_value, anciennete, epargne_investie, abattement,
+                         bareme: BaremeFiscal = BAREME_EN_VIGUEUR, seuil_primes=None) -> np.ndarray:
+    """Rachat brut qui laisse `rachat_net` après fiscalité : inverse exact de `calculer_fiscalite`.
+
+    La plus-value d'un rachat R vaut `pourcentage_plus_value` × R ; l'impôt étant
+    linéaire par morceaux en R (avant, puis après épuisement de l'abattement),
+    l'inversion se fait morceau par morceau, sans itération.
+    """
+    seuil = bareme.seuil_primes if seuil_primes is None else np.asarray(seuil_primes, dtype=float)
+    rachat_net = np.asarray(rachat_net, dtype=float)
+    pourcentage = np.maximum(np.asarray(pourcentage_plus_value, dtype=float), 0.0)
+    apres_seuil = np.asarray(anciennete) >= bareme.anciennete_reduite
+    part_taux_reduit = np.minimum(1.0, seuil / np.maximum(np.asarray(epargne_investie, dtype=float), seuil))
+    taux_impot = np.where(apres_seuil, part_taux_reduit * bareme.taux_reduit + (1 - part_taux_reduit) * bareme.taux_forfaitaire,
+                          bareme.taux_forfaitaire)
+
+    # Plus-value entièrement couverte par l'abattement : seuls les prélèvements sociaux s'appliquent
+    sous_abattement = rachat_net / (1 - pourcentage * bareme.prelevements_sociaux)
+    au_dela = (rachat_net - np.where(apres_seuil, abattement, 0.0) * taux_impot) / \
+        (1 - pourcentage * (bareme.prelevements_sociaux + taux_impot))
+    couvert = apres_seuil & (pourcentage * sous_abattement <= abattement)
+    return np.where(rachat_net > 0, np.where(couvert, sous_abattement, au_dela), 0.0)
+
+
+def calculer_fiscalite_foyer(rachat, part_plus_value, anciennete, epargne_investie, abattement,
+                             bareme: BaremeFiscal = BAREME_EN_VIGUEUR, seuil_primes=None) -> np.ndarray:
+    """Fiscalité des rachats de plusieurs contrats d'un même foyer, tableaux (contrats, années).
+
+    L'abattement (scalaire ou par année) est un plafond commun à tous les contrats
+    de plus de `anciennete_reduite` ans : il est imputé d'abord sur la plus-value
+    des contrats au taux d'impôt le plus élevé. Le seuil de primes du taux réduit
+    porte de même sur les primes de tous les contrats : chaque contrat en reçoit
+    une part au prorata de ses primes. `anciennete` est donnée par contrat,
+    de forme (contrats,) ou (contrats, années). Pour un seul contrat, identique à
+    `calculer_fiscalite`.
+    """
+    anciennete = np.asarray(anciennete)
+    if anciennete.ndim == 1:
+        anciennete = anciennete[:, None]
+    epargne_investie = np.asarray(epargne_investie, dtype=float)
+    epargne_foyer = np.broadcast_to(epargne_investie.sum(axis=0), epargne_investie.shape)
+    detail = detailler_fiscalite(rachat, part_plus_value, anciennete, epargne_foyer, 0.0, bareme, seuil_primes)
+    plus_value = np.where((np.asarray(rachat) > 0) & (np.asarray(part_plus_value) > 0), part_plus_value, 0.0)
+    eligible = np.broadcast_to(anciennete, plus_value.shape) >= bareme.anciennete_reduite
+    taux = detail.part_taux_reduit * bareme.taux_reduit + (1 - detail.part_taux_reduit) * bareme.taux_forfaitaire
+
+    # Imputation de l'abattement par taux décroissant, contrat par contrat
+    ordre = np.argsort(np.where(eligible, -taux, np.inf), axis=0, kind="stable")
+    plus_value_eligible = np.take_along_axis(np.where(eligible, plus_value, 0.0), ordre, axis=0)
+    deja_impute = np.cumsum(plus_value_eligible, axis=0) - plus_value_eligible
+    impute = np.empty_like(plus_value)
+    np.put_along_axis(impute, ordre, np.clip(abattement - deja_impute, 0.0, plus_value_eligible), axis=0)
+    return detail.prelevements_sociaux + (plus_value - impute) * taux
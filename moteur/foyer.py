@@ -0,0 +1,122 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .fiscalite import BAREME_EN_VIGUEUR, BaremeFiscal, calculer_fiscalite_foyer, dates_annuelles, seuils_primes
+from .lot import ResultatLot, preparer_lot, simuler_lot
+from .modeles import ABATTEMENT_SEUL, Contrat, Objectif, anciennetes_annuelles
+from .solveurs import marge_financement
+
+
+REPARTITIONS = ("prorata", "priorite")
+
+
+def anciennetes_foyer(contrats: Sequence[Contrat], duree: int, bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> np.ndarray:
+    """Ancienneté de chaque contrat au moment des rachats de chaque année, de forme (contrats, duree).
+
+    `Contrat.anciennete` l'emporte ; à défaut, la date d'ouverture ou l'option
+    fiscale des paramètres (`anciennetes_annuelles`).
+    """
+    selon_parametres = anciennetes_annuelles(
+        [contrat.params.option_fiscalite for contrat in contrats], duree,
+        np.array([contrat.params.date_ouverture for contrat in contrats], dtype="datetime64[D]"),
+        np.array([contrat.params.date_debut or date.today() for contrat in contrats], dtype="datetime64[D]"),
+        bareme,
+    )
+    depart = np.array([np.nan if contrat.anciennete is None else contrat.anciennete for contrat in contrats], dtype=float)
+    # Les rachats ont lieu en début d'année : l'année 1, le contrat a son ancienneté de départ
+    vieillissement = depart[:, None] + np.arange(duree)
+    return np.where(np.isnan(depart)[:, None], selon_parametres, vieillissement)
+
+
+def repartir_rachats(demande, capital, repartition: str = "prorata", ordre: Optional[Sequence[int]] = None) -> np.ndarray:
+    """Répartit le rachat `demande` du foyer entre les contrats, selon leur `capital` disponible.
+
+    "prorata" rachète chaque contrat en proportion de son capital ; "priorite" vide
+    les contrats l'un après l'autre dans l'`ordre` donné (par défaut, celui des contrats).
+    La demande est plafonnée au capital total.
+    """
+    if repartition not in REPARTITIONS:
+        raise ValueError(f"Répartition inconnue : {repartition!r} (attendu : {', '.join(REPARTITIONS)})")
+    capital = np.maximum(capital, 0.0)
+    total = capital.sum()
+    if repartition == "prorata":
+        return capital * (min(demande, total) / total) if total > 0 else np.zeros_like(capital)
+    ordre = np.arange(len(capital)) if ordre is None else np.asarray(ordre)
+    capital_ordonne = capital[ordre]
+    deja_rachete = np.cumsum(capital_ordonne) - capital_ordonne
+    rachats = np.empty_like(capital)
+    rachats[ordre] = np.clip(demande - deja_rachete, 0.0, capital_ordonne)
+    return rachats
+
+
+@dataclass(frozen=True)
+class ResultatFoyer:
+    """Contrats d'un foyer simulés ensemble : une ligne de `lot` par contrat.
+
+    `fiscalite` tient compte de l'abattement commun ; `rachats_demandes` est le
+    besoin annuel du foyer, tous contrats confondus.
+    """
+    contrats: tuple
+    lot: ResultatLot
+    anciennete: np.ndarray
+    fiscalite: np.ndarray
+    rachats_demandes: np.ndarray
+
+    def __len__(self):
+        return len(self.contrats)
+
+    @property
+    def rachat_net(self) -> np.ndarray:
+        return self.lot.rachat - self.fiscalite
+
+    @property
+    def finance(self) -> bool:
+        """Tous les rachats demandés au foyer ont été versés en totalité."""
+        disponible = (self.lot.capital_debut + self.lot.rachat).sum(axis=0)
+        return bool(marge_financement(disponible, self.rachats_demandes) >= 0)
+
+    def vers_dataframe(self) -> pd.DataFrame:
+        """Séries annuelles du foyer, tous contrats confondus, puis le capital de chaque contrat."""
+        df = pd.DataFrame({
+            "Année": self.lot.annee,
+            "Capital fin d'année": self.lot.capital_fin.sum(axis=0),
+            "Épargne investie": self.lot.epargne_investie.sum(axis=0),
+            "Rachat": self.lot.rachat.sum(axis=0),
+            "Fiscalité": self.fiscalite.sum(axis=0),
+            "Rachat net": self.rachat_net.sum(axis=0),
+        })
+        for k, capital in enumerate(self.lot.capital_fin, start=1):
+            df[f"Capital contrat {k}"] = capital
+        return df
+
+
+def simuler_foyer(contrats: Sequence[Contrat],
+                  objectifs: Sequence[Objectif] = (),
+                  abattement: float = ABATTEMENT_SEUL,
+                  repartition: str = "prorata",
+                  ordre: Optional[Sequence[int]] = None,
+                  bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> ResultatFoyer:
+    """Simule les contrats d'un foyer qui financent ensemble les mêmes objectifs.
+
+    Chaque année, le rachat demandé par les objectifs est réparti entre les contrats
+    selon leur capital de début d'année (`repartir_rachats`), puis tous les contrats
+    avancent ensemble dans `simuler_lot`. L'abattement annuel est un plafond commun
+    au foyer (`calculer_fiscalite_foyer`), et non celui des paramètres de chaque contrat.
+    """
+    contrats = tuple(contrats)
+    n = len(contrats)
+    arguments = preparer_lot([c.params for c in contrats], [list(objectifs)] * n,
+                             [list(c.modifications) for c in contrats], [list(c.versements_libres) for c in contrats])
+    demandes = arguments["rachats"][0]
+    anciennete = anciennetes_foyer(contrats, arguments["duree"], bareme)
+
+    lot = simuler_lot(**arguments, repartition_rachats=lambda t, capital: repartir_rachats(demandes[t], capital, repartition, ordre))
+
+    epargne_avant_rachat = np.concatenate([arguments["capital_initial"][:, None], lot.epargne_investie[:, :-1]], axis=1)
+    seuils = seuils_primes(dates_annuelles(arguments["duree"], arguments["date_debut"]))
+    fiscalite = calculer_fiscalite_foyer(lot.rachat, lot.part_plus_value, anciennete, epargne_avant_rachat, abattement, bareme, seuils)
+    return ResultatFoyer(contrats=contrats, lot=lot, anciennete=anciennete, fiscalite=fiscalite, rachats_demandes=demandes)
@@ -0,0 +1,160 @@
+import io
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .lot import preparer_lot, simuler_lot
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre
+from .solveurs import marge_financement
+from .stochastique import RENDEMENT_MINIMUM, ResultatMonteCarlo
+
+
+@dataclass(frozen=True)
+class SerieHistorique:
+    """Rendements historiques d'un support, annuels ou mensuels, en décimal (0.05 = 5 %)."""
+    dates: np.ndarray
+    rendements: np.ndarray
+    mensuelle: bool
+
+    @property
+    def periodes_par_an(self) -> int:
+        return 12 if self.mensuelle else 1
+
+    def rendements_annuels_glissants(self) -> np.ndarray:
+        """Rendement sur douze mois démarrant à chaque période (les rendements eux-mêmes si annuels)."""
+        if not self.mensuelle:
+            return self.rendements
+        cumul = np.concatenate([[0.0], np.cumsum(np.log1p(self.rendements))])
+        return np.expm1(cumul[12:] - cumul[:-12])
+
+    def fenetres(self, duree: int):
+        """Séquences de `duree` rendements annuels pour chaque date de départ possible.
+
+        Renvoie (dates de départ, matrice (départs, duree)). Pour une série
+        mensuelle, chaque mois est une date de départ et l'année t d'un départ
+        correspond aux douze mois suivant le mois de départ + 12 t.
+        """
+        annuels = self.rendements_annuels_glissants()
+        etendue = (duree - 1) * self.periodes_par_an + 1
+        if len(annuels) < etendue:
+            annees = len(self.rendements) / self.periodes_par_an
+            raise ValueError(f"La série couvre {annees:.0f} ans, il en faut au moins {duree} pour rejouer le plan")
+        fenetres = sliding_window_view(annuels, etendue)[:, ::self.periodes_par_an]
+        return self.dates[:len(fenetres)], fenetres
+
+
+# Unités acceptées pour la colonne des rendements : "pourcentage" (5 = 5 %) ou "decimal" (0.05 = 5 %)
+UNITES_RENDEMENT = ("pourcentage", "decimal")
+
+
+def _en_nombres(colonne: pd.Series) -> pd.Series:
+    # Virgule décimale, espaces de milliers et symbole % tolérés ; NaN pour un texte non numérique
+    texte = colonne.astype(str).str.strip().str.rstrip("%").str.replace(" ", "").str.replace(",", ".")
+    return pd.to_numeric(texte, errors="coerce")
+
+
+def _en_decimal(colonne: pd.Series, unite: str) -> np.ndarray:
+    if unite not in UNITES_RENDEMENT:
+        raise ValueError(f"Unité de rendement inconnue : {unite!r} (attendu : {', '.join(UNITES_RENDEMENT)})")
+    if unite == "decimal" and colonne.astype(str).str.strip().str.endswith("%").any():
+        raise ValueError("Des rendements portent le symbole % alors que l'unité choisie est le décimal")
+    valeurs = _en_nombres(colonne)
+    if valeurs.isna().any():
+        raise ValueError("La colonne des rendements contient des valeurs non numériques")
+    valeurs = valeurs.to_numpy(dtype=float)
+    if unite == "pourcentage":
+        valeurs = valeurs / 100
+    # L'unité n'est jamais devinée : une perte d'au moins 100 % est impossible et, en décimal,
+    # un rendement de plus de 100 % sur la période trahit le plus souvent une saisie en pourcentage
+    if (valeurs <= -1).any():
+        raise ValueError(f"Rendement inférieur ou égal à -100 % : vérifiez l'unité choisie ({unite})")
+    if unite == "decimal" and (valeurs > 1).any():
+        raise ValueError("Rendement supérieur à 100 % en décimal : les valeurs semblent saisies en pourcentage")
+    return valeurs
+
+
+def _lire_texte(fichier) -> str:
+    # Chemin ou fichier ouvert (fichier téléversé dans l'application compris)
+    if hasattr(fichier, "read"):
+        contenu = fichier.read()
+    else:
+        with open(fichier, "rb") as f:
+            contenu = f.read()
+    return contenu.decode("utf-8-sig") if isinstance(contenu, bytes) else contenu
+
+
+def charger_rendements(fichier, unite: str) -> SerieHistorique:
+    """Lit un CSV de rendements historiques (date ou année, rendement).
+
+    La première colonne contient l'année (1990) ou la date (1990-01-31,
+    31/01/1990) ; la deuxième le rendement de la période, dans l'`unite`
+    indiquée ("pourcentage" ou "decimal"), avec point ou virgule décimale.
+    Les colonnes sont séparées par un point-virgule ou une tabulation s'il y en
+    a, par une virgule sinon. La ligne d'en-tête est facultative : la première
+    ligne n'est écartée que si son rendement n'est pas un nombre. Les valeurs
+    incompatibles avec l'unité sont refusées. La périodicité (annuelle ou
+    mensuelle) est déduite de l'écart entre deux dates.
+    """
+    texte = _lire_texte(fichier)
+    # Avec un point-virgule ou une tabulation, la virgule est le séparateur décimal
+    separateur = next((sep for sep in (";", "\t") if sep in texte), ",")
+    donnees = pd.read_csv(io.StringIO(texte), sep=separateur, header=None, dtype=str).dropna(how="all")
+    if donnees.shape[1] < 2:
+        raise ValueError("Le fichier doit contenir une colonne de dates et une colonne de rendements")
+    if len(donnees) and _en_nombres(donnees.iloc[:1, 1]).isna().all():
+        donnees = donnees.iloc[1:]
+    dates_brutes, rendements = donnees.iloc[:, 0].str.strip(), _en_decimal(donnees.iloc[:, 1], unite)
+
+    if dates_brutes.str.fullmatch(r"\d{4}").all():
+        dates = dates_brutes.astype(int).to_numpy()
+        ordre = np.argsort(dates, kind="stable")
+        return SerieHistorique(dates=dates[ordre], rendements=rendements[ordre], mensuelle=False)
+
+    horodatages = pd.to_datetime(dates_brutes, dayfirst=dates_brutes.str.contains("/").any(), errors="coerce")
+    if horodatages.isna().any():
+        raise ValueError("La première colonne doit contenir des années ou des dates")
+    ordre = np.argsort(horodatages.to_numpy(), kind="stable")
+    horodatages = horodatages.iloc[ordre]
+    mensuelle = len(horodatages) > 1 and horodatages.diff().dt.days.median() < 60
+    etiquettes = horodatages.dt.strftime("%Y-%m" if mensuelle else "%Y").to_numpy()
+    return SerieHistorique(dates=etiquettes, rendements=rendements[ordre], mensuelle=bool(mensuelle))
+
+
+@dataclass(frozen=True)
+class ResultatBacktest(ResultatMonteCarlo):
+    """Un chemin par date de départ historique, avec la séquence de rendements rejouée."""
+    debuts: np.ndarray
+    rendements: np.ndarray
+
+    @property
+    def indice_pire(self) -> int:
+        """Départ le plus défavorable : plus faible marge de financement, puis plus faible capital final."""
+        marge = marge_financement(self.lot.capital_debut + self.lot.rachat, self.rachats_demandes)
+        return int(np.lexsort((self.lot.serie_finale("capital_fin"), marge))[0])
+
+
+def backtest_historique(params: Parametres,
+                        objectifs: Sequence[Objectif] = (),
+                        modifications: Sequence[ModificationVersement] = (),
+                        versements_libres: Sequence[VersementLibre] = (),
+                        *,
+                        serie: SerieHistorique,
+                        phase_rachat_historique: bool = True) -> ResultatBacktest:
+    """Rejoue le plan depuis chaque date de départ de la série, en un seul appel à `simuler_lot`.
+
+    Les rendements historiques remplacent `rendement_annuel`, et aussi
+    `rendement_phase_rachat` si `phase_rachat_historique` ; les frais de gestion,
+    versements, rachats et la fiscalité restent ceux du plan.
+    """
+    arguments = preparer_lot([params], [list(objectifs)], [list(modifications)], [list(versements_libres)])
+    debuts, rendements = serie.fenetres(arguments["duree"])
+    rendements = np.maximum(rendements, RENDEMENT_MINIMUM)
+    arguments.update(rendement_annuel=rendements)
+    if phase_rachat_historique:
+        arguments.update(rendement_phase_rachat=rendements)
+
+    lot = simuler_lot(**arguments, conserver=("capital_debut", "capital_fin", "rachat", "rachat_net", "epargne_investie"))
+    return ResultatBacktest(lot=lot, rachats_demandes=arguments["rachats"][0], debuts=debuts, rendements=rendements)
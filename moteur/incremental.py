@@ -0,0 +1,156 @@
+from dataclasses import dataclass, fields, replace
+from datetime import date
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+from .cache import CacheSimulations, cle_scenario
+from .calendrier import compiler_versements, compiler_versements_libres
+from .lot import etat_fin_annee
+from .mensuel import ResultatMensuel, simuler_mensuel
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre
+from .simulation import ResultatSimulation, calculer_duree_capi_max, calculer_duree_totale, calculer_rachats, simuler
+
+
+# Paramètres qui agissent sur toutes les années : les modifier impose de tout recalculer
+_PARAMETRES_GLOBAUX = ("capital_initial", "frais_entree_ci", "frais_entree_vp", "frais_gestion", "option_fiscalite", "abattement",
+                       "date_ouverture", "date_debut")
+
+
+@dataclass(frozen=True)
+class MiseAJour:
+    """Résultat complet après une modification, et ce qui a effectivement bougé.
+
+    `premiere_annee` est la première année recalculée (None si rien n'a été
+    recalculé) ; `lignes_modifiees` liste les années dont au moins une valeur
+    diffère du résultat précédent, années ajoutées comprises.
+    """
+    resultat: Union[ResultatSimulation, ResultatMensuel]
+    premiere_annee: Optional[int]
+    lignes_modifiees: np.ndarray
+
+
+def _echeancier(params: Parametres, objectifs, modifications, versements_libres) -> dict:
+    # Tout ce qui détermine une année donnée, compilé en tableaux annuels
+    duree = calculer_duree_totale(objectifs)
+    annee_max = calculer_duree_capi_max(objectifs)
+    annees = np.arange(1, duree + 1)
+    versements = compiler_versements(params.versement_mensuel, modifications, duree)
+    return {
+        "versements": np.where((annees <= annee_max) & (versements > 0), versements, 0.0),
+        "rachats": calculer_rachats(objectifs, duree),
+        "libres": compiler_versements_libres(versements_libres, duree),
+        "taux": np.where(annees > annee_max, params.rendement_phase_rachat, params.rendement_annuel),
+    }
+
+
+def premiere_annee_modifiee(avant: dict, apres: dict) -> Optional[int]:
+    """Première année dont les échéanciers diffèrent ; None si l'un prolonge l'autre à l'identique."""
+    premieres = []
+    for cle, serie in apres.items():
+        commun = min(len(serie), len(avant[cle]))
+        differences = np.flatnonzero(serie[:commun] != avant[cle][:commun])
+        if len(differences):
+            premieres.append(int(differences[0]) + 1)
+    if premieres:
+        return min(premieres)
+    duree_avant, duree_apres = len(avant["taux"]), len(apres["taux"])
+    return duree_avant + 1 if duree_apres > duree_avant else None
+
+
+def _annuel(resultat):
+    return resultat.annuel if isinstance(resultat, ResultatMensuel) else resultat
+
+
+def _raccorder(ancien, suite, annee: int):
+    # Années 1 à annee - 1 de l'ancien résultat, puis la suite recalculée
+    def joindre(avant, apres):
+        return {f.name: np.concatenate([getattr(avant, f.name)[:annee - 1], getattr(apres, f.name)]) for f in fields(avant)}
+
+    if isinstance(suite, ResultatMensuel):
+        mois = 12 * (annee - 1)
+        return ResultatMensuel(
+            capital=np.concatenate([ancien.capital[:mois], suite.capital]),
+            rachat=np.concatenate([ancien.rachat[:mois], suite.rachat]),
+            annuel=ResultatSimulation(**joindre(ancien.annuel, suite.annuel)),
+        )
+    return ResultatSimulation(**joindre(ancien, suite))
+
+
+def _tronquer(resultat, duree: int):
+    annuel = ResultatSimulation(**{f.name: getattr(_annuel(resultat), f.name)[:duree] for f in fields(ResultatSimulation)})
+    if isinstance(resultat, ResultatMensuel):
+        return ResultatMensuel(capital=resultat.capital[:12 * duree + 1], rachat=resultat.rachat[:12 * duree], annuel=annuel)
+    return annuel
+
+
+def lignes_modifiees(avant, apres, premiere_annee: int = 1) -> np.ndarray:
+    """Années dont au moins une série diffère (au-delà des arrondis), ou absentes de `avant`.
+
+    Les années antérieures à `premiere_annee` sont supposées identiques et ne sont pas comparées.
+    """
+    avant, apres = _annuel(avant), _annuel(apres)
+    commun = min(len(avant), len(apres))
+    debut = min(premiere_annee - 1, commun)
+    modifiees = np.zeros(len(apres), dtype=bool)
+    modifiees[commun:] = True
+    series_avant = np.array([getattr(avant, f.name)[debut:commun] for f in fields(ResultatSimulation)], dtype=float)
+    series_apres = np.array([getattr(apres, f.name)[debut:commun] for f in fields(ResultatSimulation)], dtype=float)
+    modifiees[debut:commun] = (np.abs(series_apres - series_avant) > 1e-9 + 1e-12 * np.abs(series_apres)).any(axis=0)
+    return apres.annee[modifiees]
+
+
+class SimulationIncrementale:
+    """Simulation qui ne recalcule que les années touchées par une modification.
+
+    Les valeurs de fin d'année du résultat précédent servent de points de
+    reprise : après une modification, seules les années à partir de la première
+    année dont les entrées ont changé sont simulées, puis raccordées aux
+    années inchangées. Avec `cache`, un scénario déjà calculé est repris tel quel
+    (mode annuel uniquement).
+    """
+
+    def __init__(self, mensuel: bool = False, cache: Optional[CacheSimulations] = None):
+        self.mensuel = mensuel
+        self.cache = None if mensuel else cache
+        self._params = None
+        self._echeancier = None
+        self.resultat = None
+
+    def mettre_a_jour(self,
+                      params: Parametres,
+                      objectifs: Sequence[Objectif] = (),
+                      modifications: Sequence[ModificationVersement] = (),
+                      versements_libres: Sequence[VersementLibre] = ()) -> MiseAJour:
+        # La date de départ est figée à chaque mise à jour : un changement de jour est une modification globale
+        params = replace(params, date_debut=params.date_debut or date.today())
+        entrees = (params, objectifs, modifications, versements_libres)
+        echeancier = _echeancier(*entrees)
+        duree = len(echeancier["taux"])
+        ancien = self.resultat
+
+        if ancien is None or any(getattr(params, p) != getattr(self._params, p) for p in _PARAMETRES_GLOBAUX):
+            premiere = 1
+        else:
+            premiere = premiere_annee_modifiee(self._echeancier, echeancier)
+
+        cle = None if self.cache is None else cle_scenario(*entrees)
+        resultat = None if cle is None else self.cache.obtenir(cle)
+        if resultat is None:
+            if premiere is None:
+                resultat = _tronquer(ancien, duree)
+            elif premiere == 1:
+                resultat = simuler_mensuel(*entrees) if self.mensuel else simuler(*entrees)
+            else:
+                etat = etat_fin_annee(_annuel(ancien), premiere - 1)
+                suite = simuler_mensuel(*entrees, etat_initial=etat) if self.mensuel else simuler(*entrees, etat_initial=etat)
+                resultat = _raccorder(ancien, suite, premiere)
+            if cle is not None:
+                self.cache.ajouter(cle, resultat)
+
+        if ancien is None:
+            modifiees = _annuel(resultat).annee
+        else:
+            modifiees = lignes_modifiees(ancien, resultat, len(_annuel(resultat)) + 1 if premiere is None else premiere)
+        self._params, self._echeancier, self.resultat = params, echeancier, resultat
+        return MiseAJour(resultat=resultat, premiere_annee=premiere, lignes_modifiees=modifiees)
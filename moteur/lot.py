@@ -0,0 +1,327 @@
+from dataclasses import dataclass, fields
+from datetime import date
+from typing import Callable, Iterable, Optional, Sequence
+
+import numpy as np
+
+from .calendrier import compiler_versements, compiler_versements_libres
+from .fiscalite import calculer_fiscalite, dates_annuelles, rachat_brut_pour_net, seuils_primes
+from .modeles import (
+    OPTION_MOINS_8_ANS,
+    ModificationVersement,
+    Objectif,
+    Parametres,
+    VersementLibre,
+    anciennetes_annuelles,
+)
+from .simulation import (
+    COLONNES,
+    DUREE_PAR_DEFAUT,
+    PRORATA_VERSEMENTS,
+    EtatAnnuel,
+    ResultatSimulation,
+    calculer_duree_capi_max,
+    calculer_duree_totale,
+    calculer_rachats,
+)
+
+
+SERIES = tuple(champ for champ in COLONNES if champ != "annee")
+
+
+@dataclass(frozen=True)
+class ResultatLot:
+    """Séries annuelles de N scénarios, chacune de forme (N, nombre d'années simulées).
+
+    Les séries non demandées via `conserver` valent None. Une simulation reprise
+    depuis un `EtatAnnuel` ne contient que les années suivantes. Au-delà de sa propre
+    `duree_totale`, un scénario continue d'être simulé sans rachat : seules les
+    années 1 à `duree_totale[i]` correspondent à la simulation unitaire.
+    """
+    annee: np.ndarray
+    duree_totale: np.ndarray
+    capital_debut: Optional[np.ndarray] = None
+    vp_net: Optional[np.ndarray] = None
+    rendement: Optional[np.ndarray] = None
+    frais_gestion: Optional[np.ndarray] = None
+    capital_fin: Optional[np.ndarray] = None
+    rachat: Optional[np.ndarray] = None
+    epargne_investie: Optional[np.ndarray] = None
+    vp_exceptionnel: Optional[np.ndarray] = None
+    part_capital: Optional[np.ndarray] = None
+    part_plus_value: Optional[np.ndarray] = None
+    fiscalite: Optional[np.ndarray] = None
+    pourcentage_plus_value: Optional[np.ndarray] = None
+    rachat_net: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self.duree_totale)
+
+    def serie_finale(self, champ: str) -> np.ndarray:
+        """Valeur de la série `champ` à la dernière année de chaque scénario."""
+        serie = getattr(self, champ)
+        return np.take_along_axis(serie, (self.duree_totale - self.annee[0])[:, None], axis=1)[:, 0]
+
+    def scenario(self, i: int) -> ResultatSimulation:
+        nombre_annees = int(self.duree_totale[i]) - int(self.annee[0]) + 1
+        series = {f.name: None for f in fields(ResultatSimulation)}
+        series["annee"] = self.annee[:nombre_annees]
+        for champ in SERIES:
+            serie = getattr(self, champ)
+            if serie is not None:
+                series[champ] = serie[i, :nombre_annees]
+        return ResultatSimulation(**series)
+
+
+def etat_fin_annee(resultat, annee: int) -> EtatAnnuel:
+    """Extrait l'état de fin d'année d'un `ResultatSimulation` ou d'un `ResultatLot`."""
+    indice = annee - int(resultat.annee[0])
+    return EtatAnnuel(
+        annee=annee,
+        capital=np.asarray(resultat.capital_fin[..., indice]),
+        epargne_investie=np.asarray(resultat.epargne_investie[..., indice]),
+        pourcentage_plus_value=np.asarray(resultat.pourcentage_plus_value[..., indice]),
+    )
+
+
+def rachats_objectifs(annee, montant_annuel, duree_retrait, duree: int) -> np.ndarray:
+    """Rachats demandés par année pour des objectifs donnés sous forme de tableaux (N, K).
+
+    Les scénarios ayant moins de K objectifs complètent avec un montant ou une durée nuls.
+    """
+    annee = np.asarray(annee)[..., None]
+    duree_retrait = np.asarray(duree_retrait)[..., None]
+    montant_annuel = np.asarray(montant_annuel, dtype=float)[..., None]
+    t = np.arange(1, duree + 1)
+    masque = (t > annee) & (t <= annee + duree_retrait)
+    return (montant_annuel * masque).sum(axis=-2)
+
+
+def _par_annee(valeur, n: int, duree: int) -> np.ndarray:
+    # Scalaire, vecteur (N,) constant dans le temps, ou matrice (N, duree) / (1, duree)
+    valeur = np.asarray(valeur, dtype=float)
+    if valeur.ndim == 1:
+        valeur = valeur[:, None]
+    return np.broadcast_to(valeur, (n, duree))
+
+
+def par_scenario(valeur, n: int) -> np.ndarray:
+    """Paramètre commun ou par scénario, diffusé en un tableau (n,)."""
+    return np.broadcast_to(np.asarray(valeur, dtype=float), (n,))
+
+
+def series_scenarios(resultat, champs):
+    """Séries `champs` d'un ResultatSimulation (duree,) ou d'un ResultatLot (N, duree), mises en forme (N, duree).
+
+    Renvoie (unitaire, séries, duree_totale (N,), actives) : `actives` (N, duree)
+    marque les années de chaque scénario jusqu'à sa propre durée, None si tous
+    les scénarios couvrent toute la durée simulée.
+    """
+    unitaire = np.ndim(resultat.capital_fin) == 1
+    series = {champ: np.atleast_2d(getattr(resultat, champ)) for champ in champs}
+    n, duree = np.shape(np.atleast_2d(resultat.capital_fin))
+    duree_totale = np.broadcast_to(np.asarray(getattr(resultat, "duree_totale", duree)), (n,)).astype(int)
+    actives = None if (duree_totale >= duree).all() else np.arange(1, duree + 1) <= duree_totale[:, None]
+    return unitaire, series, duree_totale, actives
+
+
+def simuler_lot(capital_initial,
+                versement_mensuel,
+                rendement_annuel,
+                frais_gestion,
+                frais_entree_ci=0.0,
+                frais_entree_vp=0.0,
+                rendement_phase_rachat=None,
+                abattement=4600,
+                option_fiscalite=OPTION_MOINS_8_ANS,
+                rachats=None,
+                versements_libres=None,
+                objectif_annee_max=None,
+                duree_totale=None,
+                duree: int = DUREE_PAR_DEFAUT,
+                date_ouverture=None,
+                date_debut=None,
+                conserver: Optional[Iterable[str]] = None,
+                etat_initial: Optional[EtatAnnuel] = None,
+                repartition_rachats: Optional[Callable[[int, np.ndarray], np.ndarray]] = None,
+                rachats_nets: bool = False) -> ResultatLot:
+    """Simule N scénarios en avançant tout le vecteur d'une année à chaque pas.
+
+    Les paramètres scalaires acceptent un scalaire ou un tableau (N,).
+    `versement_mensuel`, `rachats`, `versements_libres`, les deux rendements et
+    `frais_gestion` acceptent en plus une matrice (N, duree), ou (1, duree) pour
+    un échéancier annuel commun : c'est ainsi que sont passés les rendements
+    aléatoires et les taux d'un portefeuille multi-supports.
+    `objectif_annee_max` est l'année du dernier objectif (fin des versements et
+    passage au rendement de phase de rachat) ; `duree` par défaut.
+    Avec `etat_initial`, la simulation reprend à l'année qui suit cet état : les
+    échéanciers restent indexés sur toute la durée et `capital_initial` ne sert plus.
+    `date_ouverture` et `date_debut` (date ou tableau (N,) de dates, NaT pour un
+    contrat sans date d'ouverture) font vieillir chaque contrat année par année
+    (`anciennetes_annuelles`) ; le seuil de primes est celui du barème en vigueur
+    à chaque année de rachat.
+    `repartition_rachats(t, capital)` remplace `rachats` quand le rachat de chaque
+    scénario dépend du capital de tous les autres en début d'année t (contrats d'un foyer).
+    Avec `rachats_nets`, les `rachats` sont les montants à percevoir après fiscalité :
+    chaque année, le rachat demandé est le brut correspondant (`rachat_brut_pour_net`).
+    """
+    parametres = [capital_initial, frais_entree_ci, frais_entree_vp, rendement_annuel, rendement_phase_rachat,
+                  frais_gestion, abattement, objectif_annee_max, duree_totale,
+                  versement_mensuel, rachats, versements_libres]
+    if etat_initial is not None:
+        parametres += [etat_initial.capital, etat_initial.epargne_investie, etat_initial.pourcentage_plus_value]
+    n = max([np.shape(p)[0] for p in parametres if p is not None and np.ndim(p) >= 1] + [1])
+
+    def vecteur(valeur, defaut=None):
+        valeur = defaut if valeur is None else valeur
+        return np.broadcast_to(np.asarray(valeur, dtype=float), (n,))
+
+    capital_initial = vecteur(capital_initial)
+    frais_entree_ci = vecteur(frais_entree_ci)
+    frais_entree_vp = vecteur(frais_entree_vp)
+    rendements = _par_annee(rendement_annuel, n, duree)
+    rendements_phase_rachat = _par_annee(rendement_annuel if rendement_phase_rachat is None else rendement_phase_rachat, n, duree)
+    frais_gestion = _par_annee(frais_gestion, n, duree)
+    abattement = vecteur(abattement)
+    objectif_annee_max = vecteur(objectif_annee_max, duree)
+    duree_totale = vecteur(duree_totale, duree).astype(int)
+
+    anciennete = np.broadcast_to(anciennetes_annuelles(option_fiscalite, duree, date_ouverture, date_debut), (n, duree))
+    seuils = np.broadcast_to(seuils_primes(dates_annuelles(duree, date_debut)), (n, duree))
+
+    versements = _par_annee(versement_mensuel, n, duree)
+    rachats = _par_annee(0.0 if rachats is None else rachats, n, duree)
+    libres = _par_annee(0.0 if versements_libres is None else versements_libres, n, duree)
+
+    conserver = SERIES if conserver is None else tuple(conserver)
+    if etat_initial is None:
+        depart = 0
+        capital = capital_initial * (1 - frais_entree_ci)
+        epargne_investie = capital_initial.copy()
+        pourcentage_precedent = np.zeros(n)
+    else:
+        depart = etat_initial.annee
+        capital = np.broadcast_to(np.asarray(etat_initial.capital, dtype=float), (n,))
+        epargne_investie = np.broadcast_to(np.asarray(etat_initial.epargne_investie, dtype=float), (n,))
+        pourcentage_precedent = np.broadcast_to(np.asarray(etat_initial.pourcentage_plus_value, dtype=float), (n,))
+
+    sorties = {champ: np.empty((duree - depart, n)) for champ in conserver}
+
+    for t in range(depart, duree):
+        annee = t + 1
+        versement_courant = versements[:, t]
+        versement_investi = versement_courant * (1 - frais_entree_vp)
+        actifs = (annee <= objectif_annee_max) & (versement_courant > 0)
+
+        # Rachat plafonné au capital disponible en début d'année
+        demande = rachats[:, t] if repartition_rachats is None else repartition_rachats(t, capital)
+        if rachats_nets:
+            demande = rachat_brut_pour_net(demande, pourcentage_precedent, anciennete[:, t], epargne_investie, abattement,
+                                           seuil_primes=seuils[:, t])
+        rachat = np.minimum(demande, capital)
+        capital = capital - rachat
+        avec_rachat = rachat > 0
+
+        part_plus_value = np.where(avec_rachat, pourcentage_precedent * rachat, 0.0)
+        part_capital = np.where(avec_rachat, rachat - part_plus_value, 0.0)
+
+        fiscalite = calculer_fiscalite(rachat, part_plus_value, anciennete[:, t], epargne_investie, abattement, seuil_primes=seuils[:, t])
+        rachat_net = np.where(avec_rachat, rachat - fiscalite, 0.0)
+
+        epargne_investie = np.where(avec_rachat, np.maximum(0, epargne_investie - part_capital), epargne_investie)
+
+        rendement = rendements[:, t]
+        taux = np.where(annee > objectif_annee_max, rendements_phase_rachat[:, t], rendement)
+        rendement_capital = capital * taux
+        investi_prorata = np.where(actifs, versement_investi * PRORATA_VERSEMENTS, 0.0)
+        vp_net = np.where(actifs, versement_investi * 12, 0.0)
+        frais_annee = frais_gestion[:, t]
+        frais = capital * frais_annee + investi_prorata * frais_annee
+
+        versement_libre = libres[:, t]
+        capital_fin = (
+            capital
+            + vp_net
+            + rendement_capital
+            + investi_prorata * rendement
+            - frais
+            + versement_libre * (1 - frais_entree_vp)
+        )
+
+        epargne_investie = epargne_investie + np.where(actifs, versement_courant * 12, 0.0) + versement_libre
+
+        positif = (epargne_investie > 0) & (capital_fin > 0)
+        pourcentage = np.where(positif, 1 - epargne_investie / np.where(positif, capital_fin, 1.0), 0.0)
+
+        valeurs = {
+            "capital_debut": capital,
+            "vp_net": vp_net,
+            "rendement": rendement_capital + investi_prorata * rendement,
+            "frais_gestion": frais,
+            "capital_fin": capital_fin,
+            "rachat": rachat,
+            "epargne_investie": epargne_investie,
+            "vp_exceptionnel": versement_libre,
+            "part_capital": part_capital,
+            "part_plus_value": part_plus_value,
+            "fiscalite": fiscalite,
+            "pourcentage_plus_value": pourcentage,
+            "rachat_net": rachat_net,
+        }
+        for champ, sortie in sorties.items():
+            sortie[t - depart] = valeurs[champ]
+
+        capital = capital_fin
+        pourcentage_precedent = pourcentage
+
+    return ResultatLot(
+        annee=np.arange(depart + 1, duree + 1),
+        duree_totale=duree_totale,
+        **{champ: sortie.T for champ, sortie in sorties.items()},
+    )
+
+
+def _dates(dates, defaut=None):
+    # None si aucune date n'est renseignée, sinon un tableau (N,) avec NaT (ou `defaut`) pour les manquantes
+    if all(jour is None for jour in dates):
+        return None
+    return np.array([defaut if jour is None else jour for jour in dates], dtype="datetime64[D]")
+
+
+def preparer_lot(params: Sequence[Parametres],
+                 objectifs: Sequence[Sequence[Objectif]],
+                 modifications: Optional[Sequence[Sequence[ModificationVersement]]] = None,
+                 versements_libres: Optional[Sequence[Sequence[VersementLibre]]] = None) -> dict:
+    """Arguments de `simuler_lot` pour une liste de scénarios décrits avec les types du moteur."""
+    n = len(params)
+    modifications = modifications or [()] * n
+    versements_libres = versements_libres or [()] * n
+    durees = np.array([calculer_duree_totale(objs) for objs in objectifs], dtype=int)
+    duree = int(durees.max()) if n else DUREE_PAR_DEFAUT
+
+    versements = np.empty((n, duree))
+    rachats = np.zeros((n, duree))
+    libres = np.zeros((n, duree))
+    for i, (p, objs, modifs, vls) in enumerate(zip(params, objectifs, modifications, versements_libres)):
+        versements[i] = compiler_versements(p.versement_mensuel, modifs, duree)
+        rachats[i, :durees[i]] = calculer_rachats(objs, int(durees[i]))
+        libres[i, :durees[i]] = compiler_versements_libres(vls, int(durees[i]))
+
+    return dict(
+        capital_initial=np.array([p.capital_initial for p in params]),
+        frais_entree_ci=np.array([p.frais_entree_ci for p in params]),
+        versement_mensuel=versements,
+        frais_entree_vp=np.array([p.frais_entree_vp for p in params]),
+        rendement_annuel=np.array([p.rendement_annuel for p in params]),
+        frais_gestion=np.array([p.frais_gestion for p in params]),
+        rendement_phase_rachat=np.array([p.rendement_phase_rachat for p in params]),
+        abattement=np.array([p.abattement for p in params]),
+        option_fiscalite=np.array([p.option_fiscalite for p in params]),
+        rachats=rachats,
+        versements_libres=libres,
+        objectif_annee_max=np.array([calculer_duree_capi_max(objs) for objs in objectifs]),
+        duree_totale=durees,
+        duree=duree,
+        date_ouverture=_dates([p.date_ouverture for p in params]),
+        date_debut=_dates([p.date_debut for p in params], defaut=date.today()),
+    )
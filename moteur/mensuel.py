@@ -0,0 +1,191 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+from .calendrier import compiler_versements, compiler_versements_libres
+from .fiscalite import calculer_fiscalite, dates_annuelles, seuils_primes
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre, anciennetes_annuelles
+from .simulation import (
+    EtatAnnuel,
+    ResultatSimulation,
+    calculer_duree_capi_max,
+    calculer_duree_totale,
+    calculer_rachats,
+)
+
+
+# Un écart négatif plus petit qu'un millionième de centime est une erreur d'arrondi, pas un découvert
+_TOLERANCE_DECOUVERT = 1e-8
+
+
+@dataclass(frozen=True)
+class ResultatMensuel:
+    """Simulation au pas mensuel : capital mois par mois et séries annuelles agrégées.
+
+    `capital` a 12 × duree + 1 valeurs (capital au début de chaque mois, puis
+    capital final) ; `rachat` contient les rachats effectivement versés chaque mois.
+    Dans `annuel`, `capital_debut` est le capital au 1er janvier, avant les rachats de l'année.
+    """
+    capital: np.ndarray
+    rachat: np.ndarray
+    annuel: ResultatSimulation
+
+    def vers_dataframe(self):
+        return self.annuel.vers_dataframe()
+
+
+def recurrence_lineaire(a: np.ndarray, b: np.ndarray, x0: float) -> np.ndarray:
+    """Solution de x[t + 1] = a[t] x[t] + b[t], x[0] = x0, par produits et sommes cumulés.
+
+    Avec P[t] le produit des a[k] pour k < t, x[t] = P[t] (x0 + somme des b[k] / P[k + 1]).
+    Un coefficient nul remet la suite à b[t] : les produits repartent de ce point.
+    """
+    nul = a == 0
+    produits = np.concatenate([[1.0], np.cumprod(np.where(nul, 1.0, a))])
+    sommes = np.concatenate([[0.0], np.cumsum(b / produits[1:])])
+    # Indice du dernier coefficient nul avant chaque pas (-1 s'il n'y en a pas)
+    dernier_nul = np.maximum.accumulate(np.where(nul, np.arange(len(a)), -1))
+    base = np.empty(len(a) + 1)
+    base[0] = -x0
+    base[1:] = np.where(dernier_nul >= 0, sommes[np.maximum(dernier_nul, 0)], -x0)
+    return produits * (sommes - base)
+
+
+def _capital_mensuel(croissance, versements, rachats, libres, capital_initial):
+    # Rachats plafonnés au capital disponible : la récurrence est résolue d'un bloc, puis
+    # reprise au premier mois à découvert, où le capital est entièrement racheté.
+    nombre_mois = len(croissance)
+    capital = np.empty(nombre_mois + 1)
+    capital[0] = capital_initial
+    verses = rachats.copy()
+    apports = np.flatnonzero((versements > rachats) | (libres > 0))
+
+    t = 0
+    while t < nombre_mois:
+        solde = versements[t:] - rachats[t:]
+        x = recurrence_lineaire(croissance[t:], solde * croissance[t:] + libres[t:], capital[t])
+        decouvert = x[:-1] + solde < -_TOLERANCE_DECOUVERT
+        if not decouvert.any():
+            capital[t:] = x
+            break
+        j = t + int(decouvert.argmax())
+        capital[t:j + 1] = x[:j - t + 1]
+        verses[j] = capital[j] + versements[j]
+        capital[j + 1] = libres[j]
+        t = j + 1
+        if t < nombre_mois and capital[t] == 0:
+            # Capital épuisé : il reste nul jusqu'au prochain mois où les apports dépassent le rachat demandé
+            suivant = np.searchsorted(apports, t)
+            k = int(apports[suivant]) if suivant < len(apports) else nombre_mois
+            verses[t:k] = versements[t:k]
+            capital[t:k + 1] = 0.0
+            t = k
+    return capital, verses
+
+
+def echeancier_mensuel(params: Parametres,
+                       objectifs: Sequence[Objectif],
+                       modifications: Sequence[ModificationVersement],
+                       versements_libres: Sequence[VersementLibre],
+                       duree_totale: int) -> dict:
+    """Flux de chaque mois (12 × duree_totale valeurs) : versements bruts et investis, rachats demandés, taux.
+
+    Les versements libres sont placés en décembre, les rachats des objectifs répartis par douzièmes.
+    """
+    objectif_annee_max = calculer_duree_capi_max(objectifs)
+    annees = np.arange(1, duree_totale + 1)
+
+    versements_annee = compiler_versements(params.versement_mensuel, modifications, duree_totale)
+    actifs = (annees <= objectif_annee_max) & (versements_annee > 0)
+    versements_bruts = np.repeat(np.where(actifs, versements_annee, 0.0), 12)
+    libres_bruts = np.zeros(12 * duree_totale)
+    libres_bruts[11::12] = compiler_versements_libres(versements_libres, duree_totale)
+    taux_annuel = np.where(annees > objectif_annee_max, params.rendement_phase_rachat, params.rendement_annuel)
+    return {
+        "versements_bruts": versements_bruts,
+        "versements": versements_bruts * (1 - params.frais_entree_vp),
+        "rachats": np.repeat(calculer_rachats(objectifs, duree_totale) / 12, 12),
+        "libres_bruts": libres_bruts,
+        "libres": libres_bruts * (1 - params.frais_entree_vp),
+        "taux_mensuel": np.repeat((1 + taux_annuel) ** (1 / 12) - 1, 12),
+    }
+
+
+def simuler_mensuel(params: Parametres,
+                    objectifs: Sequence[Objectif] = (),
+                    modifications: Sequence[ModificationVersement] = (),
+                    versements_libres: Sequence[VersementLibre] = (),
+                    duree_totale: Optional[int] = None,
+                    etat_initial: Optional[EtatAnnuel] = None) -> ResultatMensuel:
+    """Simule le contrat au pas mensuel, sans boucle sur les mois.
+
+    Chaque mois, le versement programmé est investi en début de mois, le rachat
+    programmé (un douzième du montant annuel des objectifs) est prélevé, puis le
+    capital croît au taux mensuel équivalent au rendement annuel et supporte un
+    douzième des frais de gestion. Les versements libres arrivent en fin d'année.
+    Le capital et l'épargne investie suivent des récurrences linéaires résolues
+    par `recurrence_lineaire` ; la fiscalité est calculée sur la plus-value
+    rachetée de chaque année, comme dans `simuler`. Avec `etat_initial`, la
+    simulation reprend au mois de janvier qui suit cet état.
+    """
+    if duree_totale is None:
+        duree_totale = calculer_duree_totale(objectifs)
+    annees = np.arange(1, duree_totale + 1)
+    echeancier = echeancier_mensuel(params, objectifs, modifications, versements_libres, duree_totale)
+    versements_bruts, versements, rachats = echeancier["versements_bruts"], echeancier["versements"], echeancier["rachats"]
+    libres_bruts, libres, taux_mensuel = echeancier["libres_bruts"], echeancier["libres"], echeancier["taux_mensuel"]
+    frais_mensuels = params.frais_gestion / 12
+
+    if etat_initial is None:
+        capital_initial, epargne_initiale = params.capital_initial * (1 - params.frais_entree_ci), params.capital_initial
+    else:
+        capital_initial, epargne_initiale = float(etat_initial.capital), float(etat_initial.epargne_investie)
+        # Seuls les mois qui suivent l'état de reprise sont simulés
+        mois = slice(12 * etat_initial.annee, None)
+        annees = annees[etat_initial.annee:]
+        versements_bruts, versements, rachats = versements_bruts[mois], versements[mois], rachats[mois]
+        libres_bruts, libres, taux_mensuel = libres_bruts[mois], libres[mois], taux_mensuel[mois]
+    croissance = (1 + taux_mensuel) * (1 - frais_mensuels)
+
+    capital, verses = _capital_mensuel(croissance, versements, rachats, libres, capital_initial)
+
+    # Épargne investie : chaque rachat en retire la part de capital, proportionnelle au capital disponible
+    disponible = capital[:-1] + versements - verses
+    avant_rachat = capital[:-1] + versements
+    conserve = np.divide(disponible, avant_rachat, out=np.ones_like(disponible), where=avant_rachat > 0)
+    epargne = recurrence_lineaire(conserve, conserve * versements_bruts + libres_bruts, epargne_initiale)
+    part_capital = np.divide(verses * (epargne[:-1] + versements_bruts), avant_rachat, out=np.zeros_like(verses), where=avant_rachat > 0)
+
+    def par_annee(serie):
+        return serie.reshape(len(annees), 12).sum(axis=1)
+
+    rendement = par_annee(disponible * taux_mensuel)
+    frais = par_annee(disponible * (1 + taux_mensuel) * frais_mensuels)
+    rachat = par_annee(verses)
+    part_capital_annee = par_annee(part_capital)
+    part_plus_value = rachat - part_capital_annee
+    anciennete = anciennetes_annuelles(params.option_fiscalite, duree_totale, params.date_ouverture, params.date_debut)[annees - 1]
+    seuils = seuils_primes(dates_annuelles(duree_totale, params.date_debut))[annees - 1]
+    fiscalite = calculer_fiscalite(rachat, part_plus_value, anciennete, epargne[:-1:12], params.abattement, seuil_primes=seuils)
+    capital_fin = capital[12::12]
+    epargne_fin = epargne[12::12]
+    positif = (epargne_fin > 0) & (capital_fin > 0)
+
+    annuel = ResultatSimulation(
+        annee=annees,
+        capital_debut=capital[:-1:12],
+        vp_net=par_annee(versements),
+        rendement=rendement,
+        frais_gestion=frais,
+        capital_fin=capital_fin,
+        rachat=rachat,
+        epargne_investie=epargne_fin,
+        vp_exceptionnel=par_annee(libres_bruts),
+        part_capital=part_capital_annee,
+        part_plus_value=np.where(rachat > 0, part_plus_value, 0.0),
+        fiscalite=fiscalite,
+        pourcentage_plus_value=np.where(positif, 1 - epargne_fin / np.where(positif, capital_fin, 1.0), 0.0),
+        rachat_net=rachat - fiscalite,
+    )
+    return ResultatMensuel(capital=capital, rachat=verses, annuel=annuel)
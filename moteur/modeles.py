@@ -0,0 +1,146 @@
+from dataclasses import dataclass, fields
+from datetime import date
+from typing import Any, Mapping, Optional, Sequence
+
+import numpy as np
+
+from .fiscalite import BAREME_EN_VIGUEUR, BaremeFiscal
+
+
+# Libellés émis par le bouton radio "Durée de vie de votre contrat"
+OPTION_MOINS_8_ANS = "− 8 ans"
+OPTION_PLUS_8_ANS = "﹢ 8 ans"
+# Orthographe ASCII de l'option, toujours acceptée
+OPTION_PLUS_8_ANS_ASCII = "+ 8 ans"
+
+ABATTEMENT_SEUL = BAREME_EN_VIGUEUR.abattement_seul
+ABATTEMENT_COUPLE = BAREME_EN_VIGUEUR.abattement_couple
+
+
+def anciennete_contrat(option_fiscalite, bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> np.ndarray:
+    """Ancienneté du contrat (en années) correspondant à l'option "− 8 ans" / "﹢ 8 ans".
+
+    L'option indique seulement de quel côté du seuil se trouve le contrat :
+    0 pour "− 8 ans", le seuil du barème pour "﹢ 8 ans". Accepte un tableau d'options.
+    """
+    option_fiscalite = np.asarray(option_fiscalite)
+    plus_8_ans = (option_fiscalite == OPTION_PLUS_8_ANS) | (option_fiscalite == OPTION_PLUS_8_ANS_ASCII)
+    inconnues = ~plus_8_ans & (option_fiscalite != OPTION_MOINS_8_ANS)
+    if inconnues.any():
+        raise ValueError(f"Option fiscale inconnue : {option_fiscalite[inconnues].flat[0]!r}")
+    return np.where(plus_8_ans, bareme.anciennete_reduite, 0)
+
+
+def annees_ecoulees(depuis, jusqu_a) -> np.ndarray:
+    """Âge en années (mois entiers écoulés / 12) entre deux dates ou tableaux de dates ; NaN si l'une manque."""
+    depuis = np.asarray(depuis, dtype="datetime64[D]")
+    jusqu_a = np.asarray(jusqu_a, dtype="datetime64[D]")
+    mois = (jusqu_a.astype("datetime64[M]") - depuis.astype("datetime64[M]")).astype(float)
+    # Le mois en cours n'est écoulé qu'une fois le quantième atteint
+    jour_depuis = depuis - depuis.astype("datetime64[M]").astype("datetime64[D]")
+    jour_jusqu_a = jusqu_a - jusqu_a.astype("datetime64[M]").astype("datetime64[D]")
+    mois = mois - (jour_jusqu_a < jour_depuis)
+    return np.where(np.isnat(depuis) | np.isnat(jusqu_a), np.nan, mois / 12)
+
+
+def anciennetes_annuelles(option_fiscalite, duree: int, date_ouverture=None, date_debut=None,
+                          bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> np.ndarray:
+    """Ancienneté du contrat au moment des rachats de chaque année, de forme (..., duree).
+
+    Avec une `date_ouverture`, le contrat vieillit d'un an par année simulée à
+    partir de son âge à `date_debut` (aujourd'hui par défaut) et change de régime
+    l'année où il atteint `anciennete_reduite` ans. Sans date (None ou NaT dans un
+    tableau), l'option fiscale fixe l'ancienneté pour toute la simulation.
+    """
+    fixe = anciennete_contrat(option_fiscalite, bareme).astype(float)[..., None]
+    if date_ouverture is None:
+        return np.broadcast_to(fixe, fixe.shape[:-1] + (duree,))
+    debut = date.today() if date_debut is None else date_debut
+    depart = annees_ecoulees(date_ouverture, debut)[..., None]
+    return np.where(np.isnan(depart), fixe, depart + np.arange(duree))
+
+
+def ages_annuels(date_naissance, duree: int, date_debut=None) -> np.ndarray:
+    """Âge de l'assuré au début de chaque année simulée, de forme (..., duree) ; NaN sans date de naissance."""
+    if date_naissance is None:
+        return np.full(duree, np.nan)
+    debut = date.today() if date_debut is None else date_debut
+    return annees_ecoulees(date_naissance, debut)[..., None] + np.arange(duree)
+
+
+def _depuis_mapping(cls, donnees: Mapping[str, Any]):
+    # Ignore les clés inconnues (ex : "nom" d'un objectif ou clés d'interface)
+    noms = {f.name for f in fields(cls)}
+    return cls(**{cle: valeur for cle, valeur in donnees.items() if cle in noms})
+
+
+@dataclass(frozen=True)
+class Parametres:
+    """Paramètres d'un contrat, tels que saisis dans la barre latérale."""
+    capital_initial: float = 2000.0
+    frais_entree_ci: float = 0.045
+    versement_mensuel: float = 400.0
+    frais_entree_vp: float = 0.045
+    rendement_annuel: float = 0.05
+    frais_gestion: float = 0.008
+    rendement_phase_rachat: float = 0.03
+    option_fiscalite: str = OPTION_MOINS_8_ANS
+    abattement: float = ABATTEMENT_SEUL
+    # Facultatives : sans date d'ouverture, l'option fiscale s'applique à toute la simulation
+    date_ouverture: Optional[date] = None
+    date_naissance: Optional[date] = None
+    date_debut: Optional[date] = None
+
+    @classmethod
+    def depuis_dict(cls, donnees: Mapping[str, Any]) -> "Parametres":
+        return _depuis_mapping(cls, donnees)
+
+
+@dataclass(frozen=True)
+class Objectif:
+    """Rachats annuels de `montant_annuel` pendant `duree_retrait` ans après l'année `annee`."""
+    annee: int
+    montant_annuel: float
+    duree_retrait: int
+    nom: str = ""
+
+    @classmethod
+    def depuis_dict(cls, donnees: Mapping[str, Any]) -> "Objectif":
+        return _depuis_mapping(cls, donnees)
+
+
+@dataclass(frozen=True)
+class ModificationVersement:
+    """Versement mensuel remplacé par `montant` de l'année `debut` à l'année `fin` incluses."""
+    debut: int
+    fin: int
+    montant: float
+
+    @classmethod
+    def depuis_dict(cls, donnees: Mapping[str, Any]) -> "ModificationVersement":
+        return _depuis_mapping(cls, donnees)
+
+
+@dataclass(frozen=True)
+class VersementLibre:
+    """Versement exceptionnel effectué au cours de l'année `annee`."""
+    annee: int
+    montant: float
+
+    @classmethod
+    def depuis_dict(cls, donnees: Mapping[str, Any]) -> "VersementLibre":
+        return _depuis_mapping(cls, donnees)
+
+
+@dataclass(frozen=True)
+class Contrat:
+    """Un contrat du foyer : ses paramètres et son échéancier de versements.
+
+    `anciennete` est l'âge du contrat en début de simulation, en années : le contrat
+    vieillit ensuite d'un an par année simulée. Sans elle, l'ancienneté est fixée
+    par l'option fiscale des paramètres, comme pour un contrat seul.
+    """
+    params: Parametres
+    modifications: Sequence[ModificationVersement] = ()
+    versements_libres: Sequence[VersementLibre] = ()
+    anciennete: Optional[float] = None
@@ -0,0 +1,221 @@
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linprog
+
+from .fiscalite import BAREME_EN_VIGUEUR, BaremeFiscal, calculer_fiscalite_foyer, dates_annuelles, seuils_primes
+from .foyer import anciennetes_foyer
+from .lot import preparer_lot, simuler_lot
+from .modeles import Contrat, ModificationVersement, Objectif, Parametres, VersementLibre
+
+
+# Écart toléré (en euros) entre le besoin d'une année et le net effectivement disponible
+_TOLERANCE_BESOIN = 0.5
+
+_SERIES = ("capital_fin", "rachat", "epargne_investie", "part_plus_value", "pourcentage_plus_value")
+
+
+@dataclass(frozen=True)
+class CalendrierRachats:
+    """Calendrier de rachats minimisant la fiscalité, comparé au calendrier des objectifs.
+
+    Les tableaux par contrat ont la forme (contrats, années), le contrat principal
+    en premier. `besoins` est le net perçu chaque année avec le calendrier des
+    objectifs ; `tresorerie` le net retiré d'avance, en attente hors des contrats
+    en fin d'année. Les capitaux finaux incluent cette trésorerie.
+    """
+    annee: np.ndarray
+    besoins: np.ndarray
+    rachats: np.ndarray
+    fiscalite: np.ndarray
+    tresorerie: np.ndarray
+    rachats_naifs: np.ndarray
+    fiscalite_naive: np.ndarray
+    capital_final: float
+    capital_final_naif: float
+    iterations: int
+
+    @property
+    def economie(self) -> float:
+        """Fiscalité évitée sur toute la durée par rapport au calendrier des objectifs."""
+        return float(self.fiscalite_naive.sum() - self.fiscalite.sum())
+
+    def vers_dataframe(self) -> pd.DataFrame:
+        df = pd.DataFrame({
+            "Année": self.annee,
+            "Besoin net": self.besoins,
+            "Rachat actuel": self.rachats_naifs.sum(axis=0),
+            "Fiscalité actuelle": self.fiscalite_naive.sum(axis=0),
+            "Rachat optimisé": self.rachats.sum(axis=0),
+            "Fiscalité optimisée": self.fiscalite.sum(axis=0),
+            "Trésorerie": self.tresorerie,
+        })
+        if len(self.rachats) > 1:
+            for k, rachats in enumerate(self.rachats, start=1):
+                df[f"Rachat contrat {k}"] = rachats
+        return df
+
+
+def _precedent(serie: np.ndarray, initial) -> np.ndarray:
+    # Valeur de fin de l'année précédente, `initial` pour la première année
+    return np.concatenate([np.broadcast_to(np.asarray(initial, dtype=float), (len(serie), 1)), serie[:, :-1]], axis=1)
+
+
+def _programme_lineaire(besoins, valeur_finale_min, capital_final_sans_rachat, capital_disponible, croissance, part_plus_value, taux_impot,
+                        eligible, abattement, taux_tresorerie, bareme):
+    """Rachats (contrats, années) minimisant l'impôt, parts de plus-value et taux d'impôt figés.
+
+    Variables : rachats w, abattement imputé a (mêmes formes), puis trésorerie s par année.
+    Le capital est affine en w : chaque euro racheté l'année j manque à la fin de l'année t
+    à hauteur du produit des croissances de j à t (`cumul`).
+    """
+    nombre_contrats, duree = part_plus_value.shape
+    n = nombre_contrats * duree
+    taux_total = bareme.prelevements_sociaux + taux_impot
+
+    # cumul[k, t, j] = produit des croissances des années j à t (j <= t)
+    produits = np.cumprod(croissance, axis=1)
+    cumul = np.tril(produits[:, :, None] / np.concatenate([np.ones((nombre_contrats, 1)), produits[:, :-1]], axis=1)[:, None, :])
+
+    w = np.arange(n).reshape(nombre_contrats, duree)
+    a = w + n
+    s = 2 * n + np.arange(duree)
+    lignes_eq, colonnes_eq, valeurs_eq = [], [], []
+    t = np.broadcast_to(np.arange(duree), (nombre_contrats, duree))
+
+    # Net perçu + trésorerie de l'an passé - trésorerie de fin d'année = besoin
+    lignes_eq += [t.ravel(), t.ravel(), np.arange(duree), np.arange(1, duree)]
+    colonnes_eq += [w.ravel(), a.ravel(), s, s[:-1]]
+    valeurs_eq += [(1 - taux_total * part_plus_value).ravel(), taux_impot.ravel(), -np.ones(duree), np.full(duree - 1, 1 + taux_tresorerie)]
+    egalites = sparse.csr_matrix((np.concatenate(valeurs_eq), (np.concatenate(lignes_eq), np.concatenate(colonnes_eq))), shape=(duree, 2 * n + duree))
+
+    blocs = []
+    # Abattement imputé au plus égal à la plus-value rachetée : a - p w <= 0
+    blocs.append(sparse.hstack([sparse.diags(-part_plus_value.ravel()), sparse.identity(n), sparse.csr_matrix((n, duree))]))
+    # Abattement commun au foyer
+    blocs.append(sparse.hstack([sparse.csr_matrix((duree, n)), sparse.hstack([sparse.identity(duree)] * nombre_contrats), sparse.csr_matrix((duree, duree))]))
+    # Rachat plafonné au capital disponible en début d'année, diminué des rachats précédents capitalisés
+    disponibilite = np.eye(duree)[None] + np.concatenate([np.zeros((nombre_contrats, 1, duree)), cumul[:, :-1]], axis=1)
+    blocs.append(sparse.hstack([sparse.block_diag(list(disponibilite)), sparse.csr_matrix((n, n + duree))]))
+    # Valeur finale (contrats + trésorerie) au moins égale à celle du calendrier des objectifs
+    derniere = np.zeros(2 * n + duree)
+    derniere[w.ravel()] = cumul[:, -1].ravel()
+    derniere[s[-1]] = -1
+    blocs.append(sparse.csr_matrix(derniere))
+    inegalites = sparse.vstack(blocs).tocsr()
+    bornes_inegalites = np.concatenate([
+        np.zeros(n),
+        np.broadcast_to(abattement, (duree,)),
+        capital_disponible.ravel(),
+        [capital_final_sans_rachat - valeur_finale_min],
+    ])
+
+    cout = np.concatenate([(taux_total * part_plus_value).ravel(), -taux_impot.ravel(), np.zeros(duree)])
+    bornes = [(0, None)] * n + [(0, None if e else 0) for e in eligible.ravel()] + [(0, None)] * duree
+    solution = linprog(cout, A_ub=inegalites, b_ub=bornes_inegalites, A_eq=egalites, b_eq=besoins, bounds=bornes, method="highs")
+    if not solution.success:
+        return None
+    return np.maximum(solution.x[:n].reshape(nombre_contrats, duree), 0.0)
+
+
+def optimiser_rachats(params: Parametres,
+                      objectifs: Sequence[Objectif],
+                      modifications: Sequence[ModificationVersement] = (),
+                      versements_libres: Sequence[VersementLibre] = (),
+                      autres_contrats: Sequence[Contrat] = (),
+                      taux_tresorerie: float = 0.0,
+                      iterations: int = 5,
+                      bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> CalendrierRachats:
+    """Répartit les rachats dans le temps (et entre contrats) pour minimiser la fiscalité totale.
+
+    Le calendrier des objectifs rachète chaque année le montant demandé sur le
+    contrat principal. Le calendrier optimisé doit verser chaque année au moins
+    le même net, en avançant au besoin des rachats pour consommer l'abattement
+    annuel (plafond commun du foyer, `params.abattement`) : le net retiré d'avance
+    attend hors des contrats au `taux_tresorerie`. La valeur finale des contrats
+    et de la trésorerie ne peut pas être inférieure à celle du calendrier des objectifs.
+
+    La part de plus-value d'un rachat dépend des rachats passés : le problème est
+    résolu par programmes linéaires successifs (`scipy.optimize.linprog`), chacun
+    à parts de plus-value et taux d'impôt figés sur le calendrier précédent. Chaque
+    calendrier est réévalué exactement par `simuler_lot` ; le meilleur est retenu,
+    celui des objectifs à défaut.
+    """
+    contrats = [Contrat(params, modifications, versements_libres), *autres_contrats]
+    arguments = preparer_lot([c.params for c in contrats], [list(objectifs)] * len(contrats),
+                             [list(c.modifications) for c in contrats], [list(c.versements_libres) for c in contrats])
+    nombre_contrats, duree = arguments["rachats"].shape
+    # Ancienneté de chaque contrat et seuil de primes, année par année
+    anciennete = anciennetes_foyer(contrats, duree, bareme)
+    eligible = anciennete >= bareme.anciennete_reduite
+    seuils = seuils_primes(dates_annuelles(duree, arguments["date_debut"]))
+    capital_depart = arguments["capital_initial"] * (1 - arguments["frais_entree_ci"])
+    annee = np.arange(1, duree + 1)
+
+    def simuler_calendrier(rachats):
+        lot = simuler_lot(**dict(arguments, rachats=rachats), conserver=_SERIES)
+        epargne_avant = _precedent(lot.epargne_investie, arguments["capital_initial"][:, None])
+        fiscalite = calculer_fiscalite_foyer(lot.rachat, lot.part_plus_value, anciennete, epargne_avant, params.abattement, bareme, seuils)
+        return lot, epargne_avant, fiscalite
+
+    rachats_naifs = np.zeros((nombre_contrats, duree))
+    rachats_naifs[0] = arguments["rachats"][0]
+    lot, epargne_avant, fiscalite_naive = simuler_calendrier(rachats_naifs)
+    rachats_naifs = lot.rachat
+    besoins = (lot.rachat - fiscalite_naive).sum(axis=0)
+    valeur_finale_naive = float(lot.capital_fin[:, -1].sum())
+
+    meilleur = (float(fiscalite_naive.sum()), rachats_naifs, fiscalite_naive, np.zeros(duree), valeur_finale_naive, 0)
+    if meilleur[0] <= 0:
+        return CalendrierRachats(annee, besoins, rachats_naifs, fiscalite_naive, np.zeros(duree), rachats_naifs, fiscalite_naive,
+                                 valeur_finale_naive, valeur_finale_naive, 0)
+
+    # Dynamique du capital sans rachat : capital disponible et croissance de chaque année
+    sans_rachat = simuler_lot(**dict(arguments, rachats=np.zeros((nombre_contrats, duree))), conserver=("capital_fin",))
+    capital_disponible = _precedent(sans_rachat.capital_fin, capital_depart[:, None])
+    taux = np.where(annee > arguments["objectif_annee_max"][:, None],
+                    np.broadcast_to(arguments["rendement_phase_rachat"][:, None], (nombre_contrats, duree)),
+                    np.broadcast_to(arguments["rendement_annuel"][:, None], (nombre_contrats, duree)))
+    croissance = 1 + taux - arguments["frais_gestion"][:, None]
+
+    rachats = rachats_naifs
+    for iteration in range(1, iterations + 1):
+        part_plus_value = _precedent(lot.pourcentage_plus_value, 0.0)
+        # Le seuil du taux réduit porte sur les primes de tout le foyer, comme dans `calculer_fiscalite_foyer`
+        epargne_foyer = epargne_avant.sum(axis=0)
+        part_taux_reduit = np.where(eligible, np.minimum(1.0, seuils / np.maximum(epargne_foyer, seuils)), 0.0)
+        taux_impot = part_taux_reduit * bareme.taux_reduit + (1 - part_taux_reduit) * bareme.taux_forfaitaire
+        nouveaux = _programme_lineaire(besoins, valeur_finale_naive, sans_rachat.capital_fin[:, -1].sum(), capital_disponible, croissance, part_plus_value,
+                                       taux_impot, eligible, params.abattement, taux_tresorerie, bareme)
+        if nouveaux is None or np.abs(nouveaux - rachats).max() < 0.01:
+            break
+        rachats = nouveaux
+
+        lot, epargne_avant, fiscalite = simuler_calendrier(rachats)
+        net = (lot.rachat - fiscalite).sum(axis=0)
+        tresorerie = np.zeros(duree)
+        reserve = 0.0
+        for t in range(duree):
+            reserve = reserve * (1 + taux_tresorerie) + net[t] - besoins[t]
+            tresorerie[t] = reserve
+        valeur_finale = float(lot.capital_fin[:, -1].sum()) + tresorerie[-1]
+        admissible = tresorerie.min() >= -_TOLERANCE_BESOIN and valeur_finale >= valeur_finale_naive - _TOLERANCE_BESOIN
+        if admissible and fiscalite.sum() < meilleur[0]:
+            meilleur = (float(fiscalite.sum()), lot.rachat, fiscalite, np.maximum(tresorerie, 0.0), valeur_finale, iteration)
+
+    _, rachats, fiscalite, tresorerie, valeur_finale, iteration = meilleur
+    return CalendrierRachats(
+        annee=annee,
+        besoins=besoins,
+        rachats=rachats,
+        fiscalite=fiscalite,
+        tresorerie=tresorerie,
+        rachats_naifs=rachats_naifs,
+        fiscalite_naive=fiscalite_naive,
+        capital_final=valeur_finale,
+        capital_final_naif=valeur_finale_naive,
+        iterations=iteration,
+    )
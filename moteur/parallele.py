@@ -0,0 +1,166 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre
+from .simulation import calculer_duree_totale
+from .stochastique import PERCENTILES, LoiRendements, simuler_monte_carlo
+
+
+TAILLE_SHARD = 20_000
+
+
+@dataclass(frozen=True)
+class _Shard:
+    debut: int
+    fin: int
+    graine: np.random.SeedSequence
+
+
+def _liberer(memoires) -> None:
+    # Tous les segments sont supprimés même si l'un d'eux ne peut pas être fermé :
+    # un tampon encore exporté fait échouer `close()` (BufferError), pas `unlink()`
+    erreur = None
+    for memoire in memoires:
+        try:
+            memoire.close()
+        except BufferError as exc:
+            erreur = erreur or exc
+        finally:
+            memoire.unlink()
+    if erreur is not None:
+        raise erreur
+
+
+def _attacher(nom: str, forme, dtype):
+    memoire = SharedMemory(name=nom)
+    return memoire, np.ndarray(forme, dtype=dtype, buffer=memoire.buf)
+
+
+def _simuler_shard(entrees, loi, shard: _Shard, series, memoires, duree: int, nombre_chemins: int):
+    # Exécuté dans un processus du pool : écrit sa tranche de chemins en mémoire partagée
+    chocs = loi.chocs(np.random.default_rng(shard.graine), (shard.fin - shard.debut, duree))
+    resultat = simuler_monte_carlo(*entrees, loi=loi, chocs=chocs, conserver=series)
+    attaches = []
+    try:
+        for serie in series:
+            memoire, tableau = _attacher(memoires[serie], (nombre_chemins, duree), np.float64)
+            attaches.append(memoire)
+            tableau[shard.debut:shard.fin] = getattr(resultat.lot, serie)
+        memoire, finance = _attacher(memoires["finance"], (nombre_chemins,), np.bool_)
+        attaches.append(memoire)
+        finance[shard.debut:shard.fin] = resultat.finance
+    finally:
+        for memoire in attaches:
+            memoire.close()
+    return shard.fin - shard.debut
+
+
+class ResultatMonteCarloParallele:
+    """Séries (chemins, années) agrégées en mémoire partagée.
+
+    Les tableaux sont des vues sur des segments de mémoire partagée : utiliser
+    l'objet comme gestionnaire de contexte, ou appeler `fermer()`, pour les libérer.
+    Les vues ne sont plus valides ensuite : une série à conserver au-delà doit en
+    être copiée (`np.array(vue)`) avant.
+    """
+
+    def __init__(self, memoires: dict, series: dict, finance: np.ndarray):
+        self._memoires = memoires
+        self.series = series
+        self.finance = finance
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fermer()
+
+    def __len__(self):
+        return len(self.finance)
+
+    def percentiles(self, champ: str = "capital_fin", niveaux: Iterable[float] = PERCENTILES) -> np.ndarray:
+        return np.percentile(self.series[champ], list(niveaux), axis=0)
+
+    @property
+    def probabilite_financement(self) -> float:
+        return float(self.finance.mean())
+
+    def fermer(self):
+        # Les vues de l'objet sont abandonnées avant la fermeture des segments
+        self.series, self.finance = {}, None
+        memoires, self._memoires = list(self._memoires.values()), {}
+        _liberer(memoires)
+
+
+def decouper(nombre_chemins: int, graine: Optional[int], taille_shard: int = TAILLE_SHARD) -> list:
+    """Découpe les chemins en tranches munies chacune d'une graine dérivée de `graine`.
+
+    Le découpage ne dépend que du nombre de chemins et de la taille des tranches,
+    pas du nombre de processus : les résultats sont reproductibles et peuvent être
+    mis en cache quel que soit le nombre de cœurs utilisés.
+    """
+    nombre_shards = math.ceil(nombre_chemins / taille_shard)
+    graines = np.random.SeedSequence(graine).spawn(nombre_shards)
+    return [
+        _Shard(debut=i * taille_shard, fin=min((i + 1) * taille_shard, nombre_chemins), graine=graines[i])
+        for i in range(nombre_shards)
+    ]
+
+
+def simuler_monte_carlo_parallele(params: Parametres,
+                                  objectifs: Sequence[Objectif] = (),
+                                  modifications: Sequence[ModificationVersement] = (),
+                                  versements_libres: Sequence[VersementLibre] = (),
+                                  loi: LoiRendements = LoiRendements(),
+                                  nombre_chemins: int = 1_000_000,
+                                  graine: Optional[int] = 0,
+                                  series: Iterable[str] = ("capital_fin",),
+                                  processus: Optional[int] = None,
+                                  taille_shard: int = TAILLE_SHARD,
+                                  contexte: str = "spawn") -> ResultatMonteCarloParallele:
+    """Répartit une simulation Monte Carlo sur un pool de processus.
+
+    Chaque tranche de `taille_shard` chemins est simulée par `simuler_monte_carlo`
+    dans un processus du pool, qui écrit directement ses lignes dans des tableaux
+    en mémoire partagée : aucun résultat ne transite par pickle. Avec le contexte
+    "spawn", le script appelant doit protéger son point d'entrée par
+    `if __name__ == "__main__":`. Seul le moteur annuel est couvert : le moteur
+    mensuel (`simuler_mensuel`) ne simule qu'un chemin à la fois et n'a pas
+    d'équivalent vectorisé sur lequel répartir les tranches.
+    """
+    objectifs, modifications, versements_libres = list(objectifs), list(modifications), list(versements_libres)
+    duree = calculer_duree_totale(objectifs)
+    series = tuple(series)
+    processus = processus or os.cpu_count() or 1
+
+    memoires = {}
+    try:
+        for serie in series:
+            memoires[serie] = SharedMemory(create=True, size=max(nombre_chemins * duree * 8, 1))
+        memoires["finance"] = SharedMemory(create=True, size=max(nombre_chemins, 1))
+        noms = {cle: memoire.name for cle, memoire in memoires.items()}
+
+        entrees = (params, objectifs, modifications, versements_libres)
+        shards = decouper(nombre_chemins, graine, taille_shard)
+        taches = [(entrees, loi, shard, series, noms, duree, nombre_chemins) for shard in shards]
+        if processus == 1 or len(shards) == 1:
+            for tache in taches:
+                _simuler_shard(*tache)
+        else:
+            with ProcessPoolExecutor(max_workers=min(processus, len(shards)), mp_context=get_context(contexte)) as pool:
+                for _ in pool.map(_simuler_shard, *zip(*taches)):
+                    pass
+    except BaseException:
+        _liberer(memoires.values())
+        raise
+
+    vues = {serie: np.ndarray((nombre_chemins, duree), dtype=np.float64, buffer=memoires[serie].buf) for serie in series}
+    finance = np.ndarray((nombre_chemins,), dtype=np.bool_, buffer=memoires["finance"].buf)
+    return ResultatMonteCarloParallele(memoires, vues, finance)
@@ -0,0 +1,179 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from multiprocessing import get_context
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre
+from .parallele import TAILLE_SHARD, decouper
+from .simulation import calculer_duree_totale
+from .stochastique import PERCENTILES, LoiRendements, ResultatMonteCarlo, simuler_monte_carlo
+from .tri import SERIES_RENTABILITE, Rentabilite, calculer_rentabilite
+
+
+class SketchQuantiles:
+    """Sketch de quantiles à précision relative garantie, un par année (type DDSketch).
+
+    Chaque valeur est rangée dans un seau logarithmique de raison
+    gamma = (1 + precision) / (1 - precision) : tout quantile est restitué à
+    `precision` près en relatif. Les sketches de même configuration se
+    fusionnent par simple addition des compteurs, quel que soit l'ordre.
+    Les valeurs de magnitude inférieure à `valeur_min` comptent pour zéro.
+    """
+
+    def __init__(self, duree: int, precision: float = 0.01, valeur_min: float = 0.01, valeur_max: float = 1e13):
+        self.duree = duree
+        self.precision = precision
+        self.valeur_min = valeur_min
+        self.gamma = (1 + precision) / (1 - precision)
+        self._log_gamma = math.log(self.gamma)
+        self._indice_min = math.floor(math.log(valeur_min) / self._log_gamma)
+        self._nombre_seaux = math.ceil(math.log(valeur_max) / self._log_gamma) - self._indice_min + 1
+        self.positifs = np.zeros((duree, self._nombre_seaux), dtype=np.int64)
+        self.negatifs = np.zeros((duree, self._nombre_seaux), dtype=np.int64)
+        self.zeros = np.zeros(duree, dtype=np.int64)
+
+    @property
+    def effectif(self) -> np.ndarray:
+        return self.positifs.sum(axis=1) + self.negatifs.sum(axis=1) + self.zeros
+
+    def _compter(self, magnitudes: np.ndarray, annees: np.ndarray) -> np.ndarray:
+        indices = np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64) - self._indice_min
+        indices = np.clip(indices, 0, self._nombre_seaux - 1)
+        comptes = np.bincount(annees * self._nombre_seaux + indices, minlength=self.duree * self._nombre_seaux)
+        return comptes.reshape(self.duree, self._nombre_seaux)
+
+    def ajouter(self, valeurs: np.ndarray):
+        """Ajoute un bloc de chemins de forme (chemins, duree)."""
+        valeurs = np.asarray(valeurs, dtype=float)
+        annees = np.broadcast_to(np.arange(self.duree), valeurs.shape)
+        magnitudes = np.abs(valeurs)
+        nuls = magnitudes < self.valeur_min
+        self.zeros += nuls.sum(axis=0)
+        positifs = (valeurs > 0) & ~nuls
+        negatifs = (valeurs < 0) & ~nuls
+        self.positifs += self._compter(magnitudes[positifs], annees[positifs])
+        self.negatifs += self._compter(magnitudes[negatifs], annees[negatifs])
+        return self
+
+    def fusionner(self, autre: "SketchQuantiles"):
+        if (autre.duree, autre.gamma, autre._indice_min, autre._nombre_seaux) != \
+                (self.duree, self.gamma, self._indice_min, self._nombre_seaux):
+            raise ValueError("Sketches de configurations différentes : fusion impossible")
+        self.positifs += autre.positifs
+        self.negatifs += autre.negatifs
+        self.zeros += autre.zeros
+        return self
+
+    def quantiles(self, niveaux: Iterable[float]) -> np.ndarray:
+        """Quantiles (niveaux entre 0 et 1) par année, de forme (niveaux, duree)."""
+        niveaux = np.asarray(list(niveaux), dtype=float)
+        # Seaux dans l'ordre croissant des valeurs : négatifs, zéro, positifs
+        comptes = np.concatenate([self.negatifs[:, ::-1], self.zeros[:, None], self.positifs], axis=1)
+        cumul = np.cumsum(comptes, axis=1)
+        effectif = cumul[:, -1]
+        representants = 2 * self.gamma ** (np.arange(self._nombre_seaux) + self._indice_min) / (self.gamma + 1)
+        valeurs = np.concatenate([-representants[::-1], [0.0], representants])
+
+        rangs = niveaux[:, None] * np.maximum(effectif - 1, 0)[None, :]
+        seaux = (cumul[None, :, :] > rangs[:, :, None]).argmax(axis=2)
+        return np.where(effectif > 0, valeurs[seaux], np.nan)
+
+
+class StatistiquesMonteCarlo:
+    """Résumé en mémoire constante d'un grand nombre de chemins Monte Carlo.
+
+    Conserve un sketch par année du capital de fin d'année et du rachat net,
+    l'histogramme exact de l'année de ruine (première année où un rachat demandé
+    n'est pas versé en totalité, 0 si jamais) et le nombre de chemins financés.
+    Les TRI brut et net des chemins ont chacun un sketch à une seule « année ».
+    """
+
+    def __init__(self, duree: int, precision: float = 0.01):
+        self.duree = duree
+        self.capital_fin = SketchQuantiles(duree, precision)
+        self.rachat_net = SketchQuantiles(duree, precision)
+        self.tri_brut = SketchQuantiles(1, precision, valeur_min=1e-6, valeur_max=1e3)
+        self.tri_net = SketchQuantiles(1, precision, valeur_min=1e-6, valeur_max=1e3)
+        self.annee_ruine = np.zeros(duree + 1, dtype=np.int64)
+        self.nombre_chemins = 0
+
+    def __len__(self):
+        return self.nombre_chemins
+
+    def ajouter(self, resultat: ResultatMonteCarlo, rentabilite: Optional[Rentabilite] = None):
+        lot = resultat.lot
+        self.capital_fin.ajouter(lot.capital_fin)
+        self.rachat_net.ajouter(lot.rachat_net)
+        if rentabilite is not None:
+            self.tri_brut.ajouter(rentabilite.tri_brut[:, None])
+            self.tri_net.ajouter(rentabilite.tri_net[:, None])
+        echec = (resultat.rachats_demandes > 0) & (lot.capital_debut + lot.rachat < resultat.rachats_demandes)
+        ruine = np.where(echec.any(axis=1), echec.argmax(axis=1) + 1, 0)
+        self.annee_ruine += np.bincount(ruine, minlength=self.duree + 1)
+        self.nombre_chemins += len(resultat)
+        return self
+
+    def fusionner(self, autre: "StatistiquesMonteCarlo"):
+        self.capital_fin.fusionner(autre.capital_fin)
+        self.rachat_net.fusionner(autre.rachat_net)
+        self.tri_brut.fusionner(autre.tri_brut)
+        self.tri_net.fusionner(autre.tri_net)
+        self.annee_ruine += autre.annee_ruine
+        self.nombre_chemins += autre.nombre_chemins
+        return self
+
+    def percentiles(self, champ: str = "capital_fin", niveaux: Iterable[float] = PERCENTILES) -> np.ndarray:
+        """Même interface que `ResultatMonteCarlo.percentiles` (niveaux en pourcentage) ; (niveaux, 1) pour un TRI."""
+        return getattr(self, champ).quantiles(np.asarray(list(niveaux)) / 100)
+
+    @property
+    def probabilite_financement(self) -> float:
+        return float(self.annee_ruine[0] / self.nombre_chemins) if self.nombre_chemins else 0.0
+
+    @property
+    def probabilite_ruine_cumulee(self) -> np.ndarray:
+        """Probabilité d'avoir été ruiné au plus tard à chaque année."""
+        return np.cumsum(self.annee_ruine[1:]) / max(self.nombre_chemins, 1)
+
+
+def _statistiques_shard(entrees, loi, shard, duree: int, precision: float) -> StatistiquesMonteCarlo:
+    chocs = loi.chocs(np.random.default_rng(shard.graine), (shard.fin - shard.debut, duree))
+    resultat = simuler_monte_carlo(*entrees, loi=loi, chocs=chocs, conserver=("capital_debut", *SERIES_RENTABILITE))
+    return StatistiquesMonteCarlo(duree, precision).ajouter(resultat, calculer_rentabilite(resultat.lot, entrees[0]))
+
+
+def quantiles_monte_carlo(params: Parametres,
+                          objectifs: Sequence[Objectif] = (),
+                          modifications: Sequence[ModificationVersement] = (),
+                          versements_libres: Sequence[VersementLibre] = (),
+                          loi: LoiRendements = LoiRendements(),
+                          nombre_chemins: int = 1_000_000,
+                          graine: Optional[int] = 0,
+                          taille_bloc: int = TAILLE_SHARD,
+                          precision: float = 0.01,
+                          processus: int = 1,
+                          contexte: str = "spawn") -> StatistiquesMonteCarlo:
+    """Simule les chemins par blocs et n'en garde que des sketches fusionnables.
+
+    La mémoire dépend de la taille des blocs, pas du nombre de chemins. Les blocs
+    et leurs graines sont ceux de `decouper` : les chemins simulés sont les mêmes
+    que ceux de `simuler_monte_carlo_parallele`. Avec plusieurs processus, chaque
+    processus renvoie les sketches de son bloc et le parent les fusionne.
+    """
+    entrees = (params, list(objectifs), list(modifications), list(versements_libres))
+    duree = calculer_duree_totale(entrees[1])
+    blocs = decouper(nombre_chemins, graine, taille_bloc)
+    if processus == 1 or len(blocs) == 1:
+        statistiques = StatistiquesMonteCarlo(duree, precision)
+        for bloc in blocs:
+            statistiques.fusionner(_statistiques_shard(entrees, loi, bloc, duree, precision))
+        return statistiques
+
+    n = len(blocs)
+    with ProcessPoolExecutor(max_workers=min(processus or os.cpu_count() or 1, n), mp_context=get_context(contexte)) as pool:
+        partiels = pool.map(_statistiques_shard, [entrees] * n, [loi] * n, blocs, [duree] * n, [precision] * n)
+        return reduce(StatistiquesMonteCarlo.fusionner, partiels, StatistiquesMonteCarlo(duree, precision))
@@ -0,0 +1,279 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional, Sequence
+
+import numpy as np
+
+from .fiscalite import BAREME_EN_VIGUEUR, BaremeFiscal, ajouter_mois, detailler_fiscalite_primes, seuils_primes
+from .mensuel import _capital_mensuel, echeancier_mensuel, recurrence_lineaire
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre, anciennetes_annuelles
+from .simulation import ResultatSimulation, calculer_duree_totale
+
+
+# Un lot par versement. `prime` (montant brut versé, base de la part de capital) et `parts`
+# sont divisés par le coefficient de conservation du registre au jour du versement :
+# un rachat au prorata réduit tous les lots du même facteur sans les réécrire.
+LOT = np.dtype([("date", "datetime64[D]"), ("prime", "f8"), ("parts", "f8")])
+
+# Répartition d'un rachat entre les lots
+REPARTITION = np.dtype([("date", "datetime64[D]"), ("capital", "f8"), ("plus_value", "f8")])
+
+# En dessous, les lots sont renormalisés pour rester loin du plus petit flottant représentable
+_CONSERVATION_MIN = 1e-100
+
+
+@dataclass(frozen=True)
+class RachatRegistre:
+    """Ventilation d'un rachat entre primes anciennes (avant la réforme) et nouvelles."""
+    montant: float
+    capital: float
+    plus_value_anciennes: float
+    plus_value_nouvelles: float
+
+
+class Registre:
+    """Registre des versements d'un contrat : un lot daté par versement, avec sa prime.
+
+    Les lots sont stockés dans un tableau structuré (`LOT`) agrandi par doublement.
+    La valeur d'un lot est son nombre de parts fois `valeur_part` ; les rachats sont
+    répartis au prorata de la valeur de chaque lot. Les totaux des primes anciennes
+    (versées avant `bareme.date_reforme`) et nouvelles sont tenus à jour à chaque
+    versement : valeur, primes et rachats coûtent O(1), la répartition lot par lot O(lots).
+    """
+
+    def __init__(self, capacite: int = 64, bareme: BaremeFiscal = BAREME_EN_VIGUEUR):
+        self._lots = np.zeros(capacite, dtype=LOT)
+        self.taille = 0
+        self.valeur_part = 1.0
+        self.conservation = 1.0
+        self.date_reforme = np.datetime64(bareme.date_reforme, "D")
+        # Sommes des primes et des parts normalisées : [primes anciennes, primes nouvelles]
+        self._primes = np.zeros(2)
+        self._parts = np.zeros(2)
+
+    def copie(self) -> "Registre":
+        copie = Registre.__new__(Registre)
+        copie.__dict__.update(self.__dict__)
+        copie._lots, copie._primes, copie._parts = self._lots.copy(), self._primes.copy(), self._parts.copy()
+        return copie
+
+    @classmethod
+    def depuis_lots(cls, lots: np.ndarray, valeur_part: float = 1.0, bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> "Registre":
+        """Registre contenant `lots` (au format `LOT`, primes restantes et parts actuelles)."""
+        registre = cls(capacite=max(len(lots), 1), bareme=bareme)
+        registre._lots[:len(lots)] = lots
+        registre.taille = len(lots)
+        registre.valeur_part = valeur_part
+        anciens = registre.anciens
+        registre._primes = np.array([lots["prime"][anciens].sum(), lots["prime"][~anciens].sum()])
+        registre._parts = np.array([lots["parts"][anciens].sum(), lots["parts"][~anciens].sum()])
+        return registre
+
+    def __len__(self):
+        return self.taille
+
+    @property
+    def lots(self) -> np.ndarray:
+        """Lots avec leur prime restante et leurs parts actuelles (copie)."""
+        lots = self._lots[:self.taille].copy()
+        lots["prime"] *= self.conservation
+        lots["parts"] *= self.conservation
+        return lots
+
+    @property
+    def anciens(self) -> np.ndarray:
+        """Masque des lots versés avant la réforme."""
+        return self._lots["date"][:self.taille] < self.date_reforme
+
+    def verser(self, jour, prime, montant_investi) -> None:
+        """Ajoute un ou plusieurs lots ; `montant_investi` est la prime nette des frais d'entrée."""
+        jour, prime, montant_investi = np.broadcast_arrays(np.asarray(jour, dtype="datetime64[D]"),
+                                                           np.asarray(prime, dtype=float),
+                                                           np.asarray(montant_investi, dtype=float))
+        n = jour.size
+        if self.taille + n > len(self._lots):
+            agrandi = np.zeros(max(2 * len(self._lots), self.taille + n), dtype=LOT)
+            agrandi[:self.taille] = self._lots[:self.taille]
+            self._lots = agrandi
+        nouveaux = self._lots[self.taille:self.taille + n]
+        nouveaux["date"] = jour.ravel()
+        nouveaux["prime"] = prime.ravel() / self.conservation
+        nouveaux["parts"] = montant_investi.ravel() / (self.valeur_part * self.conservation)
+        self.taille += n
+
+        anciens = nouveaux["date"] < self.date_reforme
+        self._primes += [nouveaux["prime"][anciens].sum(), nouveaux["prime"][~anciens].sum()]
+        self._parts += [nouveaux["parts"][anciens].sum(), nouveaux["parts"][~anciens].sum()]
+
+    def capitaliser(self, croissance: float) -> None:
+        """Applique la croissance nette de frais de la période à tous les lots."""
+        self.valeur_part *= croissance
+
+    def valeur(self) -> float:
+        return float(self._parts.sum()) * self.valeur_part * self.conservation
+
+    def primes(self) -> np.ndarray:
+        """Primes restantes : [primes anciennes, primes nouvelles]."""
+        return self._primes * self.conservation
+
+    def repartition(self, montant: float) -> np.ndarray:
+        """Part de capital et de plus-value de chaque lot dans un rachat de `montant`, sans l'effectuer."""
+        lots = self.lots
+        valeur = self.valeur()
+        fraction = min(montant / valeur, 1.0) if valeur > 0 else 0.0
+        repartition = np.empty(self.taille, dtype=REPARTITION)
+        repartition["date"] = lots["date"]
+        repartition["capital"] = fraction * lots["prime"]
+        repartition["plus_value"] = fraction * (lots["parts"] * self.valeur_part - lots["prime"])
+        return repartition
+
+    def racheter(self, montant: float) -> RachatRegistre:
+        """Rachat au prorata de tous les lots, plafonné à la valeur du registre."""
+        valeur = self.valeur()
+        if valeur <= 0 or montant <= 0:
+            return RachatRegistre(0.0, 0.0, 0.0, 0.0)
+        fraction = min(montant / valeur, 1.0)
+        primes = self.primes()
+        plus_values = fraction * (self._parts * self.valeur_part * self.conservation - primes)
+        capital = fraction * primes.sum()
+
+        if fraction >= 1.0:
+            # Rachat total : les lots restent au registre, vidés
+            self._lots["prime"][:self.taille] = 0.0
+            self._lots["parts"][:self.taille] = 0.0
+            self._primes[:] = 0.0
+            self._parts[:] = 0.0
+            self.conservation = 1.0
+        else:
+            self.conservation *= 1 - fraction
+            if self.conservation < _CONSERVATION_MIN:
+                for champ in ("prime", "parts"):
+                    self._lots[champ][:self.taille] *= self.conservation
+                self._primes *= self.conservation
+                self._parts *= self.conservation
+                self.conservation = 1.0
+        return RachatRegistre(min(montant, valeur), float(capital), float(plus_values[0]), float(plus_values[1]))
+
+
+@dataclass(frozen=True)
+class ResultatRegistre:
+    """Simulation tenue lot par lot : séries annuelles, registre final et ventilation de la plus-value rachetée."""
+    annuel: ResultatSimulation
+    registre: Registre
+    plus_value_anciennes: np.ndarray
+    plus_value_nouvelles: np.ndarray
+
+    def vers_dataframe(self):
+        return self.annuel.vers_dataframe()
+
+
+def simuler_registre(params: Parametres,
+                     objectifs: Sequence[Objectif] = (),
+                     modifications: Sequence[ModificationVersement] = (),
+                     versements_libres: Sequence[VersementLibre] = (),
+                     debut: Optional[date] = None,
+                     registre_initial: Optional[Registre] = None,
+                     duree_totale: Optional[int] = None,
+                     bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> ResultatRegistre:
+    """Simule le contrat au pas mensuel en tenant un lot par versement.
+
+    Mêmes conventions que `simuler_mensuel` (versements en début de mois, rachats
+    par douzièmes, versements libres en décembre), dont les capitaux et l'épargne
+    investie sont retrouvés. La part de plus-value de chaque rachat est exacte et
+    ventilée entre primes anciennes et nouvelles, imposées par `detailler_fiscalite_primes`.
+    Le capital initial est un lot daté de `debut` (par défaut `params.date_debut`,
+    sinon aujourd'hui) ; `registre_initial` apporte en plus les versements déjà
+    effectués sur le contrat.
+
+    Rien n'est parcouru mois par mois : un rachat au prorata conserve la même
+    fraction de chaque lot, si bien que primes et valeurs de chaque catégorie
+    suivent les récurrences de l'épargne investie (`recurrence_lineaire`), et que
+    chaque lot final est sa prime (ou sa valeur) multipliée par les fractions
+    conservées et les croissances des mois qui suivent son versement.
+    """
+    if duree_totale is None:
+        duree_totale = calculer_duree_totale(objectifs)
+    debut = debut or params.date_debut or date.today()
+    echeancier = echeancier_mensuel(params, objectifs, modifications, versements_libres, duree_totale)
+    versements_bruts, versements = echeancier["versements_bruts"], echeancier["versements"]
+    libres_bruts, libres, taux_mensuel = echeancier["libres_bruts"], echeancier["libres"], echeancier["taux_mensuel"]
+    croissance = (1 + taux_mensuel) * (1 - params.frais_gestion / 12)
+    jours = ajouter_mois(np.datetime64(debut, "D"), np.arange(12 * duree_totale))
+
+    # Lots présents au départ : versements déjà effectués, puis capital initial
+    initial = Registre(bareme=bareme) if registre_initial is None else registre_initial.copie()
+    if params.capital_initial > 0:
+        initial.verser(debut, params.capital_initial, params.capital_initial * (1 - params.frais_entree_ci))
+    lots_initiaux = initial.lots
+    valeurs_initiales = lots_initiaux["parts"] * initial.valeur_part
+
+    capital, verses = _capital_mensuel(croissance, versements, echeancier["rachats"], libres, initial.valeur())
+    avant_rachat = capital[:-1] + versements
+    conserve = np.divide(capital[:-1] + versements - verses, avant_rachat, out=np.ones_like(avant_rachat), where=avant_rachat > 0)
+
+    # Primes restantes et valeur de chaque catégorie, [anciennes, nouvelles]
+    date_reforme = np.datetime64(bareme.date_reforme, "D")
+    anciens_mois = jours < date_reforme
+    anciens_initiaux = lots_initiaux["date"] < date_reforme
+    primes, plus_values = [], []
+    for mois, initiaux in ((anciens_mois, anciens_initiaux), (~anciens_mois, ~anciens_initiaux)):
+        vb, v = np.where(mois, versements_bruts, 0.0), np.where(mois, versements, 0.0)
+        lb, lv = np.where(mois, libres_bruts, 0.0), np.where(mois, libres, 0.0)
+        primes_categorie = recurrence_lineaire(conserve, conserve * vb + lb, lots_initiaux["prime"][initiaux].sum())
+        valeurs_categorie = recurrence_lineaire(croissance * conserve, croissance * conserve * v + lv, valeurs_initiales[initiaux].sum())
+        primes.append(primes_categorie)
+        plus_values.append((1 - conserve) * (valeurs_categorie[:-1] + v - primes_categorie[:-1] - vb))
+    primes = np.array(primes)
+    epargne = primes.sum(axis=0)
+    part_capital = (1 - conserve) * (epargne[:-1] + versements_bruts)
+
+    # Lots finaux : fraction conservée et croissance depuis le versement
+    survie = np.append(np.cumprod(conserve[::-1])[::-1], 1.0)
+    croissance_restante = np.append(np.cumprod(croissance[::-1])[::-1], 1.0)
+    valeur_part = initial.valeur_part * croissance_restante[0]
+    mensuels, exceptionnels = np.flatnonzero(versements_bruts > 0), np.flatnonzero(libres_bruts > 0)
+    lots = np.concatenate([lots_initiaux, np.empty(len(mensuels) + len(exceptionnels), dtype=LOT)])
+    lots["prime"][:len(lots_initiaux)] *= survie[0]
+    lots["parts"][:len(lots_initiaux)] *= survie[0]
+    nouveaux = lots[len(lots_initiaux):]
+    # Un versement libre arrive après le rachat et la croissance de son mois
+    for tranche, indices, decalage, bruts, investis in ((slice(0, len(mensuels)), mensuels, 0, versements_bruts, versements),
+                                                        (slice(len(mensuels), None), exceptionnels, 1, libres_bruts, libres)):
+        nouveaux["date"][tranche] = jours[indices]
+        nouveaux["prime"][tranche] = bruts[indices] * survie[indices + decalage]
+        nouveaux["parts"][tranche] = (investis[indices] * croissance_restante[indices + decalage]
+                                      * survie[indices + decalage] / valeur_part)
+    registre = Registre.depuis_lots(lots[np.argsort(lots["date"], kind="stable")], valeur_part, bareme)
+
+    def par_annee(serie):
+        return serie.reshape(duree_totale, 12).sum(axis=1)
+
+    rachat = par_annee(verses)
+    plus_value_anciennes, plus_value_nouvelles = par_annee(plus_values[0]), par_annee(plus_values[1])
+    detail = detailler_fiscalite_primes(plus_value_anciennes, plus_value_nouvelles, primes[0, :-1:12], primes[1, :-1:12],
+                                        anciennetes_annuelles(params.option_fiscalite, duree_totale, params.date_ouverture, debut, bareme),
+                                        params.abattement, bareme, seuils_primes(jours[::12]))
+    fiscalite = np.where(rachat > 0, detail.total, 0.0)
+    disponible = avant_rachat - verses
+    capital_fin = capital[12::12]
+    epargne_fin = epargne[12::12]
+    positif = (epargne_fin > 0) & (capital_fin > 0)
+
+    annuel = ResultatSimulation(
+        annee=np.arange(1, duree_totale + 1),
+        capital_debut=capital[:-1:12],
+        vp_net=par_annee(versements),
+        rendement=par_annee(disponible * taux_mensuel),
+        frais_gestion=par_annee(disponible * (1 + taux_mensuel) * params.frais_gestion / 12),
+        capital_fin=capital_fin,
+        rachat=rachat,
+        epargne_investie=epargne_fin,
+        vp_exceptionnel=par_annee(libres_bruts),
+        part_capital=par_annee(part_capital),
+        part_plus_value=np.where(rachat > 0, plus_value_anciennes + plus_value_nouvelles, 0.0),
+        fiscalite=fiscalite,
+        pourcentage_plus_value=np.where(positif, 1 - epargne_fin / np.where(positif, capital_fin, 1.0), 0.0),
+        rachat_net=rachat - fiscalite,
+    )
+    return ResultatRegistre(annuel=annuel, registre=registre,
+                            plus_value_anciennes=plus_value_anciennes, plus_value_nouvelles=plus_value_nouvelles)
@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+
+from .lot import preparer_lot, simuler_lot
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre
+
+
+@dataclass(frozen=True)
+class GrilleSensibilite:
+    """Capitaux obtenus sur une grille rendement × frais de gestion, de forme (rendements, frais)."""
+    rendements: np.ndarray
+    frais_gestion: np.ndarray
+    capital_final: np.ndarray
+    capital_fin_epargne: np.ndarray
+    annee_fin_epargne: int
+
+
+def grille_sensibilite(params: Parametres,
+                       objectifs: Sequence[Objectif],
+                       modifications: Sequence[ModificationVersement] = (),
+                       versements_libres: Sequence[VersementLibre] = (),
+                       rendements=None,
+                       frais_gestion=None) -> GrilleSensibilite:
+    """Évalue toute la grille rendement annuel × frais de gestion en un seul appel à `simuler_lot`.
+
+    Le rendement de la phase de rachat reste celui des paramètres. Le capital de
+    fin d'épargne est lu à l'année du dernier objectif (`calculer_duree_capi_max`).
+    """
+    rendements = np.linspace(0.0, max(0.10, 2 * params.rendement_annuel), 50) if rendements is None else np.asarray(rendements, dtype=float)
+    frais_gestion = np.linspace(0.0, 0.03, 50) if frais_gestion is None else np.asarray(frais_gestion, dtype=float)
+    grille_rendements, grille_frais = np.meshgrid(rendements, frais_gestion, indexing="ij")
+
+    arguments = preparer_lot([params], [list(objectifs)], [list(modifications)], [list(versements_libres)])
+    arguments.update(rendement_annuel=grille_rendements.ravel(), frais_gestion=grille_frais.ravel())
+    lot = simuler_lot(**arguments, conserver=("capital_fin",))
+
+    annee_fin_epargne = int(arguments["objectif_annee_max"][0])
+    forme = grille_rendements.shape
+    return GrilleSensibilite(
+        rendements=rendements,
+        frais_gestion=frais_gestion,
+        capital_final=lot.serie_finale("capital_fin").reshape(forme),
+        capital_fin_epargne=lot.capital_fin[:, annee_fin_epargne - 1].reshape(forme),
+        annee_fin_epargne=annee_fin_epargne,
+    )
@@ -0,0 +1,224 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .calendrier import compiler_versements, compiler_versements_libres
+from .fiscalite import calculer_fiscalite, dates_annuelles, seuils_primes
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre, anciennetes_annuelles
+
+
+DUREE_PAR_DEFAUT = 60
+
+# Somme des prorata (12 - mois) / 12 : janvier est investi 12 mois, février 11 mois, etc.
+PRORATA_VERSEMENTS = sum((12 - mois) / 12 for mois in range(12))
+
+# Correspondance entre les séries du résultat et les colonnes du tableau affiché
+COLONNES = {
+    "annee": "Année",
+    "capital_debut": "Capital initial (NET)",
+    "vp_net": "VP NET",
+    "rendement": "Rendement",
+    "frais_gestion": "Frais de gestion",
+    "capital_fin": "Capital fin d'année (NET)",
+    "rachat": "Rachat",
+    "epargne_investie": "Épargne investie",
+    "vp_exceptionnel": "VP exceptionnel",
+    "part_capital": "Part capital",
+    "part_plus_value": "Part intérêt",
+    "fiscalite": "Fiscalite",
+    "pourcentage_plus_value": "%",
+    "rachat_net": "Rachat net",
+}
+
+
+def calculer_duree_capi_max(objectifs: Sequence[Objectif]) -> int:
+    if not objectifs:  # Vérifie si la liste est vide
+        return DUREE_PAR_DEFAUT  # Durée par défaut si aucun objectif n'est défini
+    return max(obj.annee for obj in objectifs)
+
+
+def calculer_duree_totale(objectifs: Sequence[Objectif]) -> int:
+    if not objectifs:  # Vérifie si la liste est vide
+        return DUREE_PAR_DEFAUT  # Durée par défaut si aucun objectif n'est défini
+    # Calculer la durée maximale en fonction des objectifs
+    return max(obj.annee + obj.duree_retrait for obj in objectifs)
+
+
+@dataclass(frozen=True)
+class ResultatSimulation:
+    """Séries annuelles d'une simulation, une valeur par année (index 0 = année 1)."""
+    annee: np.ndarray
+    capital_debut: np.ndarray
+    vp_net: np.ndarray
+    rendement: np.ndarray
+    frais_gestion: np.ndarray
+    capital_fin: np.ndarray
+    rachat: np.ndarray
+    epargne_investie: np.ndarray
+    vp_exceptionnel: np.ndarray
+    part_capital: np.ndarray
+    part_plus_value: np.ndarray
+    fiscalite: np.ndarray
+    pourcentage_plus_value: np.ndarray
+    rachat_net: np.ndarray
+
+    def __len__(self):
+        return len(self.annee)
+
+    def vers_dataframe(self) -> pd.DataFrame:
+        """Tableau numérique avec les libellés de colonnes de l'application ("%" en pourcentage)."""
+        df = pd.DataFrame({libelle: getattr(self, champ) for champ, libelle in COLONNES.items()})
+        df["%"] = df["%"] * 100
+        return df
+
+
+@dataclass(frozen=True)
+class EtatAnnuel:
+    """État du contrat à la fin de l'année `annee`, suffisant pour reprendre la simulation."""
+    annee: int
+    capital: np.ndarray
+    epargne_investie: np.ndarray
+    pourcentage_plus_value: np.ndarray
+
+
+def calculer_rachats(objectifs: Sequence[Objectif], duree_totale: int) -> np.ndarray:
+    """Montant de rachat demandé pour chaque année de la simulation."""
+    rachats = np.zeros(duree_totale)
+    for objectif in objectifs:
+        annee_debut = objectif.annee + 1
+        fin = min(annee_debut + int(objectif.duree_retrait), duree_totale + 1)
+        if annee_debut < fin:
+            rachats[annee_debut - 1:fin - 1] += objectif.montant_annuel
+    return rachats
+
+
+def simuler(params: Parametres,
+            objectifs: Sequence[Objectif] = (),
+            modifications: Sequence[ModificationVersement] = (),
+            versements_libres: Sequence[VersementLibre] = (),
+            duree_totale: Optional[int] = None,
+            etat_initial: Optional[EtatAnnuel] = None) -> ResultatSimulation:
+    """Simule le contrat année par année, rachats des objectifs compris.
+
+    Sans `duree_totale`, la simulation couvre jusqu'à la fin du dernier objectif
+    (60 ans par défaut s'il n'y en a aucun). Avec `etat_initial`, la simulation
+    reprend à l'année qui suit cet état et ne contient que les années suivantes.
+    La fiscalité, sans effet sur le capital, est calculée après la boucle pour
+    toutes les années à la fois par `calculer_fiscalite`, avec l'ancienneté du
+    contrat et le seuil de primes propres à chaque année.
+    """
+    if duree_totale is None:
+        duree_totale = calculer_duree_totale(objectifs)
+    objectif_annee_max = calculer_duree_capi_max(objectifs)
+
+    frais_entree_vp = params.frais_entree_vp
+    rendement = params.rendement_annuel
+    frais_gestion = params.frais_gestion
+    rendement_phase_rachat = params.rendement_phase_rachat
+
+    if etat_initial is None:
+        depart = 0
+        capital_debut_annee = params.capital_initial * (1 - params.frais_entree_ci)
+        epargne_investie = params.capital_initial
+        pourcentage_plus_value_precedent = 0
+    else:
+        depart = etat_initial.annee
+        capital_debut_annee = float(etat_initial.capital)
+        epargne_investie = float(etat_initial.epargne_investie)
+        pourcentage_plus_value_precedent = float(etat_initial.pourcentage_plus_value)
+
+    rachats = calculer_rachats(objectifs, duree_totale).tolist()
+    versements_mensuels = compiler_versements(params.versement_mensuel, modifications, duree_totale).tolist()
+    versements_exceptionnels = compiler_versements_libres(versements_libres, duree_totale).tolist()
+
+    lignes = []
+    epargne_avant_rachat = []
+    for annee in range(depart + 1, duree_totale + 1):
+        versement_mensuel_courant = versements_mensuels[annee - 1]
+        versement_mensuel_investi = versement_mensuel_courant * (1 - frais_entree_vp)
+        versements_actifs = annee <= objectif_annee_max and versement_mensuel_courant > 0
+
+        # Traitement du rachat pour l'année en cours
+        rachat_annee = min(rachats[annee - 1], capital_debut_annee)
+
+        # Déduire le rachat du capital de début d'année
+        capital_debut_annee -= rachat_annee
+
+        # Les primes avant rachat déterminent la part de plus-value au taux réduit
+        epargne_avant_rachat.append(epargne_investie)
+        if rachat_annee > 0:
+            part_plus_value = pourcentage_plus_value_precedent * rachat_annee
+            part_capital = rachat_annee - part_plus_value
+
+            # Mise à jour de l'épargne investie après le rachat
+            epargne_investie = max(0, epargne_investie - part_capital)
+        else:
+            part_plus_value, part_capital = 0, 0
+
+        if annee > objectif_annee_max:
+            rendement_annuel_total = capital_debut_annee * rendement_phase_rachat
+        else:
+            rendement_annuel_total = capital_debut_annee * rendement
+
+        vp_net = versement_mensuel_investi * 12 if versements_actifs else 0
+        if versements_actifs:
+            rendement_versements_net = versement_mensuel_investi * PRORATA_VERSEMENTS * rendement
+        else:
+            rendement_versements_net = 0
+
+        frais_gestion_total = capital_debut_annee * frais_gestion
+        if versements_actifs:
+            frais_gestion_total += versement_mensuel_investi * PRORATA_VERSEMENTS * frais_gestion
+
+        versement_libre_exceptionnel = versements_exceptionnels[annee - 1]
+
+        capital_fin_annee = (
+            capital_debut_annee
+            + vp_net
+            + rendement_annuel_total
+            + rendement_versements_net
+            - frais_gestion_total
+            + versement_libre_exceptionnel * (1 - frais_entree_vp)
+        )
+
+        # Mise à jour de l'épargne investie pour l'année en cours
+        if versements_actifs:
+            epargne_investie += versement_mensuel_courant * 12
+        epargne_investie += versement_libre_exceptionnel
+
+        # Calcul du nouveau pourcentage de plus-value
+        pourcentage_plus_value = 1 - (epargne_investie / capital_fin_annee) if epargne_investie > 0 and capital_fin_annee > 0 else 0
+
+        lignes.append((
+            annee,
+            capital_debut_annee,
+            vp_net,
+            rendement_annuel_total + rendement_versements_net,
+            frais_gestion_total,
+            capital_fin_annee,
+            rachat_annee,
+            epargne_investie,
+            versement_libre_exceptionnel,
+            part_capital,
+            part_plus_value,
+            0.0,  # fiscalité
+            pourcentage_plus_value,
+            0.0,  # rachat net
+        ))
+
+        # Préparation pour l'année suivante
+        capital_debut_annee = capital_fin_annee
+        pourcentage_plus_value_precedent = pourcentage_plus_value
+
+    colonnes = np.array(lignes, dtype=float).reshape(len(lignes), len(COLONNES)).T
+    series = dict(zip(COLONNES, colonnes))
+    series["annee"] = series["annee"].astype(int)
+    # Ancienneté du contrat et seuil de primes de chaque année de rachat
+    anciennete = anciennetes_annuelles(params.option_fiscalite, duree_totale, params.date_ouverture, params.date_debut)[depart:]
+    seuils = seuils_primes(dates_annuelles(duree_totale, params.date_debut))[depart:]
+    series["fiscalite"] = calculer_fiscalite(series["rachat"], series["part_plus_value"], anciennete,
+                                             np.array(epargne_avant_rachat), params.abattement, seuil_primes=seuils)
+    series["rachat_net"] = series["rachat"] - series["fiscalite"]
+    return ResultatSimulation(**series)
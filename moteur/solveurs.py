@@ -0,0 +1,182 @@
+import math
+from dataclasses import dataclass, replace
+from typing import Sequence
+
+import numpy as np
+from scipy.optimize import brentq
+
+from .lot import etat_fin_annee, preparer_lot, rachats_objectifs, simuler_lot
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre
+from .simulation import ResultatSimulation, calculer_duree_totale, calculer_rachats, simuler
+
+
+VARIABLES = ("versement_mensuel", "capital_initial")
+
+
+@dataclass(frozen=True)
+class Solution:
+    """Valeur trouvée par un solveur et simulation correspondante."""
+    valeur: float
+    resultat: ResultatSimulation
+    evaluations: int
+
+
+def marge_financement(capital_disponible: np.ndarray, rachats_demandes: np.ndarray) -> np.ndarray:
+    """Plus petit écart entre capital disponible et rachat demandé, sur les années avec rachat.
+
+    Les tableaux ont la forme (..., duree). Une marge positive ou nulle signifie
+    qu'aucun rachat n'est plafonné ; +inf s'il n'y a aucun rachat.
+    """
+    ecart = np.where(rachats_demandes > 0, capital_disponible - rachats_demandes, np.inf)
+    return ecart.min(axis=-1, initial=np.inf)
+
+
+# Écart toléré entre le montant perçu et l'objectif (arrondis de l'inversion de la fiscalité)
+_TOLERANCE_VERSE = 1e-6
+
+
+def _marge(resultat: ResultatSimulation, rachats_demandes: np.ndarray, net: bool = False) -> float:
+    # Capital restant après chaque rachat, diminué du manque à percevoir si le rachat a été plafonné :
+    # positive tant que tout est versé, elle change de signe au seuil de financement
+    verse = resultat.rachat_net if net else resultat.rachat
+    manque = np.minimum(verse - rachats_demandes + _TOLERANCE_VERSE, 0.0)
+    return float(marge_financement(resultat.capital_debut + manque + rachats_demandes, rachats_demandes))
+
+
+def resoudre_financement(params: Parametres,
+                         objectifs: Sequence[Objectif],
+                         modifications: Sequence[ModificationVersement] = (),
+                         versements_libres: Sequence[VersementLibre] = (),
+                         variable: str = "versement_mensuel",
+                         tolerance: float = 0.01,
+                         net: bool = True) -> Solution:
+    """Plus petit versement mensuel (ou capital initial) finançant tous les objectifs.
+
+    Avec `net`, le montant annuel d'un objectif est ce que l'épargnant doit
+    percevoir après fiscalité : chaque année, le rachat est porté au brut
+    correspondant (`simuler_lot` avec `rachats_nets`) et l'objectif est financé
+    si ce rachat brut est versé en totalité. Sans `net`, le montant de l'objectif
+    est le rachat brut, la fiscalité étant prélevée dessus comme dans `simuler`.
+    La recherche encadre d'abord la solution par doublement, puis applique la
+    méthode de Brent sur la marge de financement, qui change de signe au seuil.
+    """
+    if variable not in VARIABLES:
+        raise ValueError(f"Variable inconnue : {variable!r} (attendu : {', '.join(VARIABLES)})")
+
+    rachats_demandes = calculer_rachats(objectifs, calculer_duree_totale(objectifs))
+    evaluations = 0
+
+    def evaluer(valeur):
+        nonlocal evaluations
+        evaluations += 1
+        arguments = preparer_lot([replace(params, **{variable: valeur})], [list(objectifs)],
+                                 [list(modifications)], [list(versements_libres)])
+        return simuler_lot(**arguments, rachats_nets=net).scenario(0)
+
+    def marge(valeur):
+        return _marge(evaluer(valeur), rachats_demandes, net)
+
+    if marge(0.0) >= 0:
+        return Solution(0.0, evaluer(0.0), evaluations)
+
+    # Point de départ : les rachats demandés, répartis sur les mois d'épargne pour un versement mensuel
+    borne_haute = max(float(rachats_demandes.sum()), 1.0)
+    if variable == "versement_mensuel":
+        borne_haute /= 12 * max(obj.annee for obj in objectifs)
+    borne_basse = 0.0
+    while marge(borne_haute) < 0:
+        borne_basse, borne_haute = borne_haute, borne_haute * 2
+        if borne_haute > 1e12:
+            raise ValueError("Aucune valeur ne permet de financer tous les objectifs")
+
+    racine = brentq(marge, borne_basse, borne_haute, xtol=tolerance / 2)
+
+    # Arrondi au centime supérieur pour garantir le financement
+    pas = math.ceil(racine / tolerance)
+    resultat = evaluer(pas * tolerance)
+    while _marge(resultat, rachats_demandes, net) < 0:
+        pas += 1
+        resultat = evaluer(pas * tolerance)
+    return Solution(pas * tolerance, resultat, evaluations)
+
+
+@dataclass(frozen=True)
+class RetraitSoutenable:
+    """Rachat annuel maximal d'un objectif, brut et net de fiscalité pour chaque année de retrait."""
+    objectif: Objectif
+    montant_brut: float
+    montant_net: np.ndarray
+    evaluations: int
+
+    @property
+    def montant_net_moyen(self) -> float:
+        return float(self.montant_net.mean()) if len(self.montant_net) else 0.0
+
+
+def retraits_soutenables(params: Parametres,
+                         objectifs: Sequence[Objectif],
+                         modifications: Sequence[ModificationVersement] = (),
+                         versements_libres: Sequence[VersementLibre] = (),
+                         points: int = 64,
+                         tolerance: float = 0.01) -> list:
+    """Plus grand `montant_annuel` que le contrat peut soutenir pour chaque objectif.
+
+    Les autres objectifs sont conservés. Un montant est soutenable si tous les
+    rachats des années de retrait de l'objectif, y compris ceux des objectifs qui
+    se chevauchent avec lui, sont versés en totalité ; les objectifs ultérieurs
+    peuvent en revanche ne plus l'être. L'état du contrat à la fin de l'année
+    `annee` de l'objectif ne dépend pas de son montant : chaque sonde reprend la
+    simulation depuis cet état jusqu'à la dernière année de retrait, et `points`
+    sondes sont évaluées dans un même appel à `simuler_lot`.
+    """
+    resultats = []
+    for i, objectif in enumerate(objectifs):
+        sans_objectif = list(objectifs)
+        sans_objectif[i] = replace(objectif, montant_annuel=0.0)
+        arguments = preparer_lot([params], [sans_objectif],
+                                 [list(modifications)], [list(versements_libres)])
+        # Inutile de simuler au-delà de la dernière année de retrait de l'objectif
+        duree = min(objectif.annee + int(objectif.duree_retrait), arguments["duree"])
+        for cle in ("versement_mensuel", "rachats", "versements_libres"):
+            arguments[cle] = arguments[cle][:, :duree]
+        arguments.update(duree=duree, duree_totale=duree)
+        rachats_autres = arguments.pop("rachats")
+        masque = rachats_objectifs([[objectif.annee]], [[1.0]], [[objectif.duree_retrait]], duree)
+        annees = slice(objectif.annee, duree)
+
+        etat = etat_fin_annee(simuler(params, sans_objectif, modifications, versements_libres), objectif.annee)
+        evaluations = 0
+
+        def sonder(montants):
+            nonlocal evaluations
+            evaluations += 1
+            rachats = rachats_autres + montants[:, None] * masque
+            lot = simuler_lot(**arguments, rachats=rachats, etat_initial=etat,
+                              conserver=("capital_debut", "rachat", "rachat_net"))
+            marge = marge_financement(lot.capital_debut + lot.rachat, rachats[:, annees])
+            return lot, marge >= 0
+
+        # Le premier rachat ne peut dépasser le capital disponible à la fin de l'année `annee`
+        borne_basse, borne_haute = 0.0, float(etat.capital)
+        _, finance = sonder(np.array([borne_basse, borne_haute]))
+        if not finance[0]:
+            borne_haute = 0.0
+        elif finance[1]:
+            borne_basse = borne_haute
+        while borne_haute - borne_basse > tolerance:
+            candidats = np.linspace(borne_basse, borne_haute, points + 2)[1:-1]
+            _, finance = sonder(candidats)
+            premier_echec = int(np.argmin(finance)) if not finance.all() else points
+            if premier_echec > 0:
+                borne_basse = candidats[premier_echec - 1]
+            if premier_echec < points:
+                borne_haute = candidats[premier_echec]
+
+        montant = math.floor(borne_basse / tolerance) * tolerance
+        lot, _ = sonder(np.array([montant]))
+        retraits = masque[0, annees] > 0
+        rachat, rachat_net = lot.rachat[0, retraits], lot.rachat_net[0, retraits]
+        # Part nette de l'objectif au prorata de son montant dans le rachat total de l'année
+        montant_net = np.divide(montant * rachat_net, rachat, out=np.zeros_like(rachat), where=rachat > 0)
+        resultats.append(RetraitSoutenable(objectif, montant, montant_net, evaluations))
+    return resultats
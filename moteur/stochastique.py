@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+from scipy import stats
+
+from .lot import ResultatLot, preparer_lot, simuler_lot
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre
+from .solveurs import marge_financement
+
+
+PERCENTILES = (5, 50, 95)
+
+# Un rendement annuel ne peut pas faire perdre plus que la totalité du capital
+RENDEMENT_MINIMUM = -0.99
+
+
+@dataclass(frozen=True)
+class LoiRendements:
+    """Loi des chocs annuels appliqués autour des rendements moyens des paramètres.
+
+    Sans `degres_liberte`, les chocs sont gaussiens ; sinon ils suivent une loi de
+    Student (queues épaisses) ramenée à la même volatilité.
+    """
+    volatilite: float = 0.10
+    volatilite_phase_rachat: Optional[float] = None
+    degres_liberte: Optional[float] = None
+
+    def chocs(self, generateur: np.random.Generator, forme) -> np.ndarray:
+        """Chocs centrés réduits de forme `forme`."""
+        if self.degres_liberte is None:
+            return generateur.standard_normal(forme)
+        return generateur.standard_t(self.degres_liberte, forme) * self._reduction()
+
+    def chocs_depuis_uniformes(self, uniformes: np.ndarray) -> np.ndarray:
+        """Mêmes chocs obtenus par inversion de la fonction de répartition."""
+        if self.degres_liberte is None:
+            return stats.norm.ppf(uniformes)
+        return stats.t.ppf(uniformes, self.degres_liberte) * self._reduction()
+
+    def _reduction(self) -> float:
+        # Variance d'une Student à nu degrés de liberté : nu / (nu - 2)
+        if self.degres_liberte <= 2:
+            raise ValueError("La loi de Student doit avoir plus de 2 degrés de liberté")
+        return np.sqrt((self.degres_liberte - 2) / self.degres_liberte)
+
+    def rendements(self, params: Parametres, chocs: np.ndarray):
+        """Rendements annuels (phase d'épargne, phase de rachat) pour une matrice de chocs."""
+        volatilite_rachat = self.volatilite if self.volatilite_phase_rachat is None else self.volatilite_phase_rachat
+        rendement = np.maximum(params.rendement_annuel + self.volatilite * chocs, RENDEMENT_MINIMUM)
+        rendement_rachat = np.maximum(params.rendement_phase_rachat + volatilite_rachat * chocs, RENDEMENT_MINIMUM)
+        return rendement, rendement_rachat
+
+
+@dataclass(frozen=True)
+class ResultatMonteCarlo:
+    """Chemins simulés (un scénario par chemin) et rachats demandés par année."""
+    lot: ResultatLot
+    rachats_demandes: np.ndarray
+
+    def __len__(self):
+        return len(self.lot)
+
+    def percentiles(self, champ: str = "capital_fin", niveaux: Iterable[float] = PERCENTILES) -> np.ndarray:
+        """Percentiles par année de la série `champ`, de forme (niveaux, duree)."""
+        return np.percentile(getattr(self.lot, champ), list(niveaux), axis=0)
+
+    @property
+    def finance(self) -> np.ndarray:
+        """Chemins dont tous les rachats demandés ont été versés en totalité."""
+        return marge_financement(self.lot.capital_debut + self.lot.rachat, self.rachats_demandes) >= 0
+
+    @property
+    def probabilite_financement(self) -> float:
+        return float(self.finance.mean())
+
+
+def simuler_monte_carlo(params: Parametres,
+                        objectifs: Sequence[Objectif] = (),
+                        modifications: Sequence[ModificationVersement] = (),
+                        versements_libres: Sequence[VersementLibre] = (),
+                        loi: LoiRendements = LoiRendements(),
+                        nombre_chemins: int = 10_000,
+                        graine: Optional[int] = None,
+                        chocs: Optional[np.ndarray] = None,
+                        conserver: Optional[Iterable[str]] = ("capital_debut", "capital_fin", "rachat",
+                                                              "rachat_net", "epargne_investie")) -> ResultatMonteCarlo:
+    """Simule `nombre_chemins` trajectoires de rendements aléatoires en un seul appel à `simuler_lot`.
+
+    Les chocs forment une matrice (chemins, années) ; ils peuvent être fournis
+    directement via `chocs` (échantillonnage quasi-aléatoire, séries historiques…).
+    Versements, frais, rachats et fiscalité suivent exactement le moteur déterministe.
+    """
+    arguments = preparer_lot([params], [list(objectifs)], [list(modifications)], [list(versements_libres)])
+    if chocs is None:
+        chocs = loi.chocs(np.random.default_rng(graine), (nombre_chemins, arguments["duree"]))
+    rendement, rendement_rachat = loi.rendements(params, chocs)
+    arguments.update(rendement_annuel=rendement, rendement_phase_rachat=rendement_rachat)
+
+    conserver = None if conserver is None else tuple(dict.fromkeys([*conserver, "capital_debut", "rachat"]))
+    lot = simuler_lot(**arguments, conserver=conserver)
+    return ResultatMonteCarlo(lot=lot, rachats_demandes=arguments["rachats"][0])
@@ -0,0 +1,146 @@
+from dataclasses import dataclass
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from .lot import preparer_lot, simuler_lot
+from .modeles import ModificationVersement, Objectif, Parametres, VersementLibre
+from .stochastique import RENDEMENT_MINIMUM, LoiRendements, ResultatMonteCarlo
+
+
+REBALANCEMENTS = ("annuel", "mensuel")
+
+
+@dataclass(frozen=True)
+class Support:
+    """Support d'investissement : rendement annuel moyen, frais de gestion annuels et volatilité annuelle."""
+    nom: str
+    rendement: float
+    frais_gestion: float
+    volatilite: float = 0.0
+
+
+FONDS_EUROS = Support("Fonds euros", rendement=0.025, frais_gestion=0.006)
+UNITES_DE_COMPTE = Support("Unités de compte", rendement=0.06, frais_gestion=0.009, volatilite=0.15)
+
+# Profil équilibré : 30 % en fonds euros, 70 % en unités de compte
+REPARTITION_PAR_DEFAUT = (0.3, 0.7)
+
+
+def allocations_pilotees(objectifs: Sequence[Objectif],
+                         duree: int,
+                         repartition: Sequence[float] = REPARTITION_PAR_DEFAUT,
+                         indice_securise: int = 0,
+                         horizon: int = 10,
+                         part_securisee_finale: float = 1.0) -> np.ndarray:
+    """Allocation cible de chaque année, de forme (duree, supports), d'une gestion pilotée par horizon.
+
+    Loin de tout objectif, l'allocation est `repartition`. Pendant les `horizon`
+    années qui précèdent le premier rachat d'un objectif, la part du support
+    sécurisé progresse linéairement jusqu'à `part_securisee_finale`, atteinte
+    pendant les rachats ; les autres supports gardent leurs proportions relatives.
+    Après le dernier objectif, l'allocation reste sécurisée.
+    """
+    repartition = np.asarray(repartition, dtype=float)
+    annees = np.arange(1, duree + 1)[:, None]
+    debuts = np.array([objectif.annee + 1 for objectif in objectifs], dtype=float)
+    fins = np.array([objectif.annee + objectif.duree_retrait for objectif in objectifs], dtype=float)
+
+    # Nombre d'années avant le prochain rachat : 0 pendant les rachats et après le dernier objectif
+    en_cours = ((annees >= debuts) & (annees <= fins)).any(axis=1)
+    a_venir = np.where(debuts > annees, debuts - annees, np.inf).min(axis=1, initial=np.inf)
+    termine = (annees > fins).all(axis=1) & (len(fins) > 0)
+    distance = np.where(en_cours | termine, 0.0, a_venir)
+
+    progression = np.clip(1 - distance / horizon, 0.0, 1.0)
+    part_initiale = repartition[indice_securise]
+    part_securisee = part_initiale + progression * (part_securisee_finale - part_initiale)
+    autres = np.delete(repartition, indice_securise)
+    reste_initial = autres.sum()
+    proportions = autres / reste_initial if reste_initial > 0 else np.zeros_like(autres)
+    allocations = np.insert((1 - part_securisee)[:, None] * proportions, indice_securise, part_securisee, axis=1)
+    return allocations
+
+
+def taux_portefeuille(supports: Sequence[Support], allocations: np.ndarray, rendements_supports=None, rebalancement: str = "annuel"):
+    """Rendement et frais annuels d'un portefeuille ramené chaque période à `allocations`.
+
+    `allocations` et `rendements_supports` ont les supports en dernier axe ; leurs
+    autres axes (chemins, années) sont diffusés entre eux. Avec un rééquilibrage
+    annuel, le portefeuille rapporte la moyenne pondérée des rendements ; avec un
+    rééquilibrage mensuel, la moyenne pondérée des rendements mensuels équivalents,
+    composée sur douze mois.
+    """
+    if rebalancement not in REBALANCEMENTS:
+        raise ValueError(f"Rééquilibrage inconnu : {rebalancement!r} (attendu : {', '.join(REBALANCEMENTS)})")
+    if rendements_supports is None:
+        rendements_supports = np.array([support.rendement for support in supports])
+    frais = np.array([support.frais_gestion for support in supports])
+    if rebalancement == "annuel":
+        rendement = (allocations * rendements_supports).sum(axis=-1)
+    else:
+        mensuels = (1 + rendements_supports) ** (1 / 12) - 1
+        rendement = (1 + (allocations * mensuels).sum(axis=-1)) ** 12 - 1
+    return rendement, (allocations * frais).sum(axis=-1)
+
+
+@dataclass(frozen=True)
+class ResultatSupports(ResultatMonteCarlo):
+    """Simulation multi-supports : chemins du contrat, allocations cibles et rendements de chaque support."""
+    supports: tuple = ()
+    allocations: Optional[np.ndarray] = None
+    rendements_supports: Optional[np.ndarray] = None
+
+    def capital_par_support(self, champ: str = "capital_debut") -> np.ndarray:
+        """Série `champ` répartie selon l'allocation de l'année, de forme (chemins, années, supports)."""
+        return getattr(self.lot, champ)[..., None] * self.allocations
+
+
+def simuler_supports(params: Parametres,
+                     objectifs: Sequence[Objectif] = (),
+                     modifications: Sequence[ModificationVersement] = (),
+                     versements_libres: Sequence[VersementLibre] = (),
+                     supports: Sequence[Support] = (FONDS_EUROS, UNITES_DE_COMPTE),
+                     allocations: Optional[np.ndarray] = None,
+                     rebalancement: str = "annuel",
+                     loi: Optional[LoiRendements] = None,
+                     nombre_chemins: int = 10_000,
+                     graine: Optional[int] = None,
+                     correlations: Optional[np.ndarray] = None,
+                     conserver: Optional[Iterable[str]] = ("capital_debut", "capital_fin", "rachat",
+                                                           "rachat_net", "epargne_investie")) -> ResultatSupports:
+    """Simule le contrat réparti entre plusieurs supports, rééquilibré vers `allocations`.
+
+    Les rendements et frais des supports remplacent ceux des paramètres, y compris
+    le rendement de phase de rachat : la sécurisation passe par les allocations
+    (`allocations_pilotees` par défaut), de forme (duree, supports) ou
+    (chemins, duree, supports). Le portefeuille rééquilibré se ramène à un support
+    unique aux taux annuels de `taux_portefeuille`, simulé par `simuler_lot`.
+
+    Avec `loi`, chaque support reçoit chaque année un choc de la loi (seule sa forme,
+    gaussienne ou Student, est utilisée) multiplié par sa propre volatilité ;
+    `correlations` lie les chocs des supports entre eux.
+    """
+    arguments = preparer_lot([params], [list(objectifs)], [list(modifications)], [list(versements_libres)])
+    duree = arguments["duree"]
+    if allocations is None:
+        allocations = allocations_pilotees(objectifs, duree)
+    allocations = np.asarray(allocations, dtype=float)
+
+    rendements_supports = np.array([support.rendement for support in supports])
+    if loi is not None:
+        chocs = loi.chocs(np.random.default_rng(graine), (nombre_chemins, duree, len(supports)))
+        if correlations is not None:
+            chocs = chocs @ np.linalg.cholesky(np.asarray(correlations, dtype=float)).T
+        volatilites = np.array([support.volatilite for support in supports])
+        rendements_supports = np.maximum(rendements_supports + volatilites * chocs, RENDEMENT_MINIMUM)
+
+    rendement, frais = taux_portefeuille(supports, allocations, rendements_supports, rebalancement)
+    rendement = np.broadcast_to(rendement, np.broadcast_shapes(rendement.shape, (duree,))).reshape(-1, duree)
+    frais = frais.reshape(-1, duree)
+    arguments.update(rendement_annuel=rendement, rendement_phase_rachat=rendement, frais_gestion=frais)
+
+    conserver = None if conserver is None else tuple(dict.fromkeys([*conserver, "capital_debut", "rachat"]))
+    lot = simuler_lot(**arguments, conserver=conserver)
+    return ResultatSupports(lot=lot, rachats_demandes=arguments["rachats"][0], supports=tuple(supports),
+                            allocations=allocations, rendements_supports=rendements_supports)
@@ -0,0 +1,208 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from .fiscalite import BAREME_EN_VIGUEUR, BaremeFiscal, calculer_fiscalite, dates_annuelles, seuils_primes
+from .lot import par_scenario, series_scenarios
+from .modeles import Parametres, anciennetes_annuelles
+from .simulation import PRORATA_VERSEMENTS
+
+
+# Séries du moteur nécessaires au calcul de la rentabilité (à conserver dans `simuler_lot`)
+SERIES_RENTABILITE = ("capital_fin", "rachat", "rachat_net", "vp_net", "vp_exceptionnel", "frais_gestion", "epargne_investie")
+
+# Les versements mensuels de l'année rapportent PRORATA_VERSEMENTS mois de rendement :
+# ils équivalent à un versement unique effectué à cette fraction de l'année
+INSTANT_VERSEMENTS = 1 - PRORATA_VERSEMENTS / 12
+
+
+def calculer_tri(flux, instants, iterations: int = 100, tolerance: float = 1e-12, depart=None) -> np.ndarray:
+    """Taux de rendement interne de chaque vecteur de flux, par une méthode de Newton vectorisée.
+
+    `flux` est de forme (..., flux) et `instants` (en années, positifs) de forme (flux,).
+    Tous les vecteurs avancent ensemble, en ln(1 + taux), à partir d'une
+    estimation tirée des flux ; quand elle n'est pas définie, le taux `depart`
+    du vecteur (par exemple son rendement moyen) la remplace. Dès qu'un vecteur a
+    encadré sa racine, tout pas de Newton qui sortirait de l'encadrement est
+    remplacé par une bissection. Seuls les vecteurs non encore convergés sont
+    recalculés. NaN pour un vecteur sans changement de signe ou qui ne converge pas.
+    """
+    flux = np.asarray(flux, dtype=float)
+    forme = flux.shape[:-1]
+    flux = flux.reshape(-1, flux.shape[-1])
+    instants = np.asarray(instants, dtype=float)
+    # Actualisation en deux temps : puissances entières de exp(-x), puis une par partie fractionnaire des instants
+    entiers = np.floor(instants).astype(int)
+    # Arrondi : k + 0.46 - k ne tombe pas toujours sur la même fraction, et chaque fraction coûte un polynôme
+    fractions, groupes = np.unique(np.round(instants - entiers, 9), return_inverse=True)
+    degres = np.arange(entiers.max() + 1)
+    # Regroupe les flux par (fraction, degré) : un polynôme en exp(-x) par fraction, de forme (degrés, vecteurs)
+    # pour que chaque coefficient soit une ligne contiguë
+    colonnes = np.ascontiguousarray(flux.T)
+    coefficients = np.zeros((len(fractions), len(degres), len(flux)))
+    for colonne, (groupe, entier) in enumerate(zip(groupes, entiers)):
+        coefficients[groupe, entier] += colonnes[colonne]
+    coefficients_derivee = coefficients * (degres[None, :] + fractions[:, None])[:, :, None]
+
+    def horner(polynome, z, selection):
+        # Somme des polynome[k] z^k, du plus haut degré au plus bas
+        somme = polynome[-1][selection].copy()
+        for coefficient in polynome[-2::-1]:
+            somme *= z
+            somme += coefficient[selection]
+        return somme
+
+    def valeur_actuelle(x, lignes):
+        # Tant que la plupart des vecteurs sont en cours, tous sont évalués plutôt que d'en copier les coefficients
+        selection = slice(None) if 2 * len(lignes) > len(flux) else lignes
+        z = np.exp(-x[selection])
+        valeur, derivee = 0.0, 0.0
+        for fraction, polynome, polynome_derivee in zip(fractions, coefficients, coefficients_derivee):
+            poids = np.exp(-x[selection] * fraction)
+            valeur = valeur + poids * horner(polynome, z, selection)
+            derivee = derivee - poids * horner(polynome_derivee, z, selection)
+        if isinstance(selection, slice):
+            return valeur[lignes], derivee[lignes]
+        return valeur, derivee
+
+    # Départ : taux qui égalise les entrées et les sorties, chacune concentrée à son instant moyen
+    valeurs_absolues = np.abs(flux)
+    total_entrees = (valeurs_absolues.sum(axis=1) + flux.sum(axis=1)) / 2
+    total_sorties = total_entrees - flux.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        instant_entrees = (valeurs_absolues @ instants + flux @ instants) / 2 / total_entrees
+        instant_sorties = (valeurs_absolues @ instants - flux @ instants) / 2 / total_sorties
+        x = np.log(total_entrees / total_sorties) / (instant_entrees - instant_sorties)
+        repli = np.log1p(0.03 if depart is None else np.broadcast_to(np.asarray(depart, dtype=float), forme).reshape(-1))
+        x = np.where(np.isnan(x), np.where(np.isfinite(repli), repli, np.log1p(0.03)), x)
+    x = np.clip(np.nan_to_num(x, posinf=4.0, neginf=-4.0), -4.0, 4.0)
+
+    # Encadrement : `bas` du côté du signe de départ, `haut` inconnu (NaN) tant que le signe n'a pas changé
+    bas, haut = x.copy(), np.full_like(x, np.nan)
+    signe_depart, residu = np.zeros_like(x), np.zeros_like(x)
+    converge = (total_entrees == 0) | (total_sorties == 0)
+    for iteration in range(iterations):
+        lignes = np.flatnonzero(~converge)
+        if not len(lignes):
+            break
+        valeur, derivee = valeur_actuelle(x, lignes)
+        if iteration == 0:
+            signe_depart[lignes] = np.sign(valeur)
+        cote_bas = np.sign(valeur) == signe_depart[lignes]
+        bas[lignes] = np.where(cote_bas, x[lignes], bas[lignes])
+        haut[lignes] = np.where(cote_bas, haut[lignes], x[lignes])
+        pas = np.divide(valeur, derivee, out=np.full_like(valeur, np.inf), where=derivee != 0)
+        newton = np.clip(x[lignes] - np.clip(pas, -1.0, 1.0), -5.0, 5.0)
+        encadree = ~np.isnan(haut[lignes])
+        hors_encadrement = encadree & ((newton - bas[lignes]) * (newton - haut[lignes]) > 0)
+        suivant = np.where(hors_encadrement, (bas[lignes] + haut[lignes]) / 2, newton)
+        converge[lignes] = np.abs(suivant - x[lignes]) <= tolerance
+        residu[lignes] = np.abs(valeur)
+        x[lignes] = suivant
+    # Un vecteur arrêté en bord d'intervalle sans avoir annulé sa valeur actuelle n'a pas de racine
+    valide = converge & (total_entrees > 0) & (total_sorties > 0) & (residu <= 1e-9 * (total_entrees + total_sorties))
+    return np.where(valide, np.expm1(x), np.nan).reshape(forme)
+
+
+@dataclass(frozen=True)
+class Rentabilite:
+    """Rentabilité du contrat vue par l'épargnant, par scénario.
+
+    `tri_brut` est le TRI avant frais d'entrée, frais de gestion et fiscalité :
+    la performance des supports, pondérée par les montants. `tri_net` est celui
+    des flux réels de l'épargnant : versements bruts, rachats nets et capital
+    final racheté en totalité, net d'impôt. `rendement_effectif` est le
+    rendement net de chaque année rapporté au capital engagé, de forme (..., duree),
+    NaN au-delà de la durée du scénario.
+    """
+    tri_brut: np.ndarray
+    tri_net: np.ndarray
+    rendement_effectif: np.ndarray
+
+
+def _rentabilite(resultat, capital_initial, frais_entree_ci, frais_entree_vp, option_fiscalite, abattement,
+                 date_ouverture, date_debut, bareme: BaremeFiscal) -> Rentabilite:
+    unitaire, series, duree_totale, actives = series_scenarios(resultat, SERIES_RENTABILITE)
+    n, duree = series["capital_fin"].shape
+    # Au-delà de sa propre durée, un scénario du lot n'a plus de flux
+    if actives is None:
+        actives = np.ones((n, duree), dtype=bool)
+    capital_initial = par_scenario(capital_initial, n)
+    frais_entree_ci = par_scenario(frais_entree_ci, n)
+    frais_entree_vp = par_scenario(frais_entree_vp, n)[:, None]
+
+    def annuelle(champ):
+        return np.where(actives, series[champ], 0.0)
+
+    vp_net, libres, frais_gestion = annuelle("vp_net"), annuelle("vp_exceptionnel"), annuelle("frais_gestion")
+    vp_brut = np.divide(vp_net, 1 - frais_entree_vp, out=np.zeros_like(vp_net), where=frais_entree_vp < 1)
+    derniere = (duree_totale - 1)[:, None]
+    capital_final = np.take_along_axis(series["capital_fin"], derniere, axis=1)[:, 0]
+    epargne_finale = np.take_along_axis(series["epargne_investie"], derniere, axis=1)[:, 0]
+
+    # Rachat total au début de l'année qui suit la dernière année simulée
+    anciennete = np.broadcast_to(anciennetes_annuelles(option_fiscalite, duree + 1, date_ouverture, date_debut, bareme), (n, duree + 1))
+    seuils = np.broadcast_to(seuils_primes(dates_annuelles(duree + 1, date_debut)), (n, duree + 1))
+    plus_value_finale = np.maximum(capital_final - epargne_finale, 0.0)
+    impot_final = calculer_fiscalite(capital_final, plus_value_finale,
+                                     np.take_along_axis(anciennete, duree_totale[:, None], axis=1)[:, 0],
+                                     epargne_finale, par_scenario(abattement, n), bareme,
+                                     np.take_along_axis(seuils, duree_totale[:, None], axis=1)[:, 0])
+
+    # Instants 0, 1, 2… (début d'année : rachats ; fin d'année : versements libres, capital final)
+    # intercalés avec les versements mensuels de chaque année, à k - 1 + INSTANT_VERSEMENTS
+    instants = np.empty(2 * duree + 1)
+    instants[0::2] = np.arange(duree + 1)
+    instants[1::2] = np.arange(duree) + INSTANT_VERSEMENTS
+    fin = 2 * duree_totale[:, None]
+
+    def flux(initial, versements, libres_fin_annee, rachats, final):
+        resultat_flux = np.zeros((n, 2 * duree + 1))
+        resultat_flux[:, 0] = -initial
+        resultat_flux[:, 1::2] = -versements
+        resultat_flux[:, 2::2] = libres_fin_annee
+        resultat_flux[:, 0:-1:2] += rachats
+        np.put_along_axis(resultat_flux, fin, np.take_along_axis(resultat_flux, fin, axis=1) + final[:, None], axis=1)
+        return resultat_flux
+
+    # Avant frais et impôts : les montants investis, les rachats bruts et les frais de gestion rendus à l'épargnant
+    flux_bruts = flux(capital_initial * (1 - frais_entree_ci), vp_net, frais_gestion - libres * (1 - frais_entree_vp),
+                      annuelle("rachat"), capital_final)
+    flux_nets = flux(capital_initial, vp_brut, -libres, annuelle("rachat_net"), capital_final - impot_final)
+
+    # Rendement de l'année : gain net (frais d'entrée et fiscalité compris) / capital engagé en moyenne
+    capital_fin = series["capital_fin"]
+    depart = np.concatenate([capital_initial[:, None], capital_fin[:, :-1]], axis=1)
+    gain = capital_fin + annuelle("rachat_net") - depart - vp_brut - libres
+    engage = depart - annuelle("rachat") + vp_brut * PRORATA_VERSEMENTS / 12
+    rendement_effectif = np.divide(gain, engage, out=np.full_like(gain, np.nan), where=actives & (engage > 0))
+
+    # Départ de Newton quand les flux ne suffisent pas à l'estimer : le rendement moyen pondéré
+    # par le capital engagé, augmenté des frais de gestion rendus à l'épargnant pour le TRI brut
+    with np.errstate(divide="ignore", invalid="ignore"):
+        engage_total = np.where(actives, engage, 0.0).sum(axis=1)
+        depart_net = np.where(actives, gain, 0.0).sum(axis=1) / engage_total
+        depart_brut = depart_net + frais_gestion.sum(axis=1) / engage_total
+    rentabilite = Rentabilite(tri_brut=calculer_tri(flux_bruts, instants, depart=depart_brut),
+                              tri_net=calculer_tri(flux_nets, instants, depart=depart_net),
+                              rendement_effectif=rendement_effectif)
+    if unitaire:
+        return Rentabilite(tri_brut=float(rentabilite.tri_brut[0]), tri_net=float(rentabilite.tri_net[0]),
+                           rendement_effectif=rendement_effectif[0])
+    return rentabilite
+
+
+def calculer_rentabilite(resultat, params: Parametres, bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> Rentabilite:
+    """Rentabilité d'une simulation (`ResultatSimulation`) ou de chemins d'un même contrat (`ResultatLot`).
+
+    Le lot doit avoir conservé les `SERIES_RENTABILITE` et commencer à l'année 1.
+    """
+    return _rentabilite(resultat, params.capital_initial, params.frais_entree_ci, params.frais_entree_vp,
+                        params.option_fiscalite, params.abattement, params.date_ouverture, params.date_debut, bareme)
+
+
+def rentabilite_lot(lot, arguments: dict, bareme: BaremeFiscal = BAREME_EN_VIGUEUR) -> Rentabilite:
+    """Rentabilité de chaque scénario d'un lot simulé avec les `arguments` de `preparer_lot`."""
+    return _rentabilite(lot, arguments["capital_initial"], arguments["frais_entree_ci"], arguments["frais_entree_vp"],
+                        arguments["option_fiscalite"], arguments["abattement"], arguments["date_ouverture"],
+                        arguments["date_debut"], bareme)
@@ -7,7 +7,7 @@ from plotly.subplots import make_subplots
 import plotly.io as pio
 import os
 import tempfile
-from datetime import datetime
+from datetime import date, datetime
 from PIL import Image
 import plotly.graph_objects as go
 import io
@@ -15,6 +15,9 @@ import urllib.parse
 import numpy as np
 import uuid
 
+import moteur
+from moteur import ModificationVersement, Objectif, Parametres, VersementLibre
+
 
 
 
@@ -52,13 +55,23 @@ def input_simulateur():
 
         rendement_phase_rachat = st.slider("📉 Rendement phase de rachat (%)", min_value=0.0, max_value=20.0, value=3.0, step=0.1, key="rendement_phase_rachat_key", help="Dépend de votre degré de sécurisation en phase de rachat") / 100
 
+        date_connue = st.checkbox("📆 Je connais la date d'ouverture du contrat", value=False, key="date_ouverture_connue_key", help="L'ancienneté est alors recalculée chaque année : le contrat change de régime fiscal l'année de ses 8 ans")
         option_fiscalite = st.radio(
             "Durée de vie de votre contrat",
             ("− 8 ans", "﹢ 8 ans"),
             key="option_fiscalite_key",
             horizontal=True,
+            disabled=date_connue,
             help="Avantage fiscal à partir de la 8ème année"
         )
+        date_ouverture = None
+        if date_connue:
+            date_ouverture = st.date_input("Date d'ouverture du contrat", value=date.today(), min_value=date(1950, 1, 1), max_value=date.today(), format="DD/MM/YYYY", key="date_ouverture_key")
+
+        naissance_connue = st.checkbox("🎂 Renseigner ma date de naissance", value=False, key="date_naissance_connue_key", help="Pour suivre les versements effectués après 70 ans, soumis à un abattement spécifique en cas de décès")
+        date_naissance = None
+        if naissance_connue:
+            date_naissance = st.date_input("Date de naissance", value=date(1970, 1, 1), min_value=date(1920, 1, 1), max_value=date.today(), format="DD/MM/YYYY", key="date_naissance_key")
 
         # Sélection du statut (Solo ou Couple) sur la même ligne
         statut = st.radio(
@@ -70,7 +83,10 @@ def input_simulateur():
         )
 
         # Déterminer l'abattement en fonction du statut
-        abattement = 4600 if statut == "Seul" else 9200
+        abattement = moteur.ABATTEMENT_SEUL if statut == "Seul" else moteur.ABATTEMENT_COUPLE
+
+        pas_mensuel = st.checkbox("🗓️ Calcul au pas mensuel", value=False, key="pas_mensuel_key", help="Capitalisation, frais de gestion et rachats programmés calculés mois par mois")
+        centimes = st.checkbox("🧮 Calcul exact au centime", value=False, key="centimes_key", disabled=pas_mensuel, help="Montants tenus en centimes entiers et arrondis à chaque étape (frais, fiscalité, rachats), comme sur un relevé d'assureur")
 
     # Retourner tous les paramètres sous forme de dictionnaire
     return {
@@ -82,7 +98,11 @@ def input_simulateur():
         "frais_gestion": frais_gestion,
         "rendement_phase_rachat": rendement_phase_rachat,
         "option_fiscalite": option_fiscalite,
-        "abattement": abattement
+        "abattement": abattement,
+        "date_ouverture": date_ouverture,
+        "date_naissance": date_naissance,
+        "pas_mensuel": pas_mensuel,
+        "centimes": centimes and not pas_mensuel
     }
 
 import streamlit as st
@@ -128,13 +148,8 @@ def toggle_modifier_interface():
     st.session_state.show_stopper_interface = False
 
 def verifier_chevauchements():
-    chevauchements = []
-    for i, modif1 in enumerate(st.session_state.modifications_versements):
-        for j, modif2 in enumerate(st.session_state.modifications_versements):
-            if i != j:
-                if (modif1['debut'] <= modif2['fin'] and modif2['debut'] <= modif1['fin']):
-                    chevauchements.append((i, j))
-    return chevauchements
+    # Chaque paire de périodes qui se chevauchent n'est signalée qu'une fois
+    return moteur.detecter_chevauchements([ModificationVersement.depuis_dict(m) for m in st.session_state.modifications_versements])
 
 
 
@@ -186,7 +201,7 @@ if st.session_state.show_modifier_interface:
 if st.session_state.modifications_versements:
     chevauchements = verifier_chevauchements()
     if chevauchements:
-        st.warning("⚠️ Attention : Certaines périodes de modifications se chevauchent. Veuillez vérifier vos saisies.")   
+        st.warning("⚠️ Attention : Certaines périodes de modifications se chevauchent. Sur les années communes, la modification saisie en premier s'applique. Veuillez vérifier vos saisies.")   
 
     for i, modification in enumerate(st.session_state.modifications_versements):
         if modification['montant'] == 0:
@@ -306,164 +321,44 @@ for objectif in objectifs:
 
 
 
-def calculer_duree_capi_max(objectifs):
-    if not objectifs:  # Vérifie si la liste est vide
-        return 60  # Durée par défaut si aucun objectif n'est défini
-    return max(obj["annee"] for obj in objectifs)
+def objectifs_moteur(objectifs):
+    return [Objectif.depuis_dict(obj) for obj in objectifs]
 
-def calcul_rendement_versements_mensuels(versement_mensuel_investi, rendement_annuel):
-    rendement_versements = 0
-    for mois in range(12):
-        prorata = (12 - mois) / 12  # Le mois de janvier est investi 12 mois, février 11 mois, etc.
-        rendement_versements += (versement_mensuel_investi * prorata) * rendement_annuel
-    return rendement_versements
+def calculer_duree_capi_max(objectifs):
+    return moteur.calculer_duree_capi_max(objectifs_moteur(objectifs))
 
 def calculer_duree_totale(objectifs):
-    if not objectifs:  # Vérifie si la liste est vide
-        return 60  # Durée par défaut si aucun objectif n'est défini
-    # Calculer la durée maximale en fonction des objectifs
-    return max(obj["annee"] + obj["duree_retrait"] for obj in objectifs)
+    return moteur.calculer_duree_totale(objectifs_moteur(objectifs))
 
 # ... (autre code)
 
 if not objectifs:
     st.warning("Aucun objectif n'a été défini. Une durée par défaut de 60 ans sera utilisée pour la simulation.")
 
-# Calcul des valeurs dynamiques pour le tableau
-def optimiser_objectifs(params, duree_totale):
-    capital_initial = params["capital_initial"]
-    duree_totale = calculer_duree_totale(objectifs)
-    frais_entree_ci = params["frais_entree_ci"]
-    versement_mensuel_initial = params["versement_mensuel"]
-    frais_entree_vp = params["frais_entree_vp"]
-    rendement = params["rendement_annuel"]
-    frais_gestion = params["frais_gestion"]
-    option_fiscalite = params["option_fiscalite"]
-    abattement = params["abattement"]
-    rendement_phase_rachat = params["rendement_phase_rachat"]
-    objectif_annee_max = calculer_duree_capi_max(objectifs)
-
-    capital_initial_investi = capital_initial * (1 - frais_entree_ci)
-    
-    capital_debut_annee = capital_initial_investi
-    epargne_investie = capital_initial
-    pourcentage_plus_value_precedent = 0
-
-    data = []
-
-    # Création d'une colonne 'Rachat' initialement à 0 pour toutes les années
-    rachats = [0.0] * (duree_totale + 1)
-    for objectif in objectifs:
-        annee_debut = objectif["annee"] + 1
-        duree_retrait = int(objectif["duree_retrait"])
-        montant_annuel_retrait = objectif["montant_annuel"]
-        
-        for annee in range(annee_debut, min(annee_debut + duree_retrait, duree_totale + 1)):
-            rachats[annee - 1] += montant_annuel_retrait
-
-    for annee in range(1, duree_totale + 1):
-        # Déterminer le versement mensuel pour l'année en cours
-        versement_mensuel_courant = versement_mensuel_initial
-        modifications = st.session_state.get('modifications_versements', [])
-        for modification in modifications:
-            if modification["debut"] <= annee <= modification["fin"]:
-                versement_mensuel_courant = modification["montant"]
-                break
-        
-        versement_mensuel_investi = versement_mensuel_courant * (1 - frais_entree_vp)
-        versements_actifs = annee <= objectif_annee_max and versement_mensuel_courant > 0
-        
-        # Traitement du rachat pour l'année en cours
-        rachat_annee = min(rachats[annee - 1], capital_debut_annee)
-        
-        # Déduire le rachat du capital de début d'année
-        capital_debut_annee -= rachat_annee
-
-        if rachat_annee > 0:
-            part_plus_value = pourcentage_plus_value_precedent * rachat_annee
-            part_capital = rachat_annee - part_plus_value
-            
-            # Calcul de la fiscalité
-            fiscalite = 0
-            if part_plus_value > 0:
-                fiscalite = part_plus_value * 0.172
-                if option_fiscalite == "+ 8 ans":
-                    if part_plus_value > abattement:
-                        plus_value_taxable = part_plus_value - abattement
-                        pourcentage_epargne_sup_150k = max(0, 1 - (150000 / epargne_investie)) if epargne_investie > 150000 else 0
-                        part_sup_150k = pourcentage_epargne_sup_150k * rachat_annee
-                        part_inf_150k = rachat_annee - part_sup_150k
-                        part_plus_value_inf_150k = plus_value_taxable * (part_inf_150k / rachat_annee)
-                        fiscalite += part_plus_value_inf_150k * 0.075
-                        part_plus_value_sup_150k = plus_value_taxable * (part_sup_150k / rachat_annee)
-                        fiscalite += part_plus_value_sup_150k * 0.128
-                elif option_fiscalite == "− 8 ans":
-                    fiscalite += part_plus_value * 0.128
-            
-            rachat_net = rachat_annee - fiscalite
-            
-            # Mise à jour de l'épargne investie après le rachat
-            epargne_investie = max(0, epargne_investie - part_capital)
-        else:
-            part_plus_value, part_capital, fiscalite, rachat_net = 0, 0, 0, 0
-
-
-        if annee > objectif_annee_max:
-            rendement_annuel_total = capital_debut_annee * rendement_phase_rachat
-        else:
-            rendement_annuel_total = capital_debut_annee * rendement
-
-        rendement_versements_net = calcul_rendement_versements_mensuels(versement_mensuel_investi, rendement) if versements_actifs else 0
-        
-        frais_gestion_total = (capital_debut_annee * frais_gestion)
-        if versements_actifs:
-            frais_gestion_total += sum([(versement_mensuel_investi * (12 - mois) / 12) * frais_gestion for mois in range(12)])
-
-        versement_libre_exceptionnel = sum(versement["montant"] for versement in st.session_state.versements_libres if versement["annee"] == annee)
-        
-        capital_fin_annee = (
-            capital_debut_annee
-            + (versement_mensuel_investi * 12 if versements_actifs else 0)
-            + rendement_annuel_total
-            + rendement_versements_net
-            - frais_gestion_total
-            + versement_libre_exceptionnel * (1 - frais_entree_vp)
-        )
+def entrees_moteur(params, objectifs):
+    return (
+        Parametres.depuis_dict(params),
+        objectifs_moteur(objectifs),
+        [ModificationVersement.depuis_dict(m) for m in st.session_state.get('modifications_versements', [])],
+        [VersementLibre.depuis_dict(v) for v in st.session_state.get('versements_libres', [])],
+    )
 
-        # Mise à jour de l'épargne investie pour l'année en cours
-        if versements_actifs:
-            epargne_investie += versement_mensuel_courant * 12
-        epargne_investie += versement_libre_exceptionnel
-
-        # Calcul du nouveau pourcentage de plus-value
-        pourcentage_plus_value = 1 - (epargne_investie / capital_fin_annee) if epargne_investie > 0 and capital_fin_annee > 0 else 0
-
-        data.append([
-            annee, 
-            f"{capital_debut_annee:.2f} €",
-            f"{versement_mensuel_investi * 12 if versements_actifs else 0:.2f} €",
-            f"{rendement_annuel_total + rendement_versements_net:.2f} €",
-            f"{frais_gestion_total:.2f} €",
-            f"{capital_fin_annee:.2f} €",
-            f"{rachat_annee:.2f} €",
-            f"{epargne_investie:.2f} €",
-            f"{versement_libre_exceptionnel:.2f} €",
-            f"{part_capital:.2f} €",
-            f"{part_plus_value:.2f} €",
-            f"{fiscalite:.2f} €",
-            f"{pourcentage_plus_value*100:.2f}%",
-            f"{rachat_net:.2f} €"
-        ])
-        
-        # Préparation pour l'année suivante
-        capital_debut_annee = capital_fin_annee
-        pourcentage_plus_value_precedent = pourcentage_plus_value
-
-    return pd.DataFrame(data, columns=[
-        "Année", "Capital initial (NET)", "VP NET", "Rendement", "Frais de gestion", 
-        "Capital fin d'année (NET)", "Rachat", "Épargne investie", "VP exceptionnel", 
-        "Part capital", "Part intérêt", "Fiscalite", "%", "Rachat net"
-    ])
+# Calcul des valeurs dynamiques pour le tableau
+def mettre_a_jour_simulation(params, objectifs):
+    # Un moteur incrémental par session et par mode : seules les années touchées par la dernière saisie sont recalculées.
+    # En mode annuel, le cache partagé entre les sessions permet au rapport PDF de réutiliser le résultat affiché
+    if params.get("centimes"):
+        # Mode exact : recalcul complet, chaque année pouvant dépendre des arrondis des précédentes
+        resultat = moteur.simuler_centimes(*entrees_moteur(params, objectifs))
+        return moteur.MiseAJour(resultat=resultat, premiere_annee=1, lignes_modifiees=resultat.annee)
+    mensuel = bool(params.get("pas_mensuel"))
+    cle = "simulation_mensuelle" if mensuel else "simulation_annuelle"
+    if cle not in st.session_state:
+        st.session_state[cle] = moteur.SimulationIncrementale(mensuel=mensuel, cache=moteur.cache_simulations)
+    return st.session_state[cle].mettre_a_jour(*entrees_moteur(params, objectifs))
+
+def optimiser_objectifs(params, objectifs):
+    return mettre_a_jour_simulation(params, objectifs).resultat.vers_dataframe()
 
 
 def color_alternating_rows(s):
@@ -482,19 +377,31 @@ def format_percentage(val):
     except ValueError:
         return str(val)
 
+def format_taux(val):
+    # Taux décimal affiché en pourcentage ; TRI indéfini (aucun changement de signe des flux) affiché "—"
+    if pd.isna(val):
+        return "—"
+    return f"{val * 100:.2f} %".replace(".", ",")
+
 def color_alternating_rows(s):
     return ['background-color: #EEEFF1' if i % 2 == 0 else 'background-color: #FBFBFB' for i in range(len(s))]
 
-def style_dataframe(df):
+def style_dataframe(df, lignes_modifiees=()):
+    lignes_modifiees = set(lignes_modifiees)
+
+    def surligner_lignes_modifiees(ligne):
+        return ['background-color: #F6EDCF' if ligne.name in lignes_modifiees else '' for _ in ligne]
+
+    pourcentages = [col for col in ['%', 'Rendement effectif'] if col in df.columns]
     return df.style.format({
-        col: format_currency for col in df.columns if col not in ['Année', '%']
+        col: format_currency for col in df.columns if col not in ['Année', *pourcentages]
     }).format({
-        '%': format_percentage
+        col: format_percentage for col in pourcentages
     }).set_properties(**{
         'color': '#202021',
         'font-family': 'Inter, sans-serif',
         'font-size': '14px',
-    }).apply(color_alternating_rows).set_table_styles([
+    }).apply(color_alternating_rows).apply(surligner_lignes_modifiees, axis=1).set_table_styles([
         {'selector': 'th',
          'props': [('font-weight', 'bold'),
                    ('background-color', '#284264'),
@@ -508,23 +415,221 @@ def style_dataframe(df):
 
 
 
+def input_monte_carlo():
+    with st.sidebar:
+        st.header("🎲 Rendements aléatoires")
+
+        actif = st.checkbox("Activer le mode Monte Carlo", value=False, key="monte_carlo_key", help="Simule des milliers de trajectoires de marché autour des rendements choisis")
+        if not actif:
+            return None
+
+        volatilite = st.slider("📊 Volatilité annuelle (%)", min_value=0.0, max_value=30.0, value=8.0, step=0.5, key="volatilite_key") / 100
+        volatilite_rachat = st.slider("📊 Volatilité phase de rachat (%)", min_value=0.0, max_value=30.0, value=4.0, step=0.5, key="volatilite_rachat_key") / 100
+        queues_epaisses = st.checkbox("Queues épaisses (loi de Student)", value=False, key="queues_epaisses_key", help="Rend les années extrêmes plus fréquentes qu'avec une loi normale")
+        degres_liberte = st.slider("Degrés de liberté", min_value=3, max_value=30, value=5, key="degres_liberte_key") if queues_epaisses else None
+        arret_automatique = st.checkbox("Arrêt automatique (quasi-Monte Carlo)", value=False, key="arret_automatique_key", help="Tire les trajectoires d'une suite de Sobol et s'arrête dès que la probabilité de financement est assez précise")
+        if arret_automatique:
+            tolerance = st.slider("Précision visée (± points de %)", min_value=0.1, max_value=2.0, value=0.5, step=0.1, key="tolerance_key") / 100
+            nombre_chemins = None
+        else:
+            tolerance = None
+            nombre_chemins = st.select_slider("Nombre de trajectoires", options=[1000, 5000, 10000, 20000, 50000, 100000], value=10000, key="nombre_chemins_key")
+
+    loi = moteur.LoiRendements(volatilite, volatilite_phase_rachat=volatilite_rachat, degres_liberte=degres_liberte)
+    return loi, nombre_chemins, tolerance
+
+
+def input_backtest():
+    with st.sidebar:
+        st.header("📜 Backtest historique")
+
+        fichier = st.file_uploader("Rendements historiques (CSV)", type=["csv", "txt"], key="backtest_key", help="Deux colonnes : l'année ou la date, puis le rendement de la période (annuel ou mensuel)")
+        unites = {"pourcentage": "En pourcentage (5 = 5 %)", "decimal": "En décimal (0,05 = 5 %)"}
+        unite = st.radio("Unité des rendements du fichier", moteur.UNITES_RENDEMENT, format_func=unites.get, key="backtest_unite_key", help="L'unité n'est pas devinée : un fichier incompatible avec l'unité choisie est refusé")
+        if fichier is None:
+            return None
+        try:
+            return moteur.charger_rendements(fichier, unite)
+        except ValueError as e:
+            st.error(f"Fichier de rendements illisible : {e}")
+            return None
+
+
+def input_enveloppes():
+    with st.sidebar:
+        st.header("🗂️ Comparer les enveloppes")
+
+        choix = st.multiselect("Enveloppes à comparer à l'assurance-vie", ["PEA", "Compte-titres", "PER"], default=[], key="enveloppes_key", help="Même plan de versements et de rachats, avec les frais, la fiscalité et les règles de blocage de chaque enveloppe")
+        if not choix:
+            return None
+
+        taux_marginal = st.select_slider("Tranche marginale d'imposition (%)", options=[0, 11, 30, 41, 45], value=30, key="taux_marginal_key", help="Sert à la déduction des versements au PER et à l'imposition de sa part de capital à la sortie") / 100
+        enveloppes = [moteur.ASSURANCE_VIE]
+        if "PEA" in choix:
+            enveloppes.append(moteur.PEA)
+        if "Compte-titres" in choix:
+            enveloppes.append(moteur.CTO)
+        retraite = None
+        if "PER" in choix:
+            retraite = st.slider("Départ à la retraite dans (années)", min_value=0, max_value=40, value=20, key="retraite_key", help="Le PER est bloqué jusqu'à la retraite : les rachats demandés avant ne sont pas versés")
+            enveloppes.append(moteur.PER)
+
+    return tuple(enveloppes), taux_marginal, retraite
+
+
+def input_foyer():
+    with st.sidebar:
+        st.header("👨‍👩‍👧 Foyer multi-contrats")
+
+        actif = st.checkbox("Ajouter les autres contrats du foyer", value=False, key="foyer_key", help="Les objectifs sont financés par tous les contrats du foyer, l'abattement annuel étant un plafond commun")
+        if not actif:
+            return None
+
+        nombre = st.number_input("Nombre d'autres contrats", min_value=1, max_value=9, value=1, step=1, key="nombre_contrats_key")
+        contrats = []
+        for k in range(2, int(nombre) + 2):
+            with st.expander(f"Contrat {k}"):
+                capital_initial = st.number_input("💰 Capital initial", min_value=0, max_value=1000000, value=10000, step=1000, key=f"capital_contrat_{k}_key")
+                versement_mensuel = st.number_input("💶 Versement mensuel", min_value=0, max_value=10000, value=100, step=50, key=f"versement_contrat_{k}_key")
+                rendement = st.slider("📈 Rendement annuel (%)", min_value=0.0, max_value=12.0, value=4.0, step=0.1, key=f"rendement_contrat_{k}_key") / 100
+                frais = st.slider("💸 Frais de gestion (%)", min_value=0.0, max_value=3.0, value=0.8, step=0.05, key=f"frais_contrat_{k}_key") / 100
+                anciennete = st.slider("Ancienneté du contrat (années)", min_value=0, max_value=30, value=0, key=f"anciennete_contrat_{k}_key", help="Le contrat bénéficie de la fiscalité des contrats de plus de 8 ans dès qu'il atteint cette ancienneté")
+            parametres = moteur.Parametres(capital_initial=capital_initial, versement_mensuel=versement_mensuel, rendement_annuel=rendement,
+                                           rendement_phase_rachat=rendement, frais_gestion=frais)
+            contrats.append(moteur.Contrat(parametres, anciennete=anciennete))
+
+        repartition = st.radio("Répartition des rachats", ["Au prorata du capital", "Par ordre des contrats"], key="repartition_rachats_key")
+
+    return contrats, "prorata" if repartition == "Au prorata du capital" else "priorite"
+
+
+def input_gestion_pilotee():
+    with st.sidebar:
+        st.header("🧭 Gestion pilotée")
+
+        actif = st.checkbox("Répartir entre fonds euros et unités de compte", value=False, key="gestion_pilotee_key", help="Sécurise progressivement le contrat vers le fonds euros à l'approche de chaque objectif")
+        if not actif:
+            return None
+
+        rendement_euros = st.slider("💶 Rendement du fonds euros (%)", min_value=0.0, max_value=6.0, value=2.5, step=0.1, key="rendement_euros_key") / 100
+        frais_euros = st.slider("💸 Frais de gestion du fonds euros (%)", min_value=0.0, max_value=2.0, value=0.6, step=0.05, key="frais_euros_key") / 100
+        rendement_uc = st.slider("📈 Rendement des unités de compte (%)", min_value=0.0, max_value=12.0, value=6.0, step=0.1, key="rendement_uc_key") / 100
+        frais_uc = st.slider("💸 Frais de gestion des unités de compte (%)", min_value=0.0, max_value=3.0, value=0.9, step=0.05, key="frais_uc_key") / 100
+        volatilite_uc = st.slider("📊 Volatilité des unités de compte (%)", min_value=0.0, max_value=30.0, value=15.0, step=0.5, key="volatilite_uc_key") / 100
+        part_uc = st.slider("Part initiale en unités de compte (%)", min_value=0, max_value=100, value=70, step=5, key="part_uc_key") / 100
+        horizon = st.slider("Sécurisation sur les dernières années avant un objectif", min_value=1, max_value=20, value=10, key="horizon_securisation_key")
+        rebalancement = st.radio("Rééquilibrage", ["Annuel", "Mensuel"], horizontal=True, key="rebalancement_key")
+
+    supports = (
+        moteur.Support("Fonds euros", rendement_euros, frais_euros),
+        moteur.Support("Unités de compte", rendement_uc, frais_uc, volatilite_uc),
+    )
+    return supports, (1 - part_uc, part_uc), horizon, rebalancement.lower()
+
+
 params = input_simulateur()
+monte_carlo = input_monte_carlo()
+serie_historique = input_backtest()
+gestion_pilotee = input_gestion_pilotee()
+choix_enveloppes = input_enveloppes()
+foyer = input_foyer()
 duree_totale = calculer_duree_totale(objectifs)
 
 # Calcul du tableau avec les paramètres actuels et intégration des rachats
 
 # Affichage des résultats avec les rachats
 st.header("📊 Résultats de la simulation avec rachats")
-resultats_df = optimiser_objectifs(params, objectifs)
+mise_a_jour = mettre_a_jour_simulation(params, objectifs)
+resultats_df = mise_a_jour.resultat.vers_dataframe()
+
+# TRI de l'épargnant et rendement net de chaque année, tirés des flux réels de la simulation
+rentabilite = moteur.calculer_rentabilite(getattr(mise_a_jour.resultat, "annuel", mise_a_jour.resultat), Parametres.depuis_dict(params))
+resultats_df["Rendement effectif"] = rentabilite.rendement_effectif * 100
+
+# Coût de chaque frais et de la fiscalité, capitalisation comprise, tiré des mêmes séries
+attribution = moteur.calculer_attribution(getattr(mise_a_jour.resultat, "annuel", mise_a_jour.resultat), Parametres.depuis_dict(params))
 
 resultats_df.set_index('Année', inplace=True)
 
+# Les années qui ont bougé depuis la dernière saisie sont surlignées (sauf au premier calcul)
+lignes_modifiees = mise_a_jour.lignes_modifiees if len(mise_a_jour.lignes_modifiees) < len(resultats_df) else []
+if len(lignes_modifiees):
+    st.caption(f"🔄 {len(lignes_modifiees)} année(s) modifiée(s) par votre dernière saisie, à partir de l'année {lignes_modifiees[0]}")
+
 # Appliquez le style au DataFrame
-styled_df = style_dataframe(resultats_df)
+styled_df = style_dataframe(resultats_df, lignes_modifiees)
 
 # Affichez le DataFrame stylisé
 st.dataframe(styled_df, use_container_width=True)
 
+col1, col2 = st.columns(2)
+col1.metric("TRI brut", format_taux(rentabilite.tri_brut), help="Taux de rendement interne avant frais d'entrée, frais de gestion et fiscalité : la performance de vos supports, pondérée par vos versements")
+col2.metric("TRI net", format_taux(rentabilite.tri_net), help="Taux de rendement interne de vos flux réels : versements bruts, rachats nets d'impôt et capital final racheté en totalité, net d'impôt")
+
+# Primes versées après 70 ans : au-delà de l'abattement spécifique, elles entrent dans la succession
+if params["date_naissance"] is not None:
+    primes = resultats_df["VP NET"].to_numpy() / (1 - params["frais_entree_vp"]) + resultats_df["VP exceptionnel"].to_numpy()
+    primes[0] += params["capital_initial"]
+    cumul_apres_70_ans = moteur.primes_apres_70_ans(primes, moteur.ages_annuels(params["date_naissance"], len(primes)))
+    plafond = moteur.BAREME_EN_VIGUEUR.abattement_primes_apres_70_ans
+    if cumul_apres_70_ans[-1] > plafond:
+        annee_depassement = int(np.argmax(cumul_apres_70_ans > plafond)) + 1
+        st.warning(f"⚠️ Vos versements après 70 ans ({format_currency(cumul_apres_70_ans[-1])}) dépassent l'abattement de {format_currency(plafond)} dès l'année {annee_depassement} : l'excédent sera soumis aux droits de succession.")
+    elif cumul_apres_70_ans[-1] > 0:
+        st.caption(f"ℹ️ Versements après 70 ans : {format_currency(cumul_apres_70_ans[-1])}, sous l'abattement de {format_currency(plafond)}.")
+
+# Les solveurs ne sont relancés que si les entrées du moteur changent, pas à chaque interaction
+@st.cache_data(show_spinner=False)
+def montant_minimal(entrees, variable):
+    try:
+        return moteur.resoudre_financement(*entrees, variable=variable).valeur
+    except ValueError:
+        return None  # Aucun montant ne finance tous les objectifs
+
+@st.cache_data(show_spinner=False)
+def retraits_soutenables(entrees):
+    return moteur.retraits_soutenables(*entrees)
+
+@st.cache_data(show_spinner=False)
+def optimiser_rachats(entrees):
+    return moteur.optimiser_rachats(*entrees)
+
+# Montants minimaux pour percevoir chaque année le montant des objectifs, net de fiscalité
+if objectifs:
+    with st.expander("🎯 Montant minimal pour financer tous vos objectifs"):
+        st.caption("Montants des objectifs considérés comme nets d'impôt : le rachat brut couvre aussi la fiscalité.")
+        col1, col2 = st.columns(2)
+        for col, variable, libelle in [
+            (col1, "versement_mensuel", "Versement mensuel minimal"),
+            (col2, "capital_initial", "Capital initial minimal"),
+        ]:
+            valeur = montant_minimal(entrees_moteur(params, objectifs), variable)
+            col.metric(libelle, "Non atteignable" if valeur is None else format_currency(valeur))
+
+        # Rachat maximal de chaque objectif, les autres objectifs restant inchangés
+        soutenables = retraits_soutenables(entrees_moteur(params, objectifs))
+        soutenables_df = pd.DataFrame({
+            "Objectif": [r.objectif.nom for r in soutenables],
+            "Rachat annuel maximal (brut)": [r.montant_brut for r in soutenables],
+            "Rachat annuel maximal (net)": [r.montant_net_moyen for r in soutenables],
+        }).set_index("Objectif")
+        st.dataframe(soutenables_df.style.format(format_currency), use_container_width=True)
+
+    # Calendrier de rachats qui consomme au mieux l'abattement annuel, à net perçu identique chaque année
+    with st.expander("🧾 Optimiser la fiscalité de vos rachats"):
+        calendrier = optimiser_rachats(entrees_moteur(params, objectifs))
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Fiscalité avec vos objectifs", format_currency(calendrier.fiscalite_naive.sum()))
+        col2.metric("Fiscalité optimisée", format_currency(calendrier.fiscalite.sum()))
+        col3.metric("Économie d'impôt", format_currency(calendrier.economie))
+        if calendrier.economie > 0:
+            st.caption("Même montant net perçu chaque année et capital final au moins égal : les rachats avancés sont conservés en trésorerie (non rémunérée) jusqu'à leur utilisation.")
+            calendrier_df = calendrier.vers_dataframe().set_index("Année")
+            calendrier_df = calendrier_df[(calendrier_df["Rachat actuel"] > 0) | (calendrier_df["Rachat optimisé"] > 0)]
+            st.dataframe(calendrier_df.style.format(format_currency), use_container_width=True)
+        else:
+            st.info("Votre calendrier de rachats est déjà le plus avantageux fiscalement.")
+
 
 
 
@@ -532,7 +637,7 @@ import plotly.graph_objs as go
 import pandas as pd
 import streamlit as st
 
-def create_financial_chart(df: pd.DataFrame):
+def create_financial_chart(df: pd.DataFrame, bandes=None, comparaison=None):
     # Définir les couleurs
     couleur_principal = '#16425B'
     couleur_principal_aire = 'rgba(141, 179, 197, 0.3)'
@@ -543,18 +648,9 @@ def create_financial_chart(df: pd.DataFrame):
     # Create figure
     fig = go.Figure()
 
-    # Fonction pour convertir les valeurs en float de manière sûre
-    def safe_float_convert(x):
-        if pd.isna(x):
-            return 0.0
-        if isinstance(x, str):
-            return float(x.replace(' €', '').replace(',', '.'))
-        return float(x)
-
-    # Convertir les colonnes en float de manière sûre
-    capital_fin_annee = df['Capital fin d\'année (NET)'].apply(safe_float_convert)
-    epargne_investie = df['Épargne investie'].apply(safe_float_convert)
-    rachat = df['Rachat'].apply(safe_float_convert)
+    capital_fin_annee = df['Capital fin d\'année (NET)']
+    epargne_investie = df['Épargne investie']
+    rachat = df['Rachat']
 
     # Add traces
     fig.add_trace(
@@ -583,6 +679,60 @@ def create_financial_chart(df: pd.DataFrame):
         )
     )
 
+    # Bandes P5 / P50 / P95 du capital en mode Monte Carlo
+    if bandes is not None:
+        p5, p50, p95 = bandes
+        fig.add_trace(
+            go.Scatter(
+                x=df.index,
+                y=p95,
+                name='P95',
+                line=dict(color=couleur_principal, width=1, dash='dot'),
+                mode='lines',
+                hovertemplate='<span style="color:' + couleur_principal + ';">●</span> Scénario favorable (P95) <br>Montant: <b>%{y:.0f} €</b><extra></extra>'
+            )
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=df.index,
+                y=p5,
+                name='P5 – P95',
+                line=dict(color=couleur_principal, width=1, dash='dot'),
+                fill='tonexty',
+                fillcolor='rgba(22, 66, 91, 0.15)',
+                mode='lines',
+                hovertemplate='<span style="color:' + couleur_principal + ';">●</span> Scénario défavorable (P5) <br>Montant: <b>%{y:.0f} €</b><extra></extra>'
+            )
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=df.index,
+                y=p50,
+                name='Médiane',
+                line=dict(color=couleur_principal, width=2, dash='dash'),
+                mode='lines',
+                hovertemplate='<span style="color:' + couleur_principal + ';">●</span> Scénario médian (P50) <br>Montant: <b>%{y:.0f} €</b><extra></extra>'
+            )
+        )
+
+    # Capital du même plan dans les autres enveloppes comparées
+    if comparaison is not None:
+        couleurs_enveloppes = ['#8DB3C5', '#2E7D32', '#7B1FA2', '#EF6C00']
+        for i, enveloppe in enumerate(comparaison.enveloppes):
+            if enveloppe.regime == "assurance_vie":
+                continue
+            couleur = couleurs_enveloppes[i % len(couleurs_enveloppes)]
+            fig.add_trace(
+                go.Scatter(
+                    x=comparaison.lot.annee,
+                    y=comparaison.lot.capital_fin[i],
+                    name=enveloppe.nom,
+                    line=dict(color=couleur, width=2, dash='dash'),
+                    mode='lines',
+                    hovertemplate='<span style="color:' + couleur + ';">●</span> ' + enveloppe.nom + ' <br>Montant: <b>%{y:.0f} €</b><extra></extra>'
+                )
+            )
+
     # Ajouter les rachats en dernier pour qu'ils soient au premier plan
     fig.add_trace(
         go.Bar(
@@ -657,8 +807,348 @@ st.markdown("""
 </h2>
 """, unsafe_allow_html=True)
 
+# Bandes de percentiles en mode Monte Carlo (graine fixe pour un affichage stable d'un rerun à l'autre)
+bandes = None
+if monte_carlo is not None:
+    loi, nombre_chemins, tolerance = monte_carlo
+    if tolerance is None:
+        # Seuls des sketches de quantiles sont conservés : la mémoire ne dépend pas du nombre de trajectoires
+        resultat_mc = moteur.quantiles_monte_carlo(*entrees_moteur(params, objectifs), loi=loi, nombre_chemins=nombre_chemins, graine=0)
+        bandes = resultat_mc.percentiles("capital_fin")
+        statistiques = resultat_mc
+        st.metric("Probabilité de financer tous vos objectifs", f"{resultat_mc.probabilite_financement * 100:.1f} %".replace(".", ","))
+    else:
+        estimation = moteur.estimer_probabilite_financement(*entrees_moteur(params, objectifs), loi=loi, tolerance=tolerance, graine=0)
+        bandes = estimation.statistiques.percentiles("capital_fin")
+        statistiques = estimation.statistiques
+        st.metric("Probabilité de financer tous vos objectifs",
+                  f"{estimation.probabilite * 100:.1f} % ± {estimation.erreur * 100:.1f}".replace(".", ","),
+                  help=f"{estimation.nombre_chemins:,} trajectoires".replace(",", " ") + ("" if estimation.converge else " (précision visée non atteinte)"))
+    # TRI net des trajectoires défavorable, médiane et favorable
+    colonnes_tri = st.columns(len(moteur.PERCENTILES))
+    for col, niveau, taux in zip(colonnes_tri, moteur.PERCENTILES, statistiques.percentiles("tri_net")[:, 0]):
+        col.metric(f"TRI net – {niveau}e percentile", format_taux(taux))
+
+# Le même plan rejoué dans les enveloppes choisies, en un seul passage du moteur
+comparaison = None
+if choix_enveloppes is not None:
+    enveloppes, taux_marginal, retraite = choix_enveloppes
+    comparaison = moteur.comparer_enveloppes(*entrees_moteur(params, objectifs), enveloppes=enveloppes, taux_marginal=taux_marginal,
+                                             annee_retraite=retraite)
+
 # Utiliser toute la largeur disponible
-st.plotly_chart(create_financial_chart(resultats_df), use_container_width=True, config={'displayModeBar': False})
+st.plotly_chart(create_financial_chart(resultats_df, bandes, comparaison), use_container_width=True, config={'displayModeBar': False})
+
+if comparaison is not None:
+    synthese_df = comparaison.vers_dataframe().set_index("Enveloppe")
+    synthese_df["Objectifs financés"] = synthese_df["Objectifs financés"].map({True: "Oui", False: "Non"})
+    st.dataframe(synthese_df.style.format(format_currency, subset=synthese_df.columns[:-2]), use_container_width=True)
+    st.caption("Au PEA, les versements au-delà du plafond de 150 000 € ne sont pas effectués. Le capital net d'impôt suppose un rachat total la dernière année ; l'économie d'impôt du PER n'est pas réinvestie.")
+
+
+def create_sensitivity_heatmap(rendements, frais_gestion, capital, rendement_actuel, frais_actuel):
+    fig = go.Figure()
+
+    # Heatmap : frais de gestion en abscisse, rendement en ordonnée
+    fig.add_trace(
+        go.Heatmap(
+            x=frais_gestion * 100,
+            y=rendements * 100,
+            z=capital,
+            colorscale=[[0, '#FBFBFB'], [0.5, '#8DB3C5'], [1, '#16425B']],
+            colorbar=dict(title="€", tickformat=",.0f", ticksuffix=" €"),
+            hovertemplate='Rendement : <b>%{y:.2f}%</b><br>Frais de gestion : <b>%{x:.2f}%</b><br>Capital : <b>%{z:,.0f} €</b><extra></extra>'
+        )
+    )
+
+    # Position des paramètres actuels
+    fig.add_trace(
+        go.Scatter(
+            x=[frais_actuel * 100],
+            y=[rendement_actuel * 100],
+            mode='markers',
+            marker=dict(color='#CBA325', size=14, symbol='x', line=dict(color='#FBFBFB', width=1)),
+            name='Votre simulation',
+            hovertemplate='Votre simulation<extra></extra>'
+        )
+    )
+
+    fig.update_layout(
+        xaxis=dict(
+            title="<b>Frais de gestion (%)</b>",
+            ticksuffix=" %",
+            showline=True,
+            linewidth=3,
+            linecolor='#CBA325',
+        ),
+        yaxis=dict(
+            title="<b>Rendement annuel (%)</b>",
+            ticksuffix=" %",
+            showline=True,
+            linewidth=3,
+            linecolor='#CBA325',
+        ),
+        font=dict(family="Inter", size=14),
+        margin=dict(t=60, b=60, l=60, r=60),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        showlegend=False,
+        autosize=True,
+    )
+
+    return fig
+
+
+st.markdown("""
+<h2 style='
+    text-align: center; 
+    color: #16425B; 
+    font-size: 20px; 
+    font-weight: 700; 
+    margin-top: 30px; 
+    margin-bottom: 0px; 
+    background-color: rgba(251, 251, 251, 1); 
+    padding: 20px 15px; 
+    border-radius: 15px;
+    box-shadow: 0 4px 8px rgba(0, 0, 0, 0.6);
+    '> Sensibilité de votre capital au rendement et aux frais
+</h2>
+""", unsafe_allow_html=True)
+
+# Toute la grille (50 rendements × 50 niveaux de frais) est calculée en un seul passage vectorisé,
+# et seulement quand les entrées du moteur changent
+@st.cache_data(show_spinner=False)
+def grille_sensibilite(entrees):
+    return moteur.grille_sensibilite(*entrees)
+
+grille = grille_sensibilite(entrees_moteur(params, objectifs))
+onglet_epargne, onglet_final = st.tabs([f"Fin de la phase d'épargne (année {grille.annee_fin_epargne})", "Fin de la simulation"])
+with onglet_epargne:
+    st.plotly_chart(create_sensitivity_heatmap(grille.rendements, grille.frais_gestion, grille.capital_fin_epargne, params["rendement_annuel"], params["frais_gestion"]), use_container_width=True, config={'displayModeBar': False}, key="sensibilite_epargne")
+with onglet_final:
+    st.plotly_chart(create_sensitivity_heatmap(grille.rendements, grille.frais_gestion, grille.capital_final, params["rendement_annuel"], params["frais_gestion"]), use_container_width=True, config={'displayModeBar': False}, key="sensibilite_finale")
+
+
+def create_backtest_chart(resultat, nombre_max_courbes=200):
+    fig = go.Figure()
+    annees = resultat.lot.annee
+    capital = resultat.lot.capital_fin
+    indice_pire = resultat.indice_pire
+
+    # Au-delà de quelques centaines de départs, un échantillon régulier suffit à montrer la dispersion
+    pas = max(1, len(resultat) // nombre_max_courbes)
+    for i in range(0, len(resultat), pas):
+        fig.add_trace(
+            go.Scatter(
+                x=annees,
+                y=capital[i],
+                mode='lines',
+                line=dict(color='rgba(141, 179, 197, 0.35)', width=1),
+                hovertemplate=f'Départ {resultat.debuts[i]}<br>Capital : <b>%{{y:,.0f}} €</b><extra></extra>',
+                showlegend=False
+            )
+        )
+
+    p5, p50, p95 = resultat.percentiles("capital_fin")
+    fig.add_trace(
+        go.Scatter(
+            x=annees,
+            y=p50,
+            name='Médiane',
+            mode='lines',
+            line=dict(color='#16425B', width=3, dash='dash'),
+            hovertemplate='Médiane<br>Capital : <b>%{y:,.0f} €</b><extra></extra>'
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=annees,
+            y=capital[indice_pire],
+            name=f'Pire départ ({resultat.debuts[indice_pire]})',
+            mode='lines',
+            line=dict(color='#CBA325', width=3),
+            hovertemplate=f'Pire départ ({resultat.debuts[indice_pire]})<br>Capital : <b>%{{y:,.0f}} €</b><extra></extra>'
+        )
+    )
+
+    fig.update_layout(
+        xaxis=dict(title="<b>Années de simulation</b>", showline=True, linewidth=3, linecolor='#CBA325'),
+        yaxis=dict(title="<b>Capital fin d'année (€)</b>", tickformat=",.0f", ticksuffix=" €", showline=True, linewidth=3, linecolor='#CBA325'),
+        font=dict(family="Inter", size=14),
+        margin=dict(t=60, b=60, l=60, r=60),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5),
+        hovermode="closest",
+        autosize=True,
+    )
+
+    return fig
+
+
+if serie_historique is not None:
+    st.markdown("""
+    <h2 style='
+        text-align: center; 
+        color: #16425B; 
+        font-size: 20px; 
+        font-weight: 700; 
+        margin-top: 30px; 
+        margin-bottom: 0px; 
+        background-color: rgba(251, 251, 251, 1); 
+        padding: 20px 15px; 
+        border-radius: 15px;
+        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.6);
+        '> Votre plan rejoué sur l'historique des marchés
+    </h2>
+    """, unsafe_allow_html=True)
+
+    try:
+        # Toutes les dates de départ de la série sont rejouées en un seul passage vectorisé
+        parametres, objectifs_plan, modifications, versements_libres = entrees_moteur(params, objectifs)
+        backtest = moteur.backtest_historique(parametres, objectifs_plan, modifications, versements_libres, serie=serie_historique)
+    except ValueError as e:
+        st.warning(str(e))
+    else:
+        capitaux_finaux = backtest.lot.serie_finale("capital_fin")
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Dates de départ testées", f"{len(backtest):,}".replace(",", " "))
+        col2.metric("Objectifs financés", f"{backtest.probabilite_financement * 100:.1f} %".replace(".", ","))
+        col3.metric("Pire départ", str(backtest.debuts[backtest.indice_pire]), help=f"Capital final : {format_currency(float(capitaux_finaux[backtest.indice_pire]))}")
+        st.plotly_chart(create_backtest_chart(backtest), use_container_width=True, config={'displayModeBar': False})
+
+
+def create_supports_chart(resultat):
+    fig = go.Figure()
+    annees = resultat.lot.annee
+    # Capital médian de chaque année ventilé selon l'allocation cible
+    capital = np.median(resultat.lot.capital_fin, axis=0)
+    repartition = np.broadcast_to(resultat.allocations, (len(resultat), len(annees), len(resultat.supports)))[0]
+    couleurs = ['#16425B', '#8DB3C5', '#CBA325']
+
+    for i, support in enumerate(resultat.supports):
+        fig.add_trace(
+            go.Scatter(
+                x=annees,
+                y=capital * repartition[:, i],
+                name=support.nom,
+                mode='lines',
+                stackgroup='supports',
+                line=dict(color=couleurs[i % len(couleurs)], width=1),
+                hovertemplate=f'{support.nom}<br>Capital : <b>%{{y:,.0f}} €</b><extra></extra>'
+            )
+        )
+
+    fig.update_layout(
+        xaxis=dict(title="<b>Années de simulation</b>", showline=True, linewidth=3, linecolor='#CBA325'),
+        yaxis=dict(title="<b>Capital fin d'année (€)</b>", tickformat=",.0f", ticksuffix=" €", showline=True, linewidth=3, linecolor='#CBA325'),
+        font=dict(family="Inter", size=14),
+        margin=dict(t=60, b=60, l=60, r=60),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5),
+        hovermode="x unified",
+        autosize=True,
+    )
+
+    return fig
+
+
+if gestion_pilotee is not None:
+    st.markdown("""
+    <h2 style='
+        text-align: center; 
+        color: #16425B; 
+        font-size: 20px; 
+        font-weight: 700; 
+        margin-top: 30px; 
+        margin-bottom: 0px; 
+        background-color: rgba(251, 251, 251, 1); 
+        padding: 20px 15px; 
+        border-radius: 15px;
+        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.6);
+        '> Votre contrat en gestion pilotée
+    </h2>
+    """, unsafe_allow_html=True)
+
+    supports, repartition, horizon, rebalancement = gestion_pilotee
+    parametres, objectifs_plan, modifications, versements_libres = entrees_moteur(params, objectifs)
+    allocations = moteur.allocations_pilotees(objectifs_plan, calculer_duree_totale(objectifs), repartition, horizon=horizon)
+    # En mode Monte Carlo, la loi choisie fixe la forme des chocs, chaque support gardant sa volatilité
+    loi, nombre_chemins = (monte_carlo[0], monte_carlo[1] or 10_000) if monte_carlo is not None else (None, 1)
+    pilotee = moteur.simuler_supports(parametres, objectifs_plan, modifications, versements_libres, supports, allocations,
+                                      rebalancement=rebalancement, loi=loi, nombre_chemins=nombre_chemins)
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Capital final (médian)" if loi is not None else "Capital final", format_currency(float(np.median(pilotee.lot.capital_fin[:, -1]))))
+    col2.metric("Part finale en fonds euros", format_percentage(allocations[-1, 0] * 100))
+    col3.metric("Objectifs financés", f"{pilotee.probabilite_financement * 100:.1f} %".replace(".", ","))
+    st.plotly_chart(create_supports_chart(pilotee), use_container_width=True, config={'displayModeBar': False})
+
+
+def create_foyer_chart(resultat):
+    fig = go.Figure()
+    couleurs = ['#16425B', '#8DB3C5', '#CBA325', '#2E7D32', '#7B1FA2', '#EF6C00', '#5D4037', '#00838F', '#C2185B', '#9E9D24']
+
+    for k, capital in enumerate(resultat.lot.capital_fin):
+        fig.add_trace(
+            go.Scatter(
+                x=resultat.lot.annee,
+                y=capital,
+                name=f'Contrat {k + 1}',
+                mode='lines',
+                stackgroup='contrats',
+                line=dict(color=couleurs[k % len(couleurs)], width=1),
+                hovertemplate=f'Contrat {k + 1}<br>Capital : <b>%{{y:,.0f}} €</b><extra></extra>'
+            )
+        )
+
+    fig.update_layout(
+        xaxis=dict(title="<b>Années de simulation</b>", showline=True, linewidth=3, linecolor='#CBA325'),
+        yaxis=dict(title="<b>Capital fin d'année (€)</b>", tickformat=",.0f", ticksuffix=" €", showline=True, linewidth=3, linecolor='#CBA325'),
+        font=dict(family="Inter", size=14),
+        margin=dict(t=60, b=60, l=60, r=60),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5),
+        hovermode="x unified",
+        autosize=True,
+    )
+
+    return fig
+
+
+if foyer is not None:
+    st.markdown("""
+    <h2 style='
+        text-align: center; 
+        color: #16425B; 
+        font-size: 20px; 
+        font-weight: 700; 
+        margin-top: 30px; 
+        margin-bottom: 0px; 
+        background-color: rgba(251, 251, 251, 1); 
+        padding: 20px 15px; 
+        border-radius: 15px;
+        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.6);
+        '> Vos objectifs financés par tous les contrats du foyer
+    </h2>
+    """, unsafe_allow_html=True)
+
+    autres_contrats, repartition = foyer
+    parametres, objectifs_plan, modifications, versements_libres = entrees_moteur(params, objectifs)
+    # Le contrat saisi plus haut est le contrat 1 ; l'abattement choisi (seul ou couple) vaut pour tout le foyer
+    resultat_foyer = moteur.simuler_foyer([moteur.Contrat(parametres, modifications, versements_libres), *autres_contrats],
+                                          objectifs_plan, abattement=params["abattement"], repartition=repartition)
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Capital final du foyer", format_currency(float(resultat_foyer.lot.capital_fin[:, -1].sum())))
+    col2.metric("Fiscalité totale des rachats", format_currency(float(resultat_foyer.fiscalite.sum())))
+    col3.metric("Objectifs financés", "Oui" if resultat_foyer.finance else "Non")
+    st.plotly_chart(create_foyer_chart(resultat_foyer), use_container_width=True, config={'displayModeBar': False})
+    with st.expander("Détail annuel du foyer"):
+        foyer_df = resultat_foyer.vers_dataframe().set_index("Année")
+        st.dataframe(foyer_df.style.format(format_currency), use_container_width=True)
 
 
 
@@ -672,16 +1162,7 @@ import streamlit as st
 
 def create_waterfall_chart(df: pd.DataFrame):
     # Traitement des données
-    def safe_float(value):
-        if pd.isna(value):
-            return 0.0
-        if isinstance(value, (int, float)):
-            return float(value)
-        if isinstance(value, str):
-            return float(value.replace(' €', '').replace(',', '.'))
-        return 0.0
-
-    capital_fin_annee = df['Capital fin d\'année (NET)'].apply(safe_float)
+    capital_fin_annee = df['Capital fin d\'année (NET)']
     yearly_change = capital_fin_annee.diff()
     yearly_change = yearly_change.fillna(capital_fin_annee.iloc[0])
     final_capital = capital_fin_annee.iloc[-1]
@@ -795,6 +1276,58 @@ st.markdown(title, unsafe_allow_html=True)
 st.plotly_chart(create_waterfall_chart(resultats_df), use_container_width=True, config={'displayModeBar': False})
 
 
+def create_attribution_chart(attribution):
+    fig = go.Figure()
+    libelles = list(moteur.POSTES.values())
+    # Pour chaque poste : le montant prélevé, puis ce qu'il aurait rapporté s'il était resté investi
+    for nom, valeurs, couleur in [("Coût direct", attribution.montants, '#16425B'),
+                                  ("Coût de la capitalisation", attribution.capitalisation, '#CBA325')]:
+        fig.add_trace(
+            go.Bar(
+                x=libelles,
+                y=valeurs,
+                name=nom,
+                marker_color=couleur,
+                hovertemplate=f'%{{x}}<br>{nom} : <b>%{{y:,.0f}} €</b><extra></extra>'
+            )
+        )
+
+    fig.update_layout(
+        barmode='stack',
+        xaxis=dict(showline=True, linewidth=3, linecolor='#CBA325'),
+        yaxis=dict(title="<b>Coût à la dernière année (€)</b>", tickformat=",.0f", ticksuffix=" €", showline=True, linewidth=3, linecolor='#CBA325'),
+        font=dict(family="Inter", size=14),
+        margin=dict(t=60, b=60, l=60, r=60),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5),
+        autosize=True,
+    )
+
+    return fig
+
+
+st.markdown("""
+<h2 style='
+    text-align: center; 
+    color: #16425B; 
+    font-size: 20px; 
+    font-weight: 700; 
+    margin-top: 30px; 
+    margin-bottom: 0px; 
+    background-color: rgba(251, 251, 251, 1); 
+    padding: 20px 15px; 
+    border-radius: 15px;
+    box-shadow: 0 4px 8px rgba(0, 0, 0, 0.6);
+    '> Ce que vous coûtent les frais et la fiscalité
+</h2>
+""", unsafe_allow_html=True)
+st.plotly_chart(create_attribution_chart(attribution), use_container_width=True, config={'displayModeBar': False})
+st.caption(f"Sans frais d'entrée ni frais de gestion, votre capital final serait de {format_currency(attribution.capital_brut)} "
+           f"au lieu de {format_currency(attribution.capital_final)}. La fiscalité réduit vos rachats nets "
+           f"de {format_currency(attribution.montants[-1])}, et de {format_currency(attribution.cout_total[-1])} avec ce qu'elle aurait rapporté.")
+
+
 
 import pandas as pd
 import plotly.graph_objs as go
@@ -825,24 +1358,9 @@ def create_donut_chart(df: pd.DataFrame, duree_capi_max: int, objectifs=None, ch
     # Trouver l'année correspondant à duree_capi_max
     target_year = df.loc[duree_capi_max] if duree_capi_max in df.index else df.iloc[-1]
 
-    # Fonction pour convertir en float de manière sûre
-    def safe_float(value):
-        if pd.isna(value):
-            return 0.0
-        if isinstance(value, (int, float)):
-            return float(value)
-        if isinstance(value, str):
-            try:
-                return float(value.replace(' €', '').replace(',', '.').replace('%', ''))
-            except ValueError:
-                st.warning(f"Impossible de convertir la valeur '{value}' en nombre. Utilisation de 0.")
-                return 0.0
-        st.warning(f"Type de données inattendu: {type(value)}. Utilisation de 0.")
-        return 0.0
-
     # Calculer les valeurs nécessaires
-    capital_final = safe_float(target_year.get('Capital fin d\'année (NET)', 0))
-    pourcentage_plus_value = safe_float(target_year.get('%', 0)) / 100
+    capital_final = float(target_year.get('Capital fin d\'année (NET)', 0))
+    pourcentage_plus_value = float(target_year.get('%', 0)) / 100
     plus_values = capital_final * pourcentage_plus_value
     versements = capital_final - plus_values
 
@@ -958,24 +1476,9 @@ def create_donut_chart2(df: pd.DataFrame, objectifs=None, chart_id="donut_chart_
     # Utiliser la dernière ligne du DataFrame
     target_year = df.iloc[-1]
 
-    # Fonction pour convertir en float de manière sûre
-    def safe_float(value):
-        if pd.isna(value):
-            return 0.0
-        if isinstance(value, (int, float)):
-            return float(value)
-        if isinstance(value, str):
-            try:
-                return float(value.replace(' €', '').replace(',', '.').replace('%', ''))
-            except ValueError:
-                st.warning(f"Impossible de convertir la valeur '{value}' en nombre. Utilisation de 0.")
-                return 0.0
-        st.warning(f"Type de données inattendu: {type(value)}. Utilisation de 0.")
-        return 0.0
-
     # Calculer les valeurs nécessaires
-    capital_final = safe_float(target_year.get('Capital fin d\'année (NET)', 0))
-    pourcentage_plus_value = safe_float(target_year.get('%', 0)) / 100
+    capital_final = float(target_year.get('Capital fin d\'année (NET)', 0))
+    pourcentage_plus_value = float(target_year.get('%', 0)) / 100
     plus_values = capital_final * pourcentage_plus_value
     versements = capital_final - plus_values
 
@@ -1421,7 +1924,7 @@ class PDF(FPDF):
         headers = ['Année', 'Capital au 01/01', 'Versements', 'Rendement', 'Frais', 'Rachat', 'Fiscalité', 'Rachat net', 'Capital au 31/12']
         
         data = [
-            [row['Année'], 
+            [int(row['Année']), 
              format_value(row['Capital initial (NET)']),
              format_value(row['VP NET']),
              format_value(row['Rendement']),
@@ -1479,7 +1982,117 @@ class PDF(FPDF):
 
     
 
-    def add_simulation_parameters(self, params, resultats_df, objectifs):
+    def add_comparaison_enveloppes(self, comparaison):
+        self.set_section("Comparaison des enveloppes")
+        self.add_page()
+
+        left_margin = 20
+        right_margin = 15
+        self.set_left_margin(left_margin)
+        self.set_right_margin(right_margin)
+        effective_width = self.w - left_margin - right_margin
+
+        self.set_font_safe('Inter', 'B', 18)
+        self.set_text_color(22, 66, 91)
+        self.cell(effective_width, 10, 'Votre plan dans chaque enveloppe', 0, 1, 'L')
+        self.ln(5)
+
+        self.set_font_safe('Inter', '', 10)
+        self.set_text_color(32, 32, 33)
+        self.multi_cell(effective_width, 5, "Les mêmes versements et rachats sont simulés avec les frais, la fiscalité et les règles de blocage propres à chaque enveloppe. Le capital net d'impôt suppose un rachat total la dernière année.")
+        self.ln(5)
+
+        col_widths = [30, 30, 30, 30, 30, 22]
+        headers = ['Enveloppe', 'Capital final', 'Net d\'impôt', 'Rachats nets', 'Fiscalité', 'Financés']
+        synthese = comparaison.vers_dataframe()
+
+        self.set_font_safe('Inter', 'B', 9)
+        self.set_fill_color(22, 66, 91)
+        self.set_text_color(251, 251, 251)
+        self.set_draw_color(203, 163, 37)
+        self.set_line_width(0.4)
+        self.set_x((self.w - sum(col_widths)) / 2)
+        for header, width in zip(headers, col_widths):
+            self.cell(width, 10, header, 1, 0, 'C', 1)
+        self.ln()
+
+        self.set_font_safe('Inter', '', 9)
+        self.set_text_color(60, 60, 60)
+        for i, row in synthese.iterrows():
+            self.set_fill_color(*((251, 251, 251) if i % 2 == 0 else (209, 225, 232)))
+            self.set_x((self.w - sum(col_widths)) / 2)
+            valeurs = [row['Enveloppe'],
+                       format_value(row['Capital final']),
+                       format_value(row["Capital final net d'impôt"]),
+                       format_value(row['Rachats nets perçus']),
+                       format_value(row['Fiscalité des rachats']),
+                       'Oui' if row['Objectifs financés'] else 'Non']
+            for j, (valeur, width) in enumerate(zip(valeurs, col_widths)):
+                self.cell(width, 8, str(valeur), 1, 0, 'L' if j == 0 else 'R', 1)
+            self.ln()
+
+
+    def add_attribution_frais(self, attribution):
+        self.set_section("Coût des frais et de la fiscalité")
+        self.add_page()
+
+        left_margin = 20
+        right_margin = 15
+        self.set_left_margin(left_margin)
+        self.set_right_margin(right_margin)
+        effective_width = self.w - left_margin - right_margin
+
+        self.set_font_safe('Inter', 'B', 18)
+        self.set_text_color(22, 66, 91)
+        self.cell(effective_width, 10, 'Ce que vous coûtent les frais et la fiscalité', 0, 1, 'L')
+        self.ln(5)
+
+        self.set_font_safe('Inter', '', 10)
+        self.set_text_color(32, 32, 33)
+        self.multi_cell(effective_width, 5, f"Sans frais d'entrée ni frais de gestion, votre capital final serait de {format_value(attribution.capital_brut)} € au lieu de {format_value(attribution.capital_final)} €. Chaque coût est compté avec ce qu'il aurait rapporté jusqu'à la dernière année s'il était resté investi au rendement brut du contrat.")
+        self.ln(5)
+
+        col_widths = [50, 40, 40, 40]
+        headers = ['Poste', 'Coût direct', 'Capitalisation', 'Coût total']
+
+        self.set_font_safe('Inter', 'B', 9)
+        self.set_fill_color(22, 66, 91)
+        self.set_text_color(251, 251, 251)
+        self.set_draw_color(203, 163, 37)
+        self.set_line_width(0.4)
+        self.set_x((self.w - sum(col_widths)) / 2)
+        for header, width in zip(headers, col_widths):
+            self.cell(width, 10, header, 1, 0, 'C', 1)
+        self.ln()
+
+        self.set_font_safe('Inter', '', 9)
+        self.set_text_color(60, 60, 60)
+        for i, libelle in enumerate(moteur.POSTES.values()):
+            self.set_fill_color(*((251, 251, 251) if i % 2 == 0 else (209, 225, 232)))
+            self.set_x((self.w - sum(col_widths)) / 2)
+            valeurs = [libelle,
+                       format_value(attribution.montants[i]),
+                       format_value(attribution.capitalisation[i]),
+                       format_value(attribution.cout_total[i])]
+            for j, (valeur, width) in enumerate(zip(valeurs, col_widths)):
+                self.cell(width, 8, str(valeur), 1, 0, 'L' if j == 0 else 'R', 1)
+            self.ln()
+        self.ln(5)
+
+        try:
+            chart_buffer = fig_to_img_buffer(create_attribution_chart(attribution))
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
+                temp_filename = temp_file.name
+                temp_file.write(chart_buffer.getvalue())
+            self.image(temp_filename, x=left_margin, y=self.get_y(), w=effective_width, h=100)
+            os.unlink(temp_filename)
+        except Exception as e:
+            print(f"Erreur détaillée lors de la création du graphique des coûts : {e}")
+            self.set_font_safe('Inter', '', 10)
+            self.multi_cell(effective_width, 10, f"Erreur lors de la création du graphique : {str(e)}", 0, 'C')
+
+
+    def add_simulation_parameters(self, params, resultats_df, objectifs, bandes=None, comparaison=None):
         self.set_section("Paramètres de simulation")
         self.add_page()
         
@@ -1554,14 +2167,9 @@ class PDF(FPDF):
                 return df[column].iloc[-1] if not df.empty and column in df.columns else 0
         
         duree_capi_max = self.calculer_duree_capi_max(objectifs, resultats_df)
-        capital_fin_annee_duree_capi_max = parse_value(get_value_safely(resultats_df, duree_capi_max, 'Capital fin d\'année (NET)'))
-        capital_fin_annee_derniere_ligne = parse_value(resultats_df['Capital fin d\'année (NET)'].iloc[-1] if not resultats_df.empty else 0)
-        epargne_investie = parse_value(get_value_safely(resultats_df, duree_capi_max, 'Épargne investie'))
-        
-        # Assurez-vous que toutes les valeurs sont des nombres
-        capital_fin_annee_duree_capi_max = float(capital_fin_annee_duree_capi_max)
-        capital_fin_annee_derniere_ligne = float(capital_fin_annee_derniere_ligne)
-        epargne_investie = float(epargne_investie)
+        capital_fin_annee_duree_capi_max = float(get_value_safely(resultats_df, duree_capi_max, 'Capital fin d\'année (NET)'))
+        capital_fin_annee_derniere_ligne = float(resultats_df['Capital fin d\'année (NET)'].iloc[-1] if not resultats_df.empty else 0)
+        epargne_investie = float(get_value_safely(resultats_df, duree_capi_max, 'Épargne investie'))
         
         # Affichage des valeurs
         self.set_font_safe('Inter', 'B', 10)
@@ -1630,7 +2238,7 @@ class PDF(FPDF):
         financial_chart_y = self.get_y()
     
         try:
-            financial_chart = create_financial_chart(resultats_df)
+            financial_chart = create_financial_chart(resultats_df, bandes, comparaison)
             financial_chart_buffer = fig_to_img_buffer(financial_chart)
             
             with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
@@ -1729,16 +2337,6 @@ class PDF(FPDF):
             # Si la police n'est pas trouvée, utilisez une police par défaut
             self.set_font('Arial', style, size)
     
-    def clean_and_convert(self, value):
-        if isinstance(value, str):
-            cleaned = value.replace('€', '').replace(' ', '').replace(',', '.')
-            try:
-                return float(cleaned)
-            except ValueError:
-                print(f"Impossible de convertir la valeur: {value}")
-                return value
-        return value
-    
     def calculer_duree_capi_max(self, objectifs, resultats_df):
         if not objectifs:
             return resultats_df['Année'].max() if not resultats_df.empty else 0
@@ -1747,30 +2345,13 @@ class PDF(FPDF):
         
 
 
-import re
-
-def parse_value(value):
-    if isinstance(value, (int, float)):
-        return value
-    if isinstance(value, str):
-        # Supprimer le symbole € et les espaces
-        value = value.replace('€', '').replace(' ', '').strip()
-        # Remplacer la virgule par un point pour la décimale
-        value = value.replace(',', '.')
-        # Utiliser une expression régulière pour extraire le nombre
-        match = re.search(r'-?\d+\.?\d*', value)
-        if match:
-            return float(match.group())
-    return 0
-
 def format_value(value):
-    value = parse_value(value)
-    if isinstance(value, (int, float)):
+    if isinstance(value, (int, float, np.number)):
         return f"{value:,.2f}".replace(",", " ").replace(".", ",")
     return str(value)
 
 
-def generate_pdf_report(resultats_df, params, objectives):
+def generate_pdf_report(resultats_df, params, objectives, bandes=None, comparaison=None, attribution=None):
     data = [
         ["Paramètre", "Valeur"],
         ["Capital initial", f"{params['capital_initial']} €"],
@@ -1788,14 +2369,14 @@ def generate_pdf_report(resultats_df, params, objectives):
         ])
 
     # Générer les graphiques
-    img_buffer1 = fig_to_img_buffer(create_financial_chart(resultats_df))
+    img_buffer1 = fig_to_img_buffer(create_financial_chart(resultats_df, bandes, comparaison))
     img_buffer2 = fig_to_img_buffer(create_waterfall_chart(resultats_df))
     img_buffer3 = fig_to_img_buffer(create_donut_chart(resultats_df, duree_capi_max))
     img_buffer4 = fig_to_img_buffer(create_donut_chart2(resultats_df))
     
     
     # Créer le PDF
-    pdf_bytes = create_pdf(data, [img_buffer1, img_buffer2, img_buffer3, img_buffer4], resultats_df, params, objectives)
+    pdf_bytes = create_pdf(data, [img_buffer1, img_buffer2, img_buffer3, img_buffer4], resultats_df, params, objectives, bandes, comparaison, attribution)
     
     return pdf_bytes
 
@@ -1804,7 +2385,7 @@ def generate_pdf_report(resultats_df, params, objectives):
 
 
 
-def create_pdf(data, img_buffers, resultats_df, params, objectives):
+def create_pdf(data, img_buffers, resultats_df, params, objectives, bandes=None, comparaison=None, attribution=None):
     pdf = PDF()
     pdf.set_auto_page_break(auto=True, margin=20)
 
@@ -1836,10 +2417,17 @@ def create_pdf(data, img_buffers, resultats_df, params, objectives):
     pdf.add_objectives_section(objectives)
 
 
-    # Génération des résultats
-    resultats_df = optimiser_objectifs(params, objectifs)
+    # Résultats tels qu'affichés dans l'application (l'année y sert d'index)
+    if 'Année' not in resultats_df.columns:
+        resultats_df = resultats_df.reset_index()
     # Appel de la méthode avec les arguments requis
-    pdf.add_simulation_parameters(params, resultats_df, objectives)
+    pdf.add_simulation_parameters(params, resultats_df, objectives, bandes, comparaison)
+
+    if comparaison is not None:
+        pdf.add_comparaison_enveloppes(comparaison)
+
+    if attribution is not None:
+        pdf.add_attribution_frais(attribution)
 
     
     
@@ -1862,7 +2450,7 @@ def main():
     # Exemple de bouton pour générer le PDF
     if st.button("Générer le rapport PDF"):
         try:
-            pdf_bytes = generate_pdf_report(resultats_df, params, st.session_state.objectifs)
+            pdf_bytes = generate_pdf_report(resultats_df, params, st.session_state.objectifs, bandes, comparaison, attribution)
             
             # Créer un lien de téléchargement pour le PDF
             b64 = base64.b64encode(pdf_bytes).decode()